@@ -125,6 +125,7 @@ class WorkerAdmin(admin.ModelAdmin):
         'api_key',
         'enqueue_is_enabled',
         'ping_response',
+        'ping_rtt',
         'worker_version',
         'concurrent_jobs',
     )
@@ -175,6 +176,15 @@ class WorkerAdmin(admin.ModelAdmin):
     ping_response.allow_tags = True
     ping_response.short_description = 'Last ping response'
 
+    def ping_rtt(self, obj):
+        ping_rtt = obj.get_ping_rtt()
+
+        if ping_rtt is None:
+            return '(none)'
+        return '{0} ms'.format(ping_rtt)
+
+    ping_rtt.short_description = 'Ping RTT'
+
 
 class WorkerPoolAdmin(admin.ModelAdmin):
     """
@@ -271,6 +281,7 @@ class JobAdmin(PermissionAdminMixin, admin.ModelAdmin):
                 'disable_enqueue_after_fails',
                 'reschedule_interval',
                 'reschedule_interval_type',
+                'reschedule_cron_expression',
             ),
         }),
     )
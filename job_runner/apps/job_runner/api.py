@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.contrib.auth.models import Group
 from tastypie import fields
 from tastypie.authentication import MultiAuthentication, SessionAuthentication
+from tastypie.cache import SimpleCache
 from tastypie.constants import ALL, ALL_WITH_RELATIONS
 from tastypie.resources import ModelResource
 
@@ -16,6 +18,7 @@ from job_runner.apps.job_runner.models import (
     Worker,
     WorkerPool,
 )
+from job_runner.apps.job_runner.pagination import KeysetPaginator
 
 
 class NoRelatedSaveMixin(object):
@@ -89,6 +92,7 @@ class ProjectResource(ModelResource):
         authorization = ModelAuthorization(
             api_key_path='worker_pools__workers__api_key',
             user_groups_path='groups',
+            project_path='',
         )
 
 
@@ -139,6 +143,19 @@ class WorkerResource(ModelResource):
     """
     RESTful resource for workers.
     """
+    ping_request_seq = fields.IntegerField(
+        attribute='ping_request_seq', readonly=True)
+    ping_request_dts = fields.DateTimeField(
+        attribute='ping_request_dts', null=True, readonly=True)
+    ping_rtt_history = fields.ListField(readonly=True)
+    ping_rtt = fields.IntegerField(null=True, readonly=True)
+
+    def dehydrate_ping_rtt_history(self, bundle):
+        return bundle.obj.get_ping_rtt_history()
+
+    def dehydrate_ping_rtt(self, bundle):
+        return bundle.obj.get_ping_rtt()
+
     def build_filters(self, filters=None):
         if filters is None:
             filters = {}
@@ -163,6 +180,7 @@ class WorkerResource(ModelResource):
             'description',
             'enqueue_is_enabled',
             'ping_response_dts',
+            'ping_response_seq',
             'worker_version',
             'concurrent_jobs',
         ]
@@ -214,6 +232,7 @@ class JobTemplateResource(ModelResource):
         authorization = ModelAuthorization(
             api_key_path='project__worker_pools__workers__api_key',
             user_groups_path='project__groups',
+            project_path='project',
         )
 
 
@@ -229,6 +248,11 @@ class JobResource(NoRelatedSaveMixin, ModelResource):
     parent = fields.ToOneField('self', 'parent', null=True)
     children = fields.ToManyField('self', 'children', null=True)
 
+    script_content = fields.CharField(readonly=True)
+
+    def dehydrate_script_content(self, bundle):
+        return bundle.obj.get_script_content()
+
     def build_filters(self, filters=None):
         if filters is None:
             filters = {}
@@ -242,7 +266,7 @@ class JobResource(NoRelatedSaveMixin, ModelResource):
         return orm_filters
 
     class Meta:
-        queryset = Job.objects.all()
+        queryset = Job.objects.select_related('job_template')
         resource_name = 'job'
         detail_allowed_methods = ['get', 'put', 'patch']
         list_allowed_methods = ['get', 'post']
@@ -255,6 +279,7 @@ class JobResource(NoRelatedSaveMixin, ModelResource):
             'enqueue_is_enabled',
             'reschedule_interval',
             'reschedule_interval_type',
+            'reschedule_cron_expression',
             'run_on_all_workers',
             'schedule_children_on_error',
             'notification_addresses',
@@ -273,6 +298,7 @@ class JobResource(NoRelatedSaveMixin, ModelResource):
                 'job_template__project__worker_pools__workers__api_key'),
             user_groups_path='job_template__project__groups',
             auth_user_groups_path='job_template__project__auth_groups',
+            project_path='job_template__project',
         )
 
 
@@ -301,6 +327,7 @@ class RunResource(NoRelatedSaveMixin, ModelResource):
         resource_name = 'run'
         detail_allowed_methods = ['get', 'patch']
         list_allowed_methods = ['get', 'post']
+        paginator_class = KeysetPaginator
         filtering = {
             'schedule_dts': ALL,
             'is_manual': ALL,
@@ -316,8 +343,12 @@ class RunResource(NoRelatedSaveMixin, ModelResource):
                 'job__job_template__project__worker_pools__workers__api_key'),
             user_groups_path='job__job_template__project__groups',
             auth_user_groups_path='job__job_template__project__auth_groups',
+            project_path='job__job_template__project',
         )
 
+    def dehydrate_schedule_id(self, bundle):
+        return bundle.obj.get_schedule_id()
+
     def build_filters(self, filters=None):
         if filters is None:
             filters = {}
@@ -356,15 +387,13 @@ class RunResource(NoRelatedSaveMixin, ModelResource):
         }
 
         if 'state' in filters and filters['state'] == 'last_completed':
-            jobs = Job.objects.all()
-            last_completed_schedule_ids = [
-                job.last_completed_schedule_id for job in jobs]
+            last_completed_runs = Run.objects.last_completed()
+            if 'project_id' in filters:
+                last_completed_runs = last_completed_runs.filter(
+                    job__job_template__project__id=filters['project_id'])
 
             state_filters['last_completed'] = {
-                'enqueue_dts__isnull': False,
-                'start_dts__isnull': False,
-                'return_dts__isnull': False,
-                'schedule_id__in': last_completed_schedule_ids
+                'pk__in': last_completed_runs.values('pk'),
             }
 
         if 'state' in filters and filters['state'] in state_filters:
@@ -378,6 +407,33 @@ class RunResource(NoRelatedSaveMixin, ModelResource):
         return orm_filters
 
 
+class LastCompletedRunResource(RunResource):
+    """
+    Read-only RESTful resource for the last completed runs of each job.
+
+    The response can be cached by the client for
+    :data:`JOB_RUNNER_LAST_COMPLETED_RUN_CACHE_TIMEOUT` seconds.
+
+    """
+    class Meta(RunResource.Meta):
+        queryset = Run.objects.last_completed()
+        resource_name = 'last_completed_run'
+        detail_allowed_methods = []
+        list_allowed_methods = ['get']
+        cache = SimpleCache(
+            timeout=settings.JOB_RUNNER_LAST_COMPLETED_RUN_CACHE_TIMEOUT,
+            private=True,
+        )
+
+    def dehydrate_resource_uri(self, bundle):
+        """
+        Return the URI of the run in :class:`.RunResource`.
+        """
+        kwargs = self.resource_uri_kwargs(bundle)
+        kwargs['resource_name'] = RunResource._meta.resource_name
+        return self._build_reverse_url('api_dispatch_detail', kwargs=kwargs)
+
+
 class KillRequestResource(NoRelatedSaveMixin, ModelResource):
     """
     RESTful resource for kill requests.
@@ -399,6 +455,8 @@ class KillRequestResource(NoRelatedSaveMixin, ModelResource):
             user_groups_path='run__job__job_template__project__groups',
             auth_user_groups_path=(
                 'run__job__job_template__project__auth_groups'),
+            project_path='run__job__job_template__project',
+            worker_pool_path='run__job__worker_pool',
         )
 
 
@@ -410,10 +468,12 @@ class RunLogResource(NoRelatedSaveMixin, ModelResource):
         'job_runner.apps.job_runner.api.RunResource', 'run')
 
     class Meta:
-        queryset = RunLog.objects.all()
+        # ordered on the log itself, so it can be paginated by keyset
+        queryset = RunLog.objects.order_by('-pk')
         resource_name = 'run_log'
         list_allowed_methods = ['get', 'post']
         detail_allowed_methods = ['get', 'patch']
+        paginator_class = KeysetPaginator
 
         authentication = MultiAuthentication(
             SessionAuthentication(), HmacAuthentication())
@@ -423,4 +483,6 @@ class RunLogResource(NoRelatedSaveMixin, ModelResource):
             user_groups_path='run__job__job_template__project__groups',
             auth_user_groups_path=(
                 'run__job__job_template__project__auth_groups'),
+            project_path='run__job__job_template__project',
+            worker_pool_path='run__job__worker_pool',
         )
@@ -6,6 +6,7 @@ from job_runner.apps.job_runner.api import (
     JobResource,
     JobTemplateResource,
     KillRequestResource,
+    LastCompletedRunResource,
     ProjectResource,
     RunLogResource,
     RunResource,
@@ -19,6 +20,7 @@ v1_api.register(GroupResource()),
 v1_api.register(JobResource())
 v1_api.register(JobTemplateResource())
 v1_api.register(KillRequestResource())
+v1_api.register(LastCompletedRunResource())
 v1_api.register(ProjectResource())
 v1_api.register(RunLogResource())
 v1_api.register(RunResource())
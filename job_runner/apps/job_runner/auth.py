@@ -1,16 +1,158 @@
 import hashlib
 import hmac
+import itertools
 import re
 import logging
+import threading
+import time
 
-from django.db.models import Q
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.db.models import Q, signals
+from django.utils.crypto import constant_time_compare
 from tastypie.authentication import Authentication
 from tastypie.authorization import Authorization
 
-from job_runner.apps.job_runner.models import Worker
+from job_runner.apps.job_runner.models import Project, Worker, WorkerPool
 
 logger = logging.getLogger(__name__)
 
+AUTH_HEADER_RE = re.compile(r'^ApiKey (.*?):(.*?)$')
+"""
+Regular expression matching the ``Authorization`` header of a worker.
+"""
+
+
+class LRUCache(object):
+    """
+    LRU cache with a time-to-live.
+
+    :param max_size:
+        The max. number of entries to cache.
+
+    :param ttl:
+        The number of seconds to cache an entry.
+
+    """
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.RLock()
+        self._counter = itertools.count()
+
+    def get(self, key):
+        """
+        Return the value for ``key``, or ``None`` when not cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if not entry:
+                return None
+
+            if entry[0] < time.time():
+                self._remove(key)
+                return None
+
+            entry[1] = self._counter.next()
+            return entry[2]
+
+    def set(self, key, value):
+        """
+        Cache the ``value`` for ``key``.
+
+        When the cache is full, the least recently used entry is removed.
+
+        """
+        with self._lock:
+            if (key not in self._entries and
+                    len(self._entries) >= self.max_size):
+                lru_key = min(self._entries, key=lambda k: self._entries[k][1])
+                self._remove(lru_key)
+
+            self._entries[key] = [
+                time.time() + self.ttl,
+                self._counter.next(),
+                value,
+            ]
+
+    def clear(self):
+        """
+        Remove all cached entries.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def _remove(self, key):
+        """
+        Remove the entry for ``key``, the lock must be held by the caller.
+        """
+        return self._entries.pop(key)
+
+
+class CredentialCache(LRUCache):
+    """
+    LRU cache of the worker credentials, with a time-to-live.
+
+    Maps the API-key of a worker to a ``tuple`` ``(worker_id, secret)``.
+
+    :param max_size:
+        The max. number of credentials to cache.
+
+    :param ttl:
+        The number of seconds to cache the credentials.
+
+    """
+    def __init__(self, max_size, ttl):
+        super(CredentialCache, self).__init__(max_size, ttl)
+        self._worker_api_keys = {}
+
+    def set(self, api_key, worker_id, secret):
+        """
+        Cache the credentials for ``api_key``.
+
+        When the cache is full, the least recently used credentials are
+        removed.
+
+        """
+        with self._lock:
+            super(CredentialCache, self).set(api_key, (worker_id, secret))
+            self._worker_api_keys[worker_id] = api_key
+
+    def invalidate(self, worker_id):
+        """
+        Remove the cached credentials of the worker with id ``worker_id``.
+        """
+        with self._lock:
+            api_key = self._worker_api_keys.get(worker_id)
+            if api_key is not None:
+                self._remove(api_key)
+
+    def clear(self):
+        """
+        Remove all cached credentials.
+        """
+        with self._lock:
+            super(CredentialCache, self).clear()
+            self._worker_api_keys.clear()
+
+    def _remove(self, api_key):
+        entry = super(CredentialCache, self)._remove(api_key)
+        worker_id = entry[2][0]
+        if self._worker_api_keys.get(worker_id) == api_key:
+            del self._worker_api_keys[worker_id]
+        return entry
+
+
+credential_cache = CredentialCache(
+    settings.JOB_RUNNER_API_KEY_CACHE_SIZE,
+    settings.JOB_RUNNER_API_KEY_CACHE_TTL,
+)
+"""
+The :class:`CredentialCache` used by :func:`validate_hmac`.
+"""
+
 
 def validate_hmac(request):
     """
@@ -37,17 +179,24 @@ def validate_hmac(request):
 
     """
     auth_header = request.META.get('HTTP_AUTHORIZATION', '')
-    api_key_match = re.match(r'^ApiKey (.*?):(.*?)$', auth_header)
+    api_key_match = AUTH_HEADER_RE.match(auth_header)
 
     if not api_key_match:
         logger.error('api key mismatch')
         return False
 
-    try:
-        worker = Worker.objects.get(api_key=api_key_match.group(1))
-    except Worker.DoesNotExist:
-        logger.error('worker does not exist')
-        return False
+    api_key = api_key_match.group(1)
+    credentials = credential_cache.get(api_key)
+
+    if credentials is None:
+        try:
+            worker = Worker.objects.get(api_key=api_key)
+        except Worker.DoesNotExist:
+            logger.error('worker does not exist')
+            return False
+
+        credentials = (worker.pk, worker.secret)
+        credential_cache.set(api_key, *credentials)
 
     hmac_message = '{request_method}{full_path}{request_body}'.format(
         request_method=request.method,
@@ -56,9 +205,10 @@ def validate_hmac(request):
     )
 
     expected_hmac = hmac.new(
-        str(worker.secret), hmac_message, hashlib.sha1)
+        str(credentials[1]), hmac_message, hashlib.sha1)
 
-    if expected_hmac.hexdigest() == api_key_match.group(2):
+    if constant_time_compare(
+            expected_hmac.hexdigest(), api_key_match.group(2)):
         return True
 
     logger.error('hmac mismatch')
@@ -66,6 +216,81 @@ def validate_hmac(request):
     return False
 
 
+scope_cache = LRUCache(
+    settings.JOB_RUNNER_AUTH_SCOPE_CACHE_SIZE,
+    settings.JOB_RUNNER_AUTH_SCOPE_CACHE_TTL,
+)
+"""
+The :class:`LRUCache` used for the authorization scopes of the workers and
+users.
+"""
+
+
+def _get_cached_scope(key, resolve):
+    """
+    Return the authorization scope for ``key``, resolved by ``resolve``.
+
+    The scopes are cached for ``JOB_RUNNER_AUTH_SCOPE_CACHE_TTL`` seconds,
+    or until the projects, worker-pools or groups change.
+
+    """
+    scope = scope_cache.get(key)
+
+    if scope is None:
+        scope = resolve()
+        scope_cache.set(key, scope)
+
+    return scope
+
+
+def get_worker_scope(api_key):
+    """
+    Return the scope of the worker with the given ``api_key``.
+
+    :return:
+        A ``tuple`` ``(project_ids, worker_pool_ids)`` of the projects and
+        worker-pools the worker has access to.
+
+    """
+    def resolve():
+        worker_pool_ids = list(WorkerPool.objects.filter(
+            workers__api_key=api_key).values_list('pk', flat=True))
+        project_ids = list(Project.objects.filter(
+            worker_pools__in=worker_pool_ids).values_list(
+                'pk', flat=True).distinct())
+        return project_ids, worker_pool_ids
+
+    return _get_cached_scope(('worker', api_key), resolve)
+
+
+def get_user_scope(user):
+    """
+    Return the scope of the given ``user``.
+
+    :return:
+        A ``tuple`` ``(project_ids, auth_project_ids)`` of the projects the
+        user can see and the projects the user is authorized to modify.
+
+    """
+    def resolve():
+        group_ids = list(user.groups.values_list('pk', flat=True))
+        project_ids = list(Project.objects.filter(
+            groups__in=group_ids).values_list('pk', flat=True).distinct())
+        auth_project_ids = list(Project.objects.filter(
+            auth_groups__in=group_ids).values_list(
+                'pk', flat=True).distinct())
+        return project_ids, auth_project_ids
+
+    return _get_cached_scope(('user', user.pk), resolve)
+
+
+def invalidate_scopes(sender, **kwargs):
+    """
+    Remove all cached authorization scopes.
+    """
+    scope_cache.clear()
+
+
 class HmacAuthentication(Authentication):
     """
     Authenticate based on request HMAC.
@@ -99,12 +324,37 @@ class ModelAuthorization(Authorization):
         to make modifications. Default is ``None``. For the ``Job`` model this
         would be ``'job_template__auth_groups'``.
 
+    :param project_path:
+        The path relative from the used model to the project (``''`` for the
+        ``Project`` model). When set, the objects are filtered on the
+        (cached) project ids of the worker or user (see
+        :func:`get_worker_scope` and :func:`get_user_scope`), instead of
+        joining up to the API-key or groups. The ``api_key_path`` and groups
+        paths must lead through this project. Default is ``None``.
+
+    :param worker_pool_path:
+        The path relative from the used model to the worker-pool. When set,
+        the objects requested by a worker are filtered on the (cached)
+        worker-pool ids of the worker. The ``api_key_path`` must lead through
+        this worker-pool. Default is ``None``.
+
     """
     def __init__(
-            self, api_key_path, user_groups_path, auth_user_groups_path=None):
+            self, api_key_path, user_groups_path, auth_user_groups_path=None,
+            project_path=None, worker_pool_path=None):
         self.api_key_path = api_key_path
         self.user_groups_path = user_groups_path
         self.auth_user_groups_path = auth_user_groups_path
+        self.project_path = project_path
+        self.worker_pool_path = worker_pool_path
+
+    def _get_in_lookup(self, path):
+        """
+        Return the ``__in`` lookup for ``path`` (``''`` being the model).
+        """
+        if path == '':
+            return 'pk__in'
+        return '{0}__in'.format(path)
 
     def filter_object_list(self, object_list, bundle):
         """
@@ -115,13 +365,40 @@ class ModelAuthorization(Authorization):
         # request is coming from the worker, use the ``api_key_path``.
         if request and 'HTTP_AUTHORIZATION' in request.META:
             auth_header = request.META.get('HTTP_AUTHORIZATION')
-            api_key_match = re.match(r'^ApiKey (.*?):(.*?)$', auth_header)
+            api_key_match = AUTH_HEADER_RE.match(auth_header)
+
+            if self.worker_pool_path is not None:
+                worker_pool_ids = get_worker_scope(api_key_match.group(1))[1]
+                return object_list.filter(**{
+                    self._get_in_lookup(self.worker_pool_path):
+                    worker_pool_ids
+                })
+
+            if self.project_path is not None:
+                project_ids = get_worker_scope(api_key_match.group(1))[0]
+                return object_list.filter(**{
+                    self._get_in_lookup(self.project_path): project_ids})
+
             return object_list.filter(
                 **{self.api_key_path: api_key_match.group(1)}).distinct()
 
+        # request is from a logged in user, filter on the project scope
+        elif (request and request.user.is_authenticated() and
+              self.project_path is not None):
+            project_ids, auth_project_ids = get_user_scope(request.user)
+            lookup = self._get_in_lookup(self.project_path)
+            object_list = object_list.filter(**{lookup: project_ids})
+
+            # apply extra filters when the request is not a GET
+            if (request.method != 'GET' and
+                    self.auth_user_groups_path is not None):
+                object_list = object_list.filter(**{lookup: auth_project_ids})
+
+            return object_list
+
         # request is from a logged in user (django session)
-        elif (request and request.user.is_authenticated()
-              and request.user.groups.count() > 0):
+        elif (request and request.user.is_authenticated() and
+              request.user.groups.count() > 0):
             groups_or = None
 
             if self.user_groups_path == "":
@@ -161,6 +438,30 @@ class ModelAuthorization(Authorization):
 
         return object_list.none()
 
+    def is_authorized_object(self, object_list, bundle):
+        """
+        Return a ``bool`` indicating if ``bundle.obj`` is in the filtered list.
+
+        This is checked with a single ``EXISTS`` query. Since tastypie checks
+        the same object more than once while handling a request, the result
+        is stored on the request.
+
+        """
+        key = (id(self), bundle.obj.pk)
+        authorized_objects = getattr(
+            bundle.request, '_authorized_objects', None)
+
+        if authorized_objects is None:
+            authorized_objects = {}
+            if bundle.request is not None:
+                bundle.request._authorized_objects = authorized_objects
+
+        if key not in authorized_objects:
+            authorized_objects[key] = self.filter_object_list(
+                object_list, bundle).filter(pk=bundle.obj.pk).exists()
+
+        return authorized_objects[key]
+
     def read_list(self, object_list, bundle):
         return self.filter_object_list(object_list, bundle)
 
@@ -171,9 +472,30 @@ class ModelAuthorization(Authorization):
         if not bundle.obj.id:
             return True
 
-        obj_list = self.filter_object_list(object_list, bundle)
-        return bundle.obj in obj_list.filter(pk=bundle.obj.pk)
+        return self.is_authorized_object(object_list, bundle)
 
     def update_detail(self, object_list, bundle):
-        obj_list = self.filter_object_list(object_list, bundle)
-        return bundle.obj in obj_list.filter(pk=bundle.obj.pk)
+        return self.is_authorized_object(object_list, bundle)
+
+
+def invalidate_worker_credentials(sender, instance, **kwargs):
+    """
+    Remove the cached credentials of a saved or deleted worker.
+    """
+    credential_cache.invalidate(instance.pk)
+
+
+signals.post_save.connect(invalidate_worker_credentials, sender=Worker)
+signals.post_delete.connect(invalidate_worker_credentials, sender=Worker)
+
+
+for m2m_field in (
+        Project.groups,
+        Project.auth_groups,
+        Project.worker_pools,
+        WorkerPool.workers,
+        User.groups):
+    signals.m2m_changed.connect(invalidate_scopes, sender=m2m_field.through)
+
+for model in (Project, WorkerPool, Worker, Group, User):
+    signals.post_delete.connect(invalidate_scopes, sender=model)
@@ -0,0 +1,468 @@
+import calendar
+import heapq
+import json
+import logging
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+
+import zmq
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from django.utils.importlib import import_module
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def dts_to_timestamp(dts):
+    """
+    Return the UNIX timestamp (``float``) of the given aware ``dts``.
+    """
+    return calendar.timegm(dts.utctimetuple()) + dts.microsecond / 1e6
+
+
+def timestamp_to_dts(timestamp):
+    """
+    Return an aware :class:`datetime.datetime` for the given ``timestamp``.
+    """
+    return datetime.utcfromtimestamp(timestamp).replace(tzinfo=timezone.utc)
+
+
+def get_shard(job_id):
+    """
+    Return the (1-based) queue broadcaster shard responsible for a job.
+
+    :param job_id:
+        The id of the job.
+
+    """
+    return job_id % settings.JOB_RUNNER_BROADCASTER_SHARDS + 1
+
+
+def get_shard_ports(shard):
+    """
+    Return the publish and notify port of the queue broadcaster ``shard``.
+
+    :return:
+        A ``(publish_port, notify_port)`` tuple.
+
+    """
+    offset = 2 * (shard - 1)
+    return (
+        settings.JOB_RUNNER_BROADCASTER_PORT + offset,
+        settings.JOB_RUNNER_BROADCASTER_NOTIFY_PORT + offset,
+    )
+
+
+def _get_notify_sockets():
+    """
+    Return a ``list`` of ZMQ ``PUSH`` sockets, one for each broadcaster shard.
+
+    The sockets are created lazily per thread (ZMQ sockets are not
+    thread-safe) and re-created after a fork, since most web-servers fork
+    their workers after the application has been imported.
+
+    """
+    pid = os.getpid()
+
+    if getattr(_local, 'pid', None) != pid:
+        sockets = []
+
+        for shard in range(1, settings.JOB_RUNNER_BROADCASTER_SHARDS + 1):
+            socket = zmq.Context.instance().socket(zmq.PUSH)
+            # never block the process on exit for undelivered notifications
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.connect('tcp://{0}:{1}'.format(
+                settings.JOB_RUNNER_BROADCASTER_HOSTNAME,
+                get_shard_ports(shard)[1],
+            ))
+            sockets.append(socket)
+
+        _local.pid = pid
+        _local.sockets = sockets
+
+    return _local.sockets
+
+
+def notify_broadcaster(action, job_id=None, **kwargs):
+    """
+    Notify the queue broadcaster that something changed.
+
+    This is a best-effort notification to wake up the broadcaster, so that it
+    doesn't have to wait for its next regular pass. When the broadcaster is
+    not running (or can not keep up), the notification is dropped and the
+    change will be picked up by the next regular pass.
+
+    :param action:
+        A ``str`` describing what happened (eg: ``'run_created'``).
+
+    :param job_id:
+        The id of the job the notification is about. When given, only the
+        shard responsible for the job is notified, else all shards are
+        notified.
+
+    :param kwargs:
+        Extra data to send with the notification. When a ``schedule_dts`` is
+        given, the broadcaster will wake up at that time instead of
+        immediately.
+
+    """
+    message = dict(kwargs, action=action)
+    sockets = _get_notify_sockets()
+
+    if message.get('schedule_dts'):
+        message['schedule_dts'] = dts_to_timestamp(message['schedule_dts'])
+
+    if job_id is not None:
+        message['job_id'] = job_id
+        sockets = [sockets[get_shard(job_id) - 1]]
+
+    for socket in sockets:
+        try:
+            socket.send(json.dumps(message), zmq.NOBLOCK)
+        except zmq.ZMQError:
+            logger.warning(
+                'Unable to notify broadcaster: {0}'.format(message))
+
+
+class RunTimeline(object):
+    """
+    In-memory timeline of scheduled runs, ordered by ``schedule_dts``.
+
+    This makes it possible for the queue broadcaster to know which runs are
+    due, without querying the database for it.
+
+    """
+    def __init__(self):
+        self._heap = []
+        self._runs = {}
+
+    def __len__(self):
+        return len(self._runs)
+
+    def __contains__(self, run_id):
+        return run_id in self._runs
+
+    def clear(self):
+        """
+        Remove all runs from the timeline.
+        """
+        self._heap = []
+        self._runs = {}
+
+    def add(self, run_id, schedule_dts):
+        """
+        Add (or re-schedule) the run with id ``run_id`` at ``schedule_dts``.
+        """
+        self._runs[run_id] = schedule_dts
+        heapq.heappush(self._heap, (schedule_dts, run_id))
+
+    def remove(self, run_id):
+        """
+        Remove the run with id ``run_id`` from the timeline.
+        """
+        self._runs.pop(run_id, None)
+
+    def next_dts(self):
+        """
+        Return the ``schedule_dts`` of the first run or ``None`` when empty.
+        """
+        self._discard_stale()
+
+        if self._heap:
+            return self._heap[0][0]
+        return None
+
+    def pop_due(self, dts):
+        """
+        Remove and return the runs scheduled at or before ``dts``.
+
+        :return:
+            A ``list`` of ``(run_id, schedule_dts)`` tuples, ordered by
+            ``schedule_dts``.
+
+        """
+        due = []
+        self._discard_stale()
+
+        while self._heap and self._heap[0][0] <= dts:
+            schedule_dts, run_id = heapq.heappop(self._heap)
+            del self._runs[run_id]
+            due.append((run_id, schedule_dts))
+            self._discard_stale()
+
+        return due
+
+    def _discard_stale(self):
+        """
+        Discard heap entries of runs that were removed or re-scheduled.
+        """
+        while self._heap:
+            schedule_dts, run_id = self._heap[0]
+            if self._runs.get(run_id) == schedule_dts:
+                break
+            heapq.heappop(self._heap)
+
+
+class DeliveryTracker(object):
+    """
+    In-memory tracker of messages which are not acknowledged yet.
+
+    A run is acknowledged by the worker by setting its ``enqueue_dts``. Until
+    then, the message is considered in-flight and will be re-delivered to the
+    same worker once ``interval`` seconds passed.
+
+    :param interval:
+        The interval in seconds after which an unacknowledged message is
+        re-delivered.
+
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __contains__(self, key):
+        return key in self._pending
+
+    def sent(self, key, worker_id):
+        """
+        Register that the message with ``key`` was sent to ``worker_id``.
+        """
+        attempts = 1
+
+        if self.get_worker_id(key) == worker_id:
+            attempts = self._pending[key][2] + 1
+
+        self._pending[key] = (
+            worker_id,
+            timezone.now() + timedelta(seconds=self.interval),
+            attempts,
+        )
+
+    def remove(self, key):
+        """
+        Stop tracking the message with ``key`` (eg: once acknowledged).
+        """
+        self._pending.pop(key, None)
+
+    def retain(self, keys):
+        """
+        Stop tracking all messages which are not in ``keys``.
+        """
+        for key in self._pending.keys():
+            if key not in keys:
+                del self._pending[key]
+
+    def is_due(self, key):
+        """
+        Return ``bool`` indicating if the message with ``key`` must be
+        re-delivered.
+        """
+        return self._pending[key][1] <= timezone.now()
+
+    def get_worker_id(self, key):
+        """
+        Return the id of the worker the message with ``key`` was sent to.
+        """
+        if key in self._pending:
+            return self._pending[key][0]
+        return None
+
+    def get_attempts(self, key):
+        """
+        Return the number of times the message with ``key`` was sent.
+        """
+        if key in self._pending:
+            return self._pending[key][2]
+        return 0
+
+    def get_worker_counts(self):
+        """
+        Return a ``dict`` with the number of in-flight messages per worker id.
+        """
+        counts = {}
+
+        for worker_id, redeliver_dts, attempts in self._pending.values():
+            counts[worker_id] = counts.get(worker_id, 0) + 1
+
+        return counts
+
+    def next_dts(self):
+        """
+        Return the first re-delivery :class:`datetime.datetime` or ``None``.
+        """
+        if not self._pending:
+            return None
+        return min(x[1] for x in self._pending.values())
+
+
+def get_worker_selector_class():
+    """
+    Return the worker selector class set in ``JOB_RUNNER_WORKER_SELECTOR``.
+    """
+    path = settings.JOB_RUNNER_WORKER_SELECTOR
+    module_name, class_name = path.rsplit('.', 1)
+
+    try:
+        return getattr(import_module(module_name), class_name)
+    except (ImportError, AttributeError):
+        raise ImproperlyConfigured(
+            'Unable to import worker selector: {0}'.format(path))
+
+
+class WorkerSelector(object):
+    """
+    Base class for selecting the worker to which a run will be broadcasted.
+
+    An instance is created for each broadcast pass.
+
+    :param active_runs:
+        A ``dict`` containing the number of active runs (enqueued but not
+        returned yet, including the in-flight runs) per worker id.
+
+    :param in_flight_runs:
+        A ``dict`` containing the number of runs per worker id which are
+        broadcasted by this broadcaster, but not picked up yet.
+
+    :param shard:
+        The (1-based) shard of the broadcaster.
+
+    :param shards:
+        The number of shards (see ``JOB_RUNNER_BROADCASTER_SHARDS``).
+
+    """
+    def __init__(self, active_runs, in_flight_runs=None, shard=1, shards=1):
+        self.active_runs = active_runs
+        self.in_flight_runs = in_flight_runs or {}
+        self.shard = shard
+        self.shards = shards
+
+    def get_capacity(self, worker):
+        """
+        Return the number of active runs ``worker`` can have, as seen by this
+        broadcaster.
+
+        Every shard only knows about its own in-flight runs. The capacity of
+        the worker which is not taken by enqueued runs is split between the
+        shards, so that the shards together can't exceed the number of
+        concurrent jobs of the worker.
+
+        :return:
+            An ``int`` or ``None`` when the capacity is unlimited.
+
+        """
+        if not worker.concurrent_jobs:
+            return None
+
+        if self.shards == 1:
+            return worker.concurrent_jobs
+
+        enqueued = self.active_runs.get(worker.pk, 0) - \
+            self.in_flight_runs.get(worker.pk, 0)
+        free = max(worker.concurrent_jobs - enqueued, 0)
+
+        share = free / self.shards
+        if self.shard <= free % self.shards:
+            share += 1
+
+        return enqueued + share
+
+    def has_capacity(self, worker):
+        """
+        Return ``bool`` indicating if ``worker`` can accept an other run.
+
+        A worker is saturated when its number of active runs reached its
+        capacity (see :meth:`.get_capacity`). Workers which didn't report
+        the number of concurrent jobs (yet) are considered to have unlimited
+        capacity.
+
+        """
+        capacity = self.get_capacity(worker)
+
+        if capacity is None:
+            return True
+        return self.active_runs.get(worker.pk, 0) < capacity
+
+    def get_candidates(self, workers):
+        """
+        Return the responsive workers out of ``workers`` with capacity left.
+
+        When none of the workers is responsive, all ``workers`` are taken into
+        account (the health-check will take care of the runs of unresponsive
+        workers).
+
+        """
+        candidates = [
+            w for w in workers if w.is_responsive(log_unresponsive=False)]
+        return [w for w in candidates or workers if self.has_capacity(w)]
+
+    def select(self, run, workers):
+        """
+        Return the worker (out of ``workers``) to broadcast ``run`` to.
+
+        :param run:
+            The :class:`.Run` instance to select a worker for.
+
+        :param workers:
+            A ``list`` of enqueue-enabled :class:`.Worker` instances.
+
+        :return:
+            A :class:`.Worker` instance or ``None`` when all workers are
+            saturated.
+
+        """
+        raise NotImplementedError
+
+    def assign(self, worker):
+        """
+        Register that a run was assigned to ``worker`` during this pass.
+        """
+        self.active_runs[worker.pk] = self.active_runs.get(worker.pk, 0) + 1
+        self.in_flight_runs[worker.pk] = \
+            self.in_flight_runs.get(worker.pk, 0) + 1
+
+
+class RandomWorkerSelector(WorkerSelector):
+    """
+    Select a random (responsive) worker.
+    """
+    def select(self, run, workers):
+        candidates = self.get_candidates(workers)
+
+        if candidates:
+            return random.choice(candidates)
+        return None
+
+
+class LeastLoadedWorkerSelector(WorkerSelector):
+    """
+    Select the (responsive) worker with the lowest load.
+
+    The load is the number of active runs, relative to the number of
+    concurrent jobs reported by the worker. On equal load, a random worker
+    is selected.
+
+    """
+    def get_load(self, worker):
+        """
+        Return the load (``float``) of ``worker``.
+        """
+        return float(self.active_runs.get(worker.pk, 0)) / max(
+            worker.concurrent_jobs or 1, 1)
+
+    def select(self, run, workers):
+        candidates = self.get_candidates(workers)
+
+        if not candidates:
+            return None
+
+        min_load = min(self.get_load(w) for w in candidates)
+        return random.choice(
+            [w for w in candidates if self.get_load(w) == min_load])
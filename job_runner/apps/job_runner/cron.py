@@ -0,0 +1,261 @@
+"""
+Cron-expression parsing and matching.
+
+A cron-expression consists of five fields (minute, hour, day of month, month
+and day of week), see ``man 5 crontab``. The following is supported:
+
+* ``*``, values (eg: ``5``), ranges (eg: ``1-5``) and lists (eg: ``1,3,5``)
+* steps (eg: ``*/15`` or ``0-30/10``)
+* month and day of week names (eg: ``jan`` or ``mon-fri``)
+* the ``@yearly``, ``@annually``, ``@monthly``, ``@weekly``, ``@daily``,
+  ``@midnight`` and ``@hourly`` shortcuts
+
+Like cron, when both the day of month and the day of week are restricted,
+a day matches when either of them matches.
+
+"""
+import bisect
+from datetime import datetime, timedelta
+
+
+MACROS = {
+    '@yearly': '0 0 1 1 *',
+    '@annually': '0 0 1 1 *',
+    '@monthly': '0 0 1 * *',
+    '@weekly': '0 0 * * 0',
+    '@daily': '0 0 * * *',
+    '@midnight': '0 0 * * *',
+    '@hourly': '0 * * * *',
+}
+
+MONTH_NAMES = [
+    'jan', 'feb', 'mar', 'apr', 'may', 'jun',
+    'jul', 'aug', 'sep', 'oct', 'nov', 'dec',
+]
+
+DAY_OF_WEEK_NAMES = ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat']
+
+MAX_SEARCH_DAYS = 366 * 5
+"""
+The number of days to search for the next match (leap days included).
+"""
+
+_cache = {}
+
+
+class InvalidCronExpression(ValueError):
+    """
+    Raised when a cron-expression can not be parsed.
+    """
+
+
+def _parse_value(value, minimum, names):
+    """
+    Return the ``int`` value of a single cron-field ``value``.
+    """
+    if value.lower() in names:
+        return names.index(value.lower()) + minimum
+
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidCronExpression('Invalid value: {0}'.format(value))
+
+
+def _parse_field(field, minimum, maximum, names=[]):
+    """
+    Return a sorted ``list`` of the values matching cron-field ``field``.
+
+    :param field:
+        The field to parse (eg: ``1-5,*/10``).
+
+    :param minimum:
+        The minimum allowed value.
+
+    :param maximum:
+        The maximum allowed value.
+
+    :param names:
+        A ``list`` of names for the values (starting at ``minimum``).
+
+    """
+    values = set()
+
+    for part in field.split(','):
+        step = 1
+
+        if '/' in part:
+            part, step = part.split('/', 1)
+            step = _parse_value(step, 0, [])
+            if step < 1:
+                raise InvalidCronExpression('Invalid step: {0}'.format(field))
+
+        if part == '*':
+            start, end = minimum, maximum
+        elif '-' in part:
+            start, end = part.split('-', 1)
+            start = _parse_value(start, minimum, names)
+            end = _parse_value(end, minimum, names)
+        else:
+            start = end = _parse_value(part, minimum, names)
+            # 5/10 means 5 up to the maximum with steps of 10
+            if step > 1:
+                end = maximum
+
+        if start < minimum or end > maximum or start > end:
+            raise InvalidCronExpression(
+                'Out of range ({0}-{1}): {2}'.format(minimum, maximum, field))
+
+        values.update(range(start, end + 1, step))
+
+    return sorted(values)
+
+
+class CronExpression(object):
+    """
+    A parsed cron-expression.
+
+    Use :func:`get_cron_expression` to get a (cached) instance.
+
+    :param expression:
+        The cron-expression (``str``).
+
+    :raises InvalidCronExpression:
+        When the expression is not valid.
+
+    """
+    def __init__(self, expression):
+        self.expression = expression
+        fields = MACROS.get(expression.strip().lower(), expression).split()
+
+        if len(fields) != 5:
+            raise InvalidCronExpression(
+                'Expected five fields: {0}'.format(expression))
+
+        self.minutes = _parse_field(fields[0], 0, 59)
+        self.hours = _parse_field(fields[1], 0, 23)
+        self.days = _parse_field(fields[2], 1, 31)
+        self.months = _parse_field(fields[3], 1, 12, MONTH_NAMES)
+
+        # both 0 and 7 are sunday
+        days_of_week = _parse_field(fields[4], 0, 7, DAY_OF_WEEK_NAMES)
+        self.days_of_week = sorted(set([x % 7 for x in days_of_week]))
+
+        # like Vixie cron, a field starting with * (eg: */2) counts as
+        # unrestricted when deciding how the day fields are combined
+        self.any_day = fields[2].startswith('*')
+        self.any_day_of_week = fields[4].startswith('*')
+
+    def __repr__(self):
+        return '<CronExpression: {0}>'.format(self.expression)
+
+    def match_day(self, dts):
+        """
+        Return ``bool`` indicating if the date of ``dts`` matches.
+        """
+        if dts.month not in self.months:
+            return False
+
+        day_match = dts.day in self.days
+        # isoweekday: monday is 1 and sunday is 7
+        day_of_week_match = dts.isoweekday() % 7 in self.days_of_week
+
+        if self.any_day or self.any_day_of_week:
+            return day_match and day_of_week_match
+        return day_match or day_of_week_match
+
+    def get_next(self, dts):
+        """
+        Return the first match after ``dts``.
+
+        :param dts:
+            A naive :class:`datetime.datetime` (in the local time of the
+            expression).
+
+        :return:
+            A naive :class:`datetime.datetime` or ``None`` when there is no
+            match within :data:`MAX_SEARCH_DAYS` (eg: ``0 0 31 2 *``).
+
+        """
+        dts = dts.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = datetime(dts.year, dts.month, dts.day)
+
+        for x in range(MAX_SEARCH_DAYS):
+            if self.match_day(day):
+                # on the first day, start from the given time
+                if day.date() == dts.date():
+                    hour, minute = dts.hour, dts.minute
+                else:
+                    hour, minute = 0, 0
+
+                index = bisect.bisect_left(self.hours, hour)
+
+                if index < len(self.hours):
+                    if self.hours[index] != hour:
+                        hour, minute = self.hours[index], 0
+
+                    minute_index = bisect.bisect_left(self.minutes, minute)
+
+                    if minute_index < len(self.minutes):
+                        return day.replace(
+                            hour=hour, minute=self.minutes[minute_index])
+
+                    if index + 1 < len(self.hours):
+                        return day.replace(
+                            hour=self.hours[index + 1],
+                            minute=self.minutes[0]
+                        )
+
+            day += timedelta(days=1)
+
+        return None
+
+
+def get_cron_expression(expression):
+    """
+    Return a :class:`CronExpression` instance for ``expression``.
+
+    The parsed expressions are cached, so that the expression of a job is
+    only parsed once per process.
+
+    :raises InvalidCronExpression:
+        When the expression is not valid.
+
+    """
+    if expression not in _cache:
+        _cache[expression] = CronExpression(expression)
+    return _cache[expression]
+
+
+def get_next_dts(expression, dts, tzinfo):
+    """
+    Return the first match of ``expression`` after ``dts``.
+
+    The expression is matched against the local time in ``tzinfo``, so that
+    a job scheduled at ``15 2 * * *`` keeps running at 02:15 local time after
+    a daylight saving-time change. When the local time does not exist (when
+    the clock is set forward), the job is scheduled an hour later.
+
+    :param expression:
+        The cron-expression (``str``).
+
+    :param dts:
+        An aware :class:`datetime.datetime`.
+
+    :param tzinfo:
+        A ``pytz`` timezone.
+
+    :return:
+        An aware :class:`datetime.datetime` or ``None`` when there is no
+        match.
+
+    """
+    local_dts = dts.astimezone(tzinfo).replace(tzinfo=None)
+    next_dts = get_cron_expression(expression).get_next(local_dts)
+
+    if next_dts is None:
+        return None
+
+    # is_dst=False picks the second occurrence when the time is ambiguous
+    # (when the clock is set back) and shifts non-existing times forward
+    return tzinfo.normalize(tzinfo.localize(next_dts, is_dst=False))
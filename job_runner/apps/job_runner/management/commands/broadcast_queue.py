@@ -1,15 +1,21 @@
 import json
 import logging
-import random
 import time
-from datetime import datetime, timedelta
+from datetime import timedelta
+from optparse import make_option
 
 import zmq
 from django.conf import settings
-from django.core.management.base import NoArgsCommand
+from django.core.management.base import CommandError, NoArgsCommand
 from django.db import transaction
+from django.db.models import Count, F, Max
+from django.utils import timezone
 
-from job_runner.apps.job_runner.models import KillRequest, Run, Worker
+from job_runner.apps.job_runner.broadcaster import (
+    DeliveryTracker, RunTimeline, dts_to_timestamp, get_shard,
+    get_shard_ports, get_worker_selector_class, timestamp_to_dts)
+from job_runner.apps.job_runner.models import (
+    KillRequest, Run, ScheduleCounter, Worker)
 
 
 logger = logging.getLogger(__name__)
@@ -18,41 +24,402 @@ logger = logging.getLogger(__name__)
 class Command(NoArgsCommand):
     help = 'Broadcast runs and kill-requests to workers'
 
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--shard',
+            dest='shard',
+            default=None,
+            help=(
+                'Only broadcast the runs of shard N out of M (N/M), see '
+                'JOB_RUNNER_BROADCASTER_SHARDS'
+            ),
+        ),
+    )
+
     publisher = None
     """
     Holds the ZMQ ``publisher`` instance, used to publish to the workers.
     """
 
+    receiver = None
+    """
+    Holds the ZMQ ``receiver`` instance, used to receive notifications.
+    """
+
+    next_pass_dts = None
+    """
+    The :class:`datetime.datetime` of the next broadcast pass.
+    """
+
+    enqueue_retry_interval = 5
+    """
+    The interval in seconds for re-broadcasting runs which are not picked up
+    yet by the worker (the worker sets the ``enqueue_dts`` once received).
+    """
+
+    max_enqueue_attempts = 3
+    """
+    The number of times a run is broadcasted to the same worker, before
+    selecting an other worker (in case the run is not bound to a worker).
+    """
+
+    deliveries = None
+    """
+    Holds the :class:`.DeliveryTracker` instance with the broadcasted runs
+    which are not picked up yet by the worker.
+    """
+
+    notify_settle_interval = 1
+    """
+    The interval in seconds for an extra pass after receiving a notification.
+
+    Notifications are sent from within the transaction that created the run,
+    so it might not be visible yet at the moment we receive the notification.
+
+    """
+
+    notified = False
+    """
+    Set to ``True`` when a notification triggered an immediate pass.
+    """
+
+    timeline = None
+    """
+    Holds the :class:`.RunTimeline` instance with the scheduled runs which
+    are not due yet.
+    """
+
+    due_runs = None
+    """
+    A ``dict`` containing the ids and ``schedule_dts`` of the scheduled runs
+    which are due, but not picked up by a worker yet (eg: because the job is
+    still active or because enqueue is disabled).
+    """
+
+    unconfirmed_runs = None
+    """
+    A ``dict`` containing the ``schedule_dts`` and the notification
+    :class:`datetime.datetime` of the runs we got notified about, but which
+    were not seen in the database yet.
+
+    Notifications are sent from within the transaction that created the run,
+    so these runs are kept (as due runs or on the timeline) until they are
+    visible, or until a full synchronization at least
+    ``JOB_RUNNER_BROADCASTER_RESYNC_INTERVAL`` seconds after the notification
+    didn't find them.
+
+    """
+
+    next_sync_dts = None
+    """
+    The :class:`datetime.datetime` of the next full timeline synchronization.
+    """
+
+    query_chunk_size = 500
+    """
+    The max. number of run ids to use in a single ``IN`` lookup.
+    """
+
+    next_kill_resend_dts = None
+    """
+    The :class:`datetime.datetime` at which the last broadcasted kill-requests
+    are re-broadcasted (in case they are not executed by then).
+    """
+
+    shard = 1
+    """
+    The (1-based) shard handled by this broadcaster.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(Command, self).__init__(*args, **kwargs)
+        self.timeline = RunTimeline()
+        self.due_runs = {}
+        self.unconfirmed_runs = {}
+        self.deliveries = DeliveryTracker(self.enqueue_retry_interval)
+
     @transaction.commit_manually
     def handle_noargs(self, **options):
-        logger.info('Starting queue broadcaster')
+        self.shard = self._parse_shard(options['shard'])
+        publish_port, notify_port = get_shard_ports(self.shard)
+
+        logger.info('Starting queue broadcaster (shard {0}/{1})'.format(
+            self.shard, settings.JOB_RUNNER_BROADCASTER_SHARDS))
         context = zmq.Context(1)
 
         # setup the publisher to which the workers are subscribing
         self.publisher = context.socket(zmq.PUB)
-        self.publisher.bind(
-            'tcp://*:{0}'.format(settings.JOB_RUNNER_BROADCASTER_PORT))
+        self.publisher.bind('tcp://*:{0}'.format(publish_port))
+
+        # setup the receiver for notifications about new runs, returned runs
+        # and kill-requests
+        self.receiver = context.socket(zmq.PULL)
+        self.receiver.bind('tcp://*:{0}'.format(notify_port))
+
+        poller = zmq.Poller()
+        poller.register(self.receiver, zmq.POLLIN)
 
         # give the subscribers some time to (re-)connect.
         time.sleep(2)
 
         ping_delta = timedelta(
             seconds=settings.JOB_RUNNER_WORKER_PING_INTERVAL)
-        next_ping_request = datetime.utcnow()
+        next_ping_request = timezone.now()
+        self.next_pass_dts = timezone.now()
 
         while True:
-            if next_ping_request <= datetime.utcnow():
-                self._broadcast_worker_ping()
-                next_ping_request = datetime.utcnow() + ping_delta
-            self._broadcast_runs()
-            self._broadcast_kill_requests()
+            if next_ping_request <= timezone.now():
+                # the workers are subscribed to all shards, one ping is enough
+                if self.shard == 1:
+                    self._broadcast_worker_ping()
+                next_ping_request = timezone.now() + ping_delta
+
+            if self.next_pass_dts <= timezone.now():
+                self._broadcast_runs()
+                self._broadcast_kill_requests()
+                self.next_pass_dts = self._get_next_pass_dts()
+
             transaction.commit()
-            time.sleep(5)
+
+            wake_up_dts = min(self.next_pass_dts, next_ping_request)
+            timeout = wake_up_dts - timezone.now()
+            timeout = max(0, (
+                timeout.days * 86400 + timeout.seconds) * 1000 +
+                timeout.microseconds / 1000)
+
+            if poller.poll(timeout):
+                self._receive_notifications()
 
         self.publisher.close()
+        self.receiver.close()
         self.event_publisher.close()
         context.term()
 
+    def _parse_shard(self, value):
+        """
+        Return the shard number out of the ``--shard=N/M`` option ``value``.
+
+        :raises CommandError:
+            When the value is invalid, or doesn't match with
+            ``JOB_RUNNER_BROADCASTER_SHARDS``.
+
+        """
+        shards = settings.JOB_RUNNER_BROADCASTER_SHARDS
+
+        if value is None:
+            if shards > 1:
+                raise CommandError(
+                    '--shard is required when running {0} shards'.format(
+                        shards))
+            return 1
+
+        try:
+            shard, total = [int(x) for x in value.split('/')]
+        except ValueError:
+            raise CommandError(
+                'Invalid shard {0}, expected N/M'.format(value))
+
+        if total != shards:
+            raise CommandError(
+                'Invalid shard {0}, JOB_RUNNER_BROADCASTER_SHARDS is set to '
+                '{1}'.format(value, shards))
+
+        if not 1 <= shard <= total:
+            raise CommandError(
+                'Invalid shard {0}, N must be between 1 and {1}'.format(
+                    value, total))
+
+        return shard
+
+    def _in_shard(self, job_id):
+        """
+        Return ``bool`` indicating if the job with ``job_id`` is handled by
+        this broadcaster.
+        """
+        return get_shard(job_id) == self.shard
+
+    def _get_next_pass_dts(self):
+        """
+        Return the :class:`datetime.datetime` of the next broadcast pass.
+
+        This is the earliest of:
+
+        * the first scheduled run in the future
+        * the re-broadcast of runs that are not picked up yet
+        * the re-check of due runs that are not visible in the database yet
+        * the re-broadcast of kill-requests that are not executed yet
+        * the extra pass after a notification
+        * the next full timeline synchronization
+        * the maximum interval between two passes
+
+        """
+        now = timezone.now()
+        next_pass_dts = now + timedelta(
+            seconds=settings.JOB_RUNNER_BROADCASTER_MAX_INTERVAL)
+
+        redeliver_dts = self.deliveries.next_dts()
+
+        for run_id in self.unconfirmed_runs:
+            if run_id in self.due_runs:
+                recheck_dts = now + timedelta(
+                    seconds=self.enqueue_retry_interval)
+                redeliver_dts = min(
+                    redeliver_dts or recheck_dts, recheck_dts)
+                break
+
+        if self.next_kill_resend_dts and self.next_kill_resend_dts > now:
+            redeliver_dts = min(
+                redeliver_dts or self.next_kill_resend_dts,
+                self.next_kill_resend_dts
+            )
+
+        if redeliver_dts:
+            next_pass_dts = min(next_pass_dts, redeliver_dts)
+
+        if self.notified:
+            self.notified = False
+            next_pass_dts = min(
+                next_pass_dts,
+                now + timedelta(seconds=self.notify_settle_interval)
+            )
+
+        if self.next_sync_dts:
+            next_pass_dts = min(next_pass_dts, self.next_sync_dts)
+
+        next_schedule_dts = self.timeline.next_dts()
+
+        if next_schedule_dts:
+            next_pass_dts = min(next_pass_dts, next_schedule_dts)
+
+        return next_pass_dts
+
+    def _sync_timeline(self):
+        """
+        (Re-)load all scheduled runs from the database into the timeline.
+
+        This is done at startup and periodically (see
+        ``JOB_RUNNER_BROADCASTER_RESYNC_INTERVAL``), as a safety net for
+        changes we didn't get notified about.
+
+        """
+        logger.info('Synchronizing timeline')
+        self.timeline.clear()
+        self.due_runs = {}
+        scheduled_ids = set()
+
+        for run_id, job_id, schedule_dts in \
+                Run.objects.scheduled().values_list(
+                    'pk', 'job', 'schedule_dts').order_by():
+            scheduled_ids.add(run_id)
+            if self._in_shard(job_id):
+                self.timeline.add(run_id, schedule_dts)
+
+        # keep the runs we got notified about, which might not be committed
+        # yet, unless they are missing for longer than the resync interval
+        expire_dts = timezone.now() - timedelta(
+            seconds=settings.JOB_RUNNER_BROADCASTER_RESYNC_INTERVAL)
+
+        for run_id, (schedule_dts, notified_dts) in \
+                self.unconfirmed_runs.items():
+            if run_id in scheduled_ids or notified_dts <= expire_dts:
+                del self.unconfirmed_runs[run_id]
+            else:
+                self.timeline.add(run_id, schedule_dts)
+
+        self.next_sync_dts = timezone.now() + timedelta(
+            seconds=settings.JOB_RUNNER_BROADCASTER_RESYNC_INTERVAL)
+
+    def _update_due_runs(self):
+        """
+        Move the due runs from the timeline to :attr:`due_runs`.
+
+        Runs that are not scheduled anymore (eg: picked up by a worker or
+        deleted) are removed from :attr:`due_runs` and :attr:`deliveries`,
+        unless they are not visible yet (see :attr:`unconfirmed_runs`).
+
+        """
+        if not self.next_sync_dts or self.next_sync_dts <= timezone.now():
+            self._sync_timeline()
+
+        for run_id, schedule_dts in self.timeline.pop_due(timezone.now()):
+            self.due_runs[run_id] = schedule_dts
+
+        scheduled_ids = set()
+
+        for run_ids in self._get_due_run_id_chunks():
+            scheduled_ids.update(Run.objects.scheduled().filter(
+                pk__in=run_ids).values_list('pk', flat=True).order_by())
+
+        for run_id in self.due_runs.keys():
+            if run_id in scheduled_ids:
+                self.unconfirmed_runs.pop(run_id, None)
+            elif run_id not in self.unconfirmed_runs:
+                del self.due_runs[run_id]
+
+        self.deliveries.retain(self.due_runs)
+
+    def _get_due_run_id_chunks(self):
+        """
+        Return the ids of the due runs, ordered by ``schedule_dts``, in chunks
+        of max. :attr:`query_chunk_size`.
+        """
+        run_ids = sorted(self.due_runs, key=lambda x: self.due_runs[x])
+        return [
+            run_ids[i:i + self.query_chunk_size]
+            for i in range(0, len(run_ids), self.query_chunk_size)
+        ]
+
+    def _receive_notifications(self):
+        """
+        Receive all pending notifications and update the next pass.
+
+        Notifications containing a ``schedule_dts`` will make the broadcaster
+        wake up at that time, all other notifications will trigger a pass
+        immediately (followed by an extra pass, see
+        :attr:`notify_settle_interval`).
+
+        """
+        while True:
+            try:
+                message = self.receiver.recv(zmq.NOBLOCK)
+            except zmq.ZMQError:
+                break
+
+            logger.debug('Received: {0}'.format(message))
+
+            try:
+                notification = json.loads(message)
+            except ValueError:
+                logger.error('Invalid notification: {0}'.format(message))
+                continue
+
+            now = timezone.now()
+
+            if (notification.get('job_id') is not None and
+                    not self._in_shard(notification['job_id'])):
+                logger.warning(
+                    'Notification for other shard: {0}'.format(message))
+                continue
+
+            if notification.get('action') == 'runs_scheduled':
+                # the runs were created in bulk (without a notification per
+                # run), re-load the timeline on the next pass
+                self.next_sync_dts = now
+
+            if notification.get('schedule_dts'):
+                schedule_dts = timestamp_to_dts(notification['schedule_dts'])
+                self.timeline.add(notification['run_id'], schedule_dts)
+                self.unconfirmed_runs[notification['run_id']] = (
+                    schedule_dts, now)
+                wake_up_dts = max(now, schedule_dts)
+            else:
+                wake_up_dts = now
+
+            if wake_up_dts <= now:
+                self.notified = True
+
+            self.next_pass_dts = min(self.next_pass_dts, wake_up_dts)
+
     @transaction.commit_manually
     def _broadcast_runs(self):
         """
@@ -62,17 +429,52 @@ class Command(NoArgsCommand):
         runs are not broadcasted, unless they are scheduled manually
         (``is_manual`` set to ``True``).
 
-        """
-        enqueueable_runs = Run.objects.enqueueable().select_related()
+        Only the runs which are due according to the :attr:`timeline` are
+        taken into account. Runs which were broadcasted before, but are not
+        picked up yet by the worker, are re-broadcasted to the same worker
+        every :attr:`enqueue_retry_interval` seconds (see
+        :attr:`deliveries`).
+
+        :return:
+            The number of broadcasted runs.
 
-        # Use select_for_update so that the enqueueable runs will be locked.
-        # This is to make sure that in case of multiple broadcasters we're not
-        # creating any duplicate runs in case of run_on_all_workers=True.
-        enqueueable_runs = enqueueable_runs.select_for_update()
+        """
         broadcasted = {}
         to_broadcast = []
+        enabled_workers = {}
+        selector = None
+        rescheduled_job_ids = set()
+        active_schedule_ids = {}
+        last_schedule_dts = {}
 
         try:
+            self._update_due_runs()
+            enqueueable_runs = []
+
+            for run_ids in self._get_due_run_id_chunks():
+                # Use select_for_update so that the enqueueable runs will be
+                # locked. This is to make sure that in case of multiple
+                # broadcasters we're not creating any duplicate runs in case
+                # of run_on_all_workers=True.
+                enqueueable_runs.extend(Run.objects.enqueueable().filter(
+                    pk__in=run_ids).select_related(
+                        'job__job_template__project',
+                        'job__worker_pool',
+                        'worker',
+                    ).prefetch_related(
+                        'job__rescheduleexclude_set'
+                    ).select_for_update())
+
+            if enqueueable_runs:
+                selector = self._get_worker_selector()
+
+                if settings.JOB_RUNNER_SCHEDULE_HORIZON:
+                    enqueueable_runs = self._discard_missed_runs(
+                        enqueueable_runs)
+                else:
+                    active_schedule_ids, last_schedule_dts = \
+                        self._get_reschedule_data(enqueueable_runs)
+
             for run in enqueueable_runs:
                 # schedule the run if we haven't already scheduled a run for
                 # the same job, or when the run.schedule_id is equal to the
@@ -82,47 +484,91 @@ class Command(NoArgsCommand):
                         (run.job.pk in broadcasted and
                             broadcasted[run.job.pk] == run.get_schedule_id())):
                     worker = run.worker
+                    redelivery = run.pk in self.deliveries
 
-                    # reschedule the job (the reschedule method will take care
-                    # of checking if we should reschedule the job or not).
-                    run.job.reschedule()
+                    # the run is in-flight, wait for the worker to pick it up
+                    if redelivery and not self.deliveries.is_due(run.pk):
+                        broadcasted[run.job.pk] = run.get_schedule_id()
+                        continue
 
                     if not worker:
+                        workers = self._get_enabled_workers(
+                            run.job.worker_pool, enabled_workers)
+
                         # if the job should run on all workers
                         if run.job.run_on_all_workers:
-                            workers = run.job.worker_pool.workers.filter(
-                                enqueue_is_enabled=True)
-                            if workers.count():
+                            if workers:
+                                self._reschedule_job(
+                                    run.job,
+                                    rescheduled_job_ids,
+                                    active_schedule_ids,
+                                    last_schedule_dts,
+                                )
                                 broadcasted[run.job.pk] = run.get_schedule_id()
 
-                                for w in workers:
-                                    # assign a worker to each run
-                                    assigned_run = Run.objects.create(
-                                        job=run.job,
-                                        schedule_id=run.get_schedule_id(),
-                                        worker=w,
-                                        schedule_dts=run.schedule_dts,
-                                        is_manual=run.is_manual,
-                                        schedule_children=run.schedule_children
-                                    )
-                                    to_broadcast.append((assigned_run, w))
+                                for assigned_run, w in self._fan_out_run(
+                                        run, workers):
+                                    self.due_runs[assigned_run.pk] = \
+                                        assigned_run.schedule_dts
+
+                                    # saturated workers will get their run
+                                    # in one of the next passes
+                                    if selector.has_capacity(w):
+                                        selector.assign(w)
+                                        to_broadcast.append((assigned_run, w))
 
                                 # delete the "old" unassigned run
                                 run.delete()
 
-                        # select a random worker
-                        else:
-                            # TODO: take ping response into account?
-                            workers = run.job.worker_pool.workers.filter(
-                                enqueue_is_enabled=True)
-                            if len(workers):
-                                # pick a random active worker
-                                worker = workers[
-                                    random.randint(0, len(workers) - 1)]
+                        # select a worker
+                        elif workers:
+                            candidates = workers
+
+                            if redelivery:
+                                worker = self._get_redelivery_worker(
+                                    run, workers)
+                                # prefer the other workers on fail-over
+                                failed_id = self.deliveries.get_worker_id(
+                                    run.pk)
+                                candidates = [
+                                    w for w in workers if w.pk != failed_id
+                                ] or workers
+
+                            if not worker:
+                                worker = selector.select(run, candidates)
+                                if worker:
+                                    selector.assign(worker)
+
+                            if not worker:
+                                logger.info(
+                                    'All workers saturated, holding back '
+                                    '{0}'.format(run.log_name()))
+
+                    elif not redelivery and not selector.has_capacity(worker):
+                        logger.info('Worker {0} saturated, holding back '
+                                    '{1}'.format(
+                                        worker.log_name(), run.log_name()))
+                        worker = None
 
                     # this is the case when a run has already a worker assigned
-                    # to it, or when we selected a random worker.
+                    # to it, or when we selected a worker.
                     if worker:
+                        # reschedule the job (the reschedule method will take
+                        # care of checking if we should reschedule the job or
+                        # not). Runs created by the fan-out of a job which
+                        # runs on all workers share the schedule id of the
+                        # run for which the job was already rescheduled.
+                        if run.get_schedule_id() == run.pk and not redelivery:
+                            self._reschedule_job(
+                                run.job,
+                                rescheduled_job_ids,
+                                active_schedule_ids,
+                                last_schedule_dts,
+                            )
+
+                        if run.worker and not redelivery:
+                            selector.assign(worker)
+
                         to_broadcast.append((run, worker))
                         broadcasted[run.job.pk] = run.get_schedule_id()
 
@@ -132,8 +578,224 @@ class Command(NoArgsCommand):
         else:
             transaction.commit()
 
-            for brocast_args in to_broadcast:
-                self._broadcast_run(*brocast_args)
+            for run, worker in to_broadcast:
+                self._broadcast_run(run, worker)
+                self.deliveries.sent(run.pk, worker.pk)
+
+        return len(to_broadcast)
+
+    def _get_reschedule_data(self, runs):
+        """
+        Return the data needed for rescheduling the jobs of ``runs`` in bulk.
+
+        :return:
+            A ``tuple`` of two ``dict`` instances, containing the active
+            schedule ids and the ``schedule_dts`` of the last non-manual run
+            per job id (see :meth:`.Job.reschedule`).
+
+        """
+        job_ids = list(set([run.job_id for run in runs]))
+        active_schedule_ids = {}
+        last_schedule_dts = {}
+
+        for job_id in job_ids:
+            active_schedule_ids[job_id] = []
+
+        for job_id, pk, schedule_id in Run.objects.filter(
+                job__in=job_ids, return_dts__isnull=True).values_list(
+                    'job', 'pk', 'schedule_id').order_by():
+            if (schedule_id or pk) not in active_schedule_ids[job_id]:
+                active_schedule_ids[job_id].append(schedule_id or pk)
+
+        last_run_ids = Run.objects.filter(
+            job__in=job_ids, is_manual=False).values('job').annotate(
+                last_run_id=Max('pk')).order_by().values_list(
+                    'last_run_id', flat=True)
+
+        for job_id, schedule_dts in Run.objects.filter(
+                pk__in=list(last_run_ids)).values_list(
+                    'job', 'schedule_dts').order_by():
+            last_schedule_dts[job_id] = schedule_dts
+
+        return active_schedule_ids, last_schedule_dts
+
+    def _reschedule_job(
+            self, job, rescheduled_job_ids, active_schedule_ids,
+            last_schedule_dts):
+        """
+        Reschedule ``job`` using the data of :meth:`_get_reschedule_data`.
+
+        A job is only rescheduled once per pass, since the prefetched data is
+        outdated once it has been rescheduled. When the runs are pre-scheduled
+        (see ``JOB_RUNNER_SCHEDULE_HORIZON``), jobs are not rescheduled.
+
+        :param job:
+            The :class:`.Job` instance to reschedule.
+
+        :param rescheduled_job_ids:
+            A ``set`` of ids of the jobs rescheduled within this pass.
+
+        """
+        if (settings.JOB_RUNNER_SCHEDULE_HORIZON or
+                job.pk in rescheduled_job_ids):
+            return
+
+        rescheduled_job_ids.add(job.pk)
+        job.reschedule(
+            active_schedule_ids=active_schedule_ids[job.pk],
+            last_schedule_dts=last_schedule_dts.get(job.pk),
+        )
+
+    def _discard_missed_runs(self, runs):
+        """
+        Delete the pre-scheduled runs which are superseded by a later run.
+
+        When a job was active (or disabled) while several of its pre-scheduled
+        runs became due, only the last one is broadcasted, like rescheduling
+        skips the missed intervals.
+
+        :param runs:
+            A ``list`` of enqueueable :class:`.Run` instances.
+
+        :return:
+            A ``list`` of the remaining runs.
+
+        """
+        last_runs = {}
+
+        for run in runs:
+            if run.is_manual or run.worker_id:
+                continue
+
+            last_run = last_runs.get(run.job_id)
+            if not last_run or run.schedule_dts > last_run.schedule_dts:
+                last_runs[run.job_id] = run
+
+        missed_ids = set([
+            run.pk for run in runs
+            if not run.is_manual and not run.worker_id and
+            last_runs[run.job_id] is not run
+        ])
+
+        if not missed_ids:
+            return runs
+
+        logger.info('Discarding {0} missed run(s)'.format(len(missed_ids)))
+        Run.objects.filter(pk__in=missed_ids).delete()
+
+        for run_id in missed_ids:
+            self.due_runs.pop(run_id, None)
+            self.deliveries.remove(run_id)
+
+        return [run for run in runs if run.pk not in missed_ids]
+
+    def _get_worker_selector(self):
+        """
+        Return a worker selector (see ``JOB_RUNNER_WORKER_SELECTOR``).
+
+        The number of active runs per worker is fetched in one query. The runs
+        which are broadcasted but not picked up yet are counted as active.
+        Since these are only known by this shard, the selector splits the
+        capacity of the workers between the shards.
+
+        """
+        in_flight_runs = self.deliveries.get_worker_counts()
+        active_runs = dict(in_flight_runs)
+        counts = Run.objects.active().filter(worker__isnull=False).values(
+            'worker').annotate(count=Count('pk')).order_by()
+
+        for row in counts:
+            active_runs[row['worker']] = (
+                active_runs.get(row['worker'], 0) + row['count'])
+
+        return get_worker_selector_class()(
+            active_runs,
+            in_flight_runs=in_flight_runs,
+            shard=self.shard,
+            shards=settings.JOB_RUNNER_BROADCASTER_SHARDS,
+        )
+
+    def _get_redelivery_worker(self, run, workers):
+        """
+        Return the worker to which ``run`` was broadcasted before.
+
+        ``None`` is returned when the worker is not in ``workers`` anymore or
+        when the run was already broadcasted :attr:`max_enqueue_attempts`
+        times to it. In that case, an other worker must be selected.
+
+        """
+        worker_id = self.deliveries.get_worker_id(run.pk)
+        attempts = self.deliveries.get_attempts(run.pk)
+
+        if attempts < self.max_enqueue_attempts:
+            for worker in workers:
+                if worker.pk == worker_id:
+                    return worker
+
+        logger.warning(
+            '{0} not picked up by worker {1} after {2} attempt(s)'.format(
+                run.log_name(), worker_id, attempts))
+        return None
+
+    def _get_enabled_workers(self, worker_pool, cache):
+        """
+        Return a ``list`` of enqueue-enabled workers of ``worker_pool``.
+
+        :param worker_pool:
+            The :class:`.WorkerPool` instance.
+
+        :param cache:
+            A ``dict`` used to cache the workers per worker-pool id (so that
+            the workers are fetched once per pool per broadcast pass).
+
+        """
+        if worker_pool.pk not in cache:
+            cache[worker_pool.pk] = list(
+                worker_pool.workers.filter(enqueue_is_enabled=True))
+        return cache[worker_pool.pk]
+
+    def _fan_out_run(self, run, workers):
+        """
+        Create a copy of ``run`` for each of the given ``workers``.
+
+        The runs are created with a single ``INSERT`` and get the schedule id
+        of ``run`` assigned. A counter is created for the schedule id, which
+        is used to detect the return of the last run (see
+        :meth:`.Run.register_return`).
+
+        :return:
+            A ``list`` of ``(run, worker)`` tuples.
+
+        """
+        schedule_id = run.get_schedule_id()
+
+        Run.objects.bulk_create([
+            Run(
+                job_id=run.job_id,
+                schedule_id=schedule_id,
+                worker=worker,
+                schedule_dts=run.schedule_dts,
+                is_manual=run.is_manual,
+                schedule_children=run.schedule_children,
+            ) for worker in workers
+        ])
+        ScheduleCounter.objects.create(
+            schedule_id=schedule_id, expected=len(workers))
+
+        # bulk_create doesn't set the primary keys, so we need to fetch the
+        # created runs
+        workers_by_id = dict((worker.pk, worker) for worker in workers)
+        assigned_runs = Run.objects.filter(
+            job=run.job_id,
+            schedule_id=schedule_id,
+            worker__in=workers_by_id.keys(),
+            enqueue_dts__isnull=True,
+        ).order_by('pk')
+
+        return [
+            (assigned_run, workers_by_id[assigned_run.worker_id])
+            for assigned_run in assigned_runs
+        ]
 
     def _broadcast_run(self, run, worker):
         """
@@ -149,11 +811,25 @@ class Command(NoArgsCommand):
     def _broadcast_kill_requests(self):
         """
         Broadcast kill-requests.
+
+        The broadcasted kill-requests get their ``enqueue_dts`` set (in one
+        query), so that they are only re-broadcasted when they are not
+        executed within ``JOB_RUNNER_KILL_REQUEST_RESEND_INTERVAL`` seconds.
+
         """
-        kill_requests = KillRequest.objects.killable().select_related()
+        now = timezone.now()
+        kill_requests = KillRequest.objects.killable(
+            resend_before=now - timedelta(
+                seconds=settings.JOB_RUNNER_KILL_REQUEST_RESEND_INTERVAL)
+        ).select_related()
+        enqueued_ids = []
 
         for kill_request in kill_requests:
             run = kill_request.run
+
+            if not self._in_shard(run.job_id):
+                continue
+
             worker = run.worker
             message = [
                 'master.broadcast.{0}'.format(worker.api_key),
@@ -164,18 +840,38 @@ class Command(NoArgsCommand):
             ]
             logger.info('Sending: {0}'.format(message))
             self.publisher.send_multipart(message)
+            enqueued_ids.append(kill_request.pk)
+
+        if enqueued_ids:
+            KillRequest.objects.filter(pk__in=enqueued_ids).update(
+                enqueue_dts=now)
+            self.next_kill_resend_dts = now + timedelta(
+                seconds=settings.JOB_RUNNER_KILL_REQUEST_RESEND_INTERVAL)
 
     def _broadcast_worker_ping(self):
         """
-        Broadcast ping-request to all the workers.
+        Broadcast ping-request to all the enqueue-enabled workers.
+
+        The ping sequence number and request dts of the workers are updated
+        in one query, the worker sends back the sequence number on response
+        so that the round-trip time can be calculated.
+
         """
-        workers = Worker.objects.all()
+        now = timezone.now()
+        workers = Worker.objects.filter(enqueue_is_enabled=True)
+        workers.update(
+            ping_request_seq=F('ping_request_seq') + 1,
+            ping_request_dts=now,
+        )
 
-        for worker in workers:
+        for api_key, ping_request_seq in workers.values_list(
+                'api_key', 'ping_request_seq'):
             message = [
-                'master.broadcast.{0}'.format(worker.api_key),
+                'master.broadcast.{0}'.format(api_key),
                 json.dumps({
                     'action': 'ping',
+                    'seq': ping_request_seq,
+                    'sent_ts': dts_to_timestamp(now),
                 })
             ]
             logger.debug('Sending: {0}'.format(message))
@@ -0,0 +1,41 @@
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+from job_runner.apps.job_runner.models import Job
+
+
+class Command(NoArgsCommand):
+    help = (
+        'Check that the effective enqueue state of the jobs matches the '
+        'enqueue state of the jobs, job-templates, projects and worker-pools'
+    )
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--fix',
+            action='store_true',
+            dest='fix',
+            default=False,
+            help='Fix the jobs with an incorrect effective enqueue state',
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        jobs = Job.objects.effective_enqueue_mismatches().select_related()
+
+        for job in jobs:
+            self.stdout.write(
+                u'Incorrect effective enqueue state for {0}\n'.format(
+                    job.log_name()))
+
+        if not jobs:
+            self.stdout.write('All good!\n')
+        elif options['fix']:
+            Job.objects.update_effective_enqueue_is_enabled(
+                pk__in=[job.pk for job in jobs])
+            self.stdout.write('Fixed {0} job(s)\n'.format(len(jobs)))
+        else:
+            raise CommandError(
+                'Found {0} job(s) with an incorrect effective enqueue '
+                'state, use --fix to fix them'.format(len(jobs)))
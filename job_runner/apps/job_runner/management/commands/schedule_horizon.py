@@ -0,0 +1,99 @@
+import logging
+from datetime import timedelta
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import CommandError, NoArgsCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from job_runner.apps.job_runner import notifications
+from job_runner.apps.job_runner.broadcaster import notify_broadcaster
+from job_runner.apps.job_runner.models import Job, RescheduleException, Run
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(NoArgsCommand):
+    help = 'Pre-schedule the runs of the periodic jobs for the next hours'
+
+    option_list = NoArgsCommand.option_list + (
+        make_option(
+            '--hours',
+            type='int',
+            dest='hours',
+            default=None,
+            help=(
+                'The number of hours to schedule ahead (defaults to '
+                'JOB_RUNNER_SCHEDULE_HORIZON)'
+            ),
+        ),
+    )
+
+    def handle_noargs(self, **options):
+        hours = options['hours'] or settings.JOB_RUNNER_SCHEDULE_HORIZON
+
+        if not hours:
+            raise CommandError(
+                'JOB_RUNNER_SCHEDULE_HORIZON is not set, use --hours')
+
+        with transaction.commit_on_success():
+            runs = self._get_runs(timezone.now() + timedelta(hours=hours))
+            Run.objects.bulk_create(runs)
+
+        # the broadcaster must be notified after the commit, else it resyncs
+        # before the runs are visible
+        if runs:
+            notify_broadcaster('runs_scheduled')
+
+        self.stdout.write('Scheduled {0} run(s)\n'.format(len(runs)))
+
+    def _get_runs(self, until):
+        """
+        Return a ``list`` of unsaved runs, scheduled up to ``until``.
+
+        The runs are incremented from the last non-manual run of each
+        enqueue-enabled job which is setup for re-scheduling. Jobs without
+        any non-manual run are skipped (like when rescheduling).
+
+        """
+        job_qs = Job.objects.filter(
+            effective_enqueue_is_enabled=True,
+        ).exclude(
+            reschedule_interval_type='',
+        )
+
+        last_schedule_dts = {}
+
+        for row in Run.objects.filter(
+                job__in=job_qs, is_manual=False).values('job').annotate(
+                    last_schedule_dts=Max('schedule_dts')).order_by():
+            last_schedule_dts[row['job']] = row['last_schedule_dts']
+
+        runs = []
+
+        for job in job_qs.prefetch_related('rescheduleexclude_set'):
+            if (not job.has_reschedule_interval() or
+                    job.pk not in last_schedule_dts):
+                continue
+
+            try:
+                reschedule_dates = job.get_reschedule_dates(
+                    last_schedule_dts[job.pk], until)
+            except RescheduleException:
+                logger.error(
+                    'Reschedule failed for {0}: RescheduleException'.format(
+                        job.log_name()))
+                notifications.reschedule_failed(job)
+                continue
+
+            for reschedule_date in reschedule_dates:
+                runs.append(Run(job=job, schedule_dts=reschedule_date))
+
+            if reschedule_dates:
+                logger.info('Scheduled {0} run(s) for {1} up to {2}'.format(
+                    len(reschedule_dates), job.log_name(), until))
+
+        return runs
@@ -0,0 +1,35 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from job_runner.apps.job_runner import notifications
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(NoArgsCommand):
+    help = 'Deliver the queued e-mail notifications'
+
+    @transaction.commit_manually
+    def handle_noargs(self, **options):
+        logger.info('Starting notification sender')
+
+        while True:
+            try:
+                notifications.queue_digests()
+                num_sent = notifications.send_queued_notifications()
+            except Exception:
+                logger.exception(
+                    'Something went wrong, rolling back transaction')
+                transaction.rollback()
+            else:
+                transaction.commit()
+                if num_sent:
+                    logger.info('Sent {0} notification e-mail(s)'.format(
+                        num_sent))
+
+            time.sleep(settings.JOB_RUNNER_NOTIFICATION_SEND_INTERVAL)
@@ -1,8 +1,87 @@
 from django.db import models
-from django.db.models import Q
+from django.db.models import F, Q
 from django.utils import timezone
 
 
+def _enqueue_disabled_q():
+    """
+    Return a ``Q`` object matching jobs for which enqueue is disabled.
+
+    This is the case when enqueue is disabled for the job itself, or for its
+    job-template, project or worker-pool.
+
+    """
+    return (
+        Q(enqueue_is_enabled=False) |
+        Q(job_template__enqueue_is_enabled=False) |
+        Q(job_template__project__enqueue_is_enabled=False) |
+        Q(worker_pool__enqueue_is_enabled=False)
+    )
+
+
+class JobManager(models.Manager):
+    """
+    Custom manager for the Job model.
+    """
+    def update_effective_enqueue_is_enabled(self, **filters):
+        """
+        Re-calculate ``effective_enqueue_is_enabled`` for the matching jobs.
+
+        This is done with (max.) two ``UPDATE`` queries and should be called
+        every time the ``enqueue_is_enabled`` of a job-template, project or
+        worker-pool changes.
+
+        :param filters:
+            Keyword arguments to filter the jobs to update.
+
+        :return:
+            The number of updated jobs.
+
+        """
+        qs = self.get_query_set().filter(**filters)
+
+        return (
+            qs.filter(_enqueue_disabled_q()).filter(
+                effective_enqueue_is_enabled=True).update(
+                    effective_enqueue_is_enabled=False) +
+            qs.exclude(_enqueue_disabled_q()).filter(
+                effective_enqueue_is_enabled=False).update(
+                    effective_enqueue_is_enabled=True)
+        )
+
+    def invalidate_notification_addresses(self, **filters):
+        """
+        Reset ``effective_notification_addresses`` for the matching jobs.
+
+        This should be called every time the ``notification_addresses`` of a
+        job-template, project or worker-pool changes. The addresses are
+        resolved again by :meth:`.Job.get_notification_addresses`.
+
+        :param filters:
+            Keyword arguments to filter the jobs to update.
+
+        :return:
+            The number of updated jobs.
+
+        """
+        return self.get_query_set().filter(**filters).update(
+            effective_notification_addresses=None)
+
+    def effective_enqueue_mismatches(self):
+        """
+        Return a QS filtered on jobs with an incorrect
+        ``effective_enqueue_is_enabled`` value.
+        """
+        qs = self.get_query_set()
+
+        return qs.filter(
+            Q(pk__in=qs.filter(_enqueue_disabled_q()).filter(
+                effective_enqueue_is_enabled=True).values('pk')) |
+            Q(pk__in=qs.exclude(_enqueue_disabled_q()).filter(
+                effective_enqueue_is_enabled=False).values('pk'))
+        )
+
+
 class RunManager(models.Manager):
     """
     Custom manager for the Run model.
@@ -14,6 +93,52 @@ class RunManager(models.Manager):
         qs = self.get_query_set()
         return qs.filter(enqueue_dts__isnull=True)
 
+    def active(self):
+        """
+        Return a QS filtered on run's that are enqueued but not returned yet.
+        """
+        qs = self.get_query_set()
+        return qs.filter(enqueue_dts__isnull=False, return_dts__isnull=True)
+
+    def with_schedule_ids(self, schedule_ids):
+        """
+        Return a QS filtered on run's with one of the given schedule ids.
+
+        A run without ``schedule_id`` has its own id as schedule id (see
+        :meth:`.Run.get_schedule_id`).
+
+        :param schedule_ids:
+            A ``list`` of schedule ids.
+
+        """
+        qs = self.get_query_set()
+        return qs.filter(
+            Q(schedule_id__in=schedule_ids) |
+            Q(schedule_id__isnull=True, pk__in=schedule_ids)
+        )
+
+    def last_completed(self):
+        """
+        Return a QS filtered on the completed run's of the last completed
+        schedule of their job.
+
+        This is done with a join against ``Job.last_completed_schedule_id``,
+        so it can be combined with other filters (eg: on the project) without
+        fetching the jobs first.
+
+        """
+        qs = self.get_query_set()
+        return qs.filter(
+            Q(schedule_id=F('job__last_completed_schedule_id')) |
+            Q(
+                schedule_id__isnull=True,
+                pk=F('job__last_completed_schedule_id')
+            ),
+            enqueue_dts__isnull=False,
+            start_dts__isnull=False,
+            return_dts__isnull=False,
+        )
+
     def enqueueable(self):
         """
         Return a QS filtered on runs's that are ready to enqueue.
@@ -26,38 +151,34 @@ class RunManager(models.Manager):
         )
         scheduled = self.scheduled()
 
+        # the runs of a job which runs on all workers that were assigned to
+        # a worker, but not picked up yet (eg: because the worker was
+        # saturated or didn't receive the run), while other runs of the same
+        # schedule are active already
+        active_schedule_siblings = scheduled.filter(
+            worker__isnull=False,
+            schedule_id__in=self.get_query_set().filter(
+                enqueue_dts__isnull=False,
+                return_dts__isnull=True,
+                schedule_id__isnull=False,
+            ).values('schedule_id'),
+        )
+
         return scheduled.filter(
             # make sure it should be running now
             schedule_dts__lte=timezone.now(),
         ).exclude(
-            # exclude auto scheduled jobs when enqueue is disabled
-
-            # when job enqueue is disabled
+            # exclude auto scheduled jobs when enqueue is disabled for the
+            # job, job-template, project or worker-pool
             Q(
-                job__enqueue_is_enabled=False,
+                job__effective_enqueue_is_enabled=False,
                 is_manual=False
-            ) |
-
-            # when job-template enqueue is disabled
-            Q(
-                job__job_template__enqueue_is_enabled=False,
-                is_manual=False
-            ) |
-
-            # when project enqueue is disabled
-            Q(
-                job__job_template__project__enqueue_is_enabled=False,
-                is_manual=False
-            ) |
-
-            # when worker-pool enqueue is disabled
-            Q(
-                job__worker_pool__enqueue_is_enabled=False,
-                is_manual=False
-            ) |
-
-            # exclude jobs that are still active
-            Q(job__in=active_jobs)
+            )
+        ).filter(
+            # exclude jobs that are still active, except for the runs of the
+            # active schedule
+            ~Q(job__in=active_jobs) |
+            Q(pk__in=active_schedule_siblings.values('pk'))
         )
 
 
@@ -65,18 +186,30 @@ class KillRequestManager(models.Manager):
     """
     Custom manager for the KillRequest model.
     """
-    def killable(self):
+    def killable(self, resend_before=None):
         """
         Return a QS filtered on requests that are killable.
+
+        :param resend_before:
+            When set to a :class:`datetime.datetime`, the requests which were
+            enqueued before this date (but not executed yet) are included.
+
         """
         qs = self.get_query_set()
 
+        if resend_before:
+            qs = qs.filter(
+                Q(enqueue_dts__isnull=True) |
+                Q(enqueue_dts__lte=resend_before)
+            )
+        else:
+            qs = qs.filter(enqueue_dts__isnull=True)
+
         return qs.filter(
             # this should be always the case
             schedule_dts__lte=timezone.now(),
 
             # make sure it hasn't been executed already
-            enqueue_dts__isnull=True,
             execute_dts__isnull=True,
 
             # make sure a pid is assigned to the run
@@ -1,29 +1,38 @@
 import calendar
-from datetime import timedelta
+from datetime import datetime, timedelta
 import logging
 
 from django.conf import settings
 from django.contrib.auth.models import Group
 from django.core.exceptions import ValidationError
 from django.db import models
-from django.db.models import signals
+from django.db.models import F, signals
 from django.template import Context, Template
 from django.utils import timezone
 from smart_selects.db_fields import ChainedForeignKey
 
 from job_runner.apps.job_runner import notifications
-from job_runner.apps.job_runner.managers import KillRequestManager, RunManager
-from job_runner.apps.job_runner.signals import post_run_update, post_run_create
-from job_runner.apps.job_runner.utils import correct_dst_difference
+from job_runner.apps.job_runner.cron import (
+    InvalidCronExpression, get_cron_expression, get_next_dts)
+from job_runner.apps.job_runner.managers import (
+    JobManager, KillRequestManager, RunManager)
+from job_runner.apps.job_runner.signals import (
+    post_kill_request_create, post_run_create, post_run_delete,
+    post_run_update)
+from job_runner.apps.job_runner.utils import (
+    correct_dst_difference, time_to_microseconds, timedelta_to_microseconds)
 
 logger = logging.getLogger(__name__)
 
+_compiled_templates = {}
+
 
 RESCHEDULE_INTERVAL_TYPE_CHOICES = (
     ('MINUTE', 'Every x minutes'),
     ('HOUR', 'Every x hours'),
     ('DAY', 'Every x days'),
     ('MONTH', 'Every x months'),
+    ('CRON', 'Cron expression'),
 )
 
 
@@ -35,6 +44,16 @@ def validate_positive(value):
         raise ValidationError(u'The input should be greater than 0.')
 
 
+def validate_cron_expression(value):
+    """
+    Validate that the value is a valid cron-expression.
+    """
+    try:
+        get_cron_expression(value)
+    except InvalidCronExpression as e:
+        raise ValidationError(u'Invalid cron expression: {0}'.format(e))
+
+
 def validate_no_recursion(value, seen=[]):
     """
     Validate that there is no recursion in the job-chain.
@@ -105,9 +124,31 @@ class Project(models.Model):
         )
     )
 
+    def __init__(self, *args, **kwargs):
+        super(Project, self).__init__(*args, **kwargs)
+        self._saved_enqueue_is_enabled = self.enqueue_is_enabled
+        self._saved_notification_addresses = self.notification_addresses
+
     def __unicode__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        """
+        Override default save to update the effective enqueue state and
+        notification addresses of jobs.
+        """
+        super(Project, self).save(*args, **kwargs)
+
+        if self.enqueue_is_enabled != self._saved_enqueue_is_enabled:
+            Job.objects.update_effective_enqueue_is_enabled(
+                job_template__project=self)
+            self._saved_enqueue_is_enabled = self.enqueue_is_enabled
+
+        if self.notification_addresses != self._saved_notification_addresses:
+            Job.objects.invalidate_notification_addresses(
+                job_template__project=self)
+            self._saved_notification_addresses = self.notification_addresses
+
     def get_notification_addresses(self):
         """
         Return a ``list`` notification addresses.
@@ -145,15 +186,134 @@ class Worker(models.Model):
     concurrent_jobs = models.PositiveIntegerField(
         blank=True, null=True, editable=False)
 
+    # the sequence number and dts of the last ping request, the worker will
+    # send back the sequence number on ping response
+    ping_request_seq = models.PositiveIntegerField(default=0, editable=False)
+    ping_request_dts = models.DateTimeField(
+        blank=True, null=True, editable=False)
+    ping_response_seq = models.PositiveIntegerField(
+        blank=True, null=True, editable=False)
+
+    # round-trip times (in ms) of the last ping requests (oldest first)
+    ping_rtt_history = models.CommaSeparatedIntegerField(
+        max_length=255, blank=True, default='', editable=False)
+
+    # the fields which are not written by a save of an existing worker
+    _ping_fields = ('ping_request_seq', 'ping_request_dts', 'ping_rtt_history')
+
+    def __init__(self, *args, **kwargs):
+        super(Worker, self).__init__(*args, **kwargs)
+        self._saved_ping_response_seq = self.ping_response_seq
+
     def __unicode__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # the round-trip time is measured at the moment the response is
+        # received, since the clock of the worker could be off
+        now = timezone.now()
+
+        if self._state.adding or kwargs.get('force_insert'):
+            super(Worker, self).save(*args, **kwargs)
+        else:
+            # the ping request fields are updated concurrently by the
+            # broadcaster, and the ping RTT history is only updated on ping
+            # response (see ``_save_ping_rtt``), so these columns are left
+            # as they are
+            saved_values = {}
+            for name in self._ping_fields:
+                saved_values[name] = getattr(self, name)
+                setattr(self, name, F(name))
+
+            try:
+                super(Worker, self).save(*args, **kwargs)
+            finally:
+                for name, value in saved_values.items():
+                    setattr(self, name, value)
+
+            if self.ping_response_seq != self._saved_ping_response_seq:
+                self._save_ping_rtt(now)
+
+        self._saved_ping_response_seq = self.ping_response_seq
+
+    def _save_ping_rtt(self, now):
+        """
+        Save the round-trip time of the ping response.
+
+        The RTT is only saved when the response matches the last ping request
+        and the update is filtered on this request, so a ping request sent by
+        the broadcaster in the meantime is never taken for the answered one.
+
+        :param now:
+            The :class:`datetime.datetime` the response was received.
+
+        """
+        values = Worker.objects.filter(pk=self.pk).values(*self._ping_fields)
+        for name, value in values[0].items():
+            setattr(self, name, value)
+
+        if (self.ping_response_seq != self.ping_request_seq or
+                not self.ping_request_dts):
+            return
+
+        self.add_ping_rtt(now - self.ping_request_dts)
+        Worker.objects.filter(
+            pk=self.pk,
+            ping_request_seq=self.ping_request_seq,
+            ping_request_dts=self.ping_request_dts,
+        ).update(ping_rtt_history=self.ping_rtt_history)
+
+    def add_ping_rtt(self, rtt):
+        """
+        Add a ping round-trip time to the ping RTT history.
+
+        The history is limited to ``JOB_RUNNER_WORKER_PING_RTT_HISTORY``
+        entries, the oldest entries are dropped when the history doesn't fit
+        the column.
+
+        :param rtt:
+            A :class:`datetime.timedelta` instance.
+
+        """
+        rtt_ms = (rtt.days * 86400 + rtt.seconds) * 1000 + \
+            rtt.microseconds / 1000
+        history = self.get_ping_rtt_history() + [max(rtt_ms, 0)]
+        history = history[-settings.JOB_RUNNER_WORKER_PING_RTT_HISTORY:]
+
+        max_length = self._meta.get_field('ping_rtt_history').max_length
+        while len(','.join([str(x) for x in history])) > max_length:
+            history = history[1:]
+
+        self.ping_rtt_history = ','.join([str(x) for x in history])
+
+    def get_ping_rtt_history(self):
+        """
+        Return a ``list`` of ping round-trip times in ms (oldest first).
+        """
+        if not self.ping_rtt_history:
+            return []
+        return [int(x) for x in self.ping_rtt_history.split(',')]
+
+    def get_ping_rtt(self):
+        """
+        Return the average ping round-trip time in ms or ``None``.
+        """
+        history = self.get_ping_rtt_history()
+
+        if not history:
+            return None
+        return sum(history) / len(history)
+
     def log_name(self):
         return u'"{0}"({1})'.format(self.title, self.pk)
 
-    def is_responsive(self):
+    def is_responsive(self, log_unresponsive=True):
         """
         Return ``bool`` indicating if the worker is resposive.
+
+        :param log_unresponsive:
+            Log an error when the worker is not responsive (default ``True``).
+
         """
         unresponsive_intervals = \
             settings.JOB_RUNNER_WORKER_UNRESPONSIVE_AFTER_INTERVALS
@@ -167,7 +327,9 @@ class Worker(models.Model):
             if self.ping_response_dts + acceptable_delta >= timezone.now():
                 return True
 
-        logger.error('Worker {0} is not responsive'.format(self.log_name()))
+        if log_unresponsive:
+            logger.error(
+                'Worker {0} is not responsive'.format(self.log_name()))
         return False
 
     class Meta:
@@ -194,12 +356,32 @@ class WorkerPool(models.Model):
     )
     workers = models.ManyToManyField(Worker)
 
+    def __init__(self, *args, **kwargs):
+        super(WorkerPool, self).__init__(*args, **kwargs)
+        self._saved_enqueue_is_enabled = self.enqueue_is_enabled
+        self._saved_notification_addresses = self.notification_addresses
+
     def __unicode__(self):
         return self.title
 
     def log_name(self):
         return u'"{0}"({1})'.format(self.title, self.pk)
 
+    def save(self, *args, **kwargs):
+        """
+        Override default save to update the effective enqueue state and
+        notification addresses of jobs.
+        """
+        super(WorkerPool, self).save(*args, **kwargs)
+
+        if self.enqueue_is_enabled != self._saved_enqueue_is_enabled:
+            Job.objects.update_effective_enqueue_is_enabled(worker_pool=self)
+            self._saved_enqueue_is_enabled = self.enqueue_is_enabled
+
+        if self.notification_addresses != self._saved_notification_addresses:
+            Job.objects.invalidate_notification_addresses(worker_pool=self)
+            self._saved_notification_addresses = self.notification_addresses
+
     def get_notification_addresses(self):
         """
         Return a ``list`` notification addresses.
@@ -234,21 +416,89 @@ class JobTemplate(models.Model):
             'the worker queue. This will not affect already running jobs.'
         )
     )
+    # incremented when the body changes, the script content of the jobs is
+    # re-rendered lazily (see Job.get_script_content)
+    revision = models.PositiveIntegerField(default=1, editable=False)
+
+    def __init__(self, *args, **kwargs):
+        super(JobTemplate, self).__init__(*args, **kwargs)
+        self._saved_body = self.body
+        self._saved_enqueue_state = self._get_enqueue_state()
+        self._saved_notification_state = self._get_notification_state()
 
     def __unicode__(self):
         return u'{0} > {1}'.format(self.project, self.title)
 
     def save(self, *args, **kwargs):
         """
-        Override default save to re-save jobs.
+        Override default save to invalidate the script content of the jobs.
 
-        This will make sure that when the template changed, the cached version
-        will be updated on the job level.
+        Instead of re-saving all the jobs, the revision is incremented when
+        the body changed. The effective enqueue state and notification
+        addresses of the jobs are updated in bulk.
 
         """
-        super(JobTemplate, self).save(*args, **kwargs)
-        for job in self.job_set.all():
-            job.save()
+        if self._state.adding or kwargs.get('force_insert'):
+            super(JobTemplate, self).save(*args, **kwargs)
+        else:
+            # the revision is incremented by the database, so concurrent
+            # saves never end up with the same revision for different bodies
+            revision = self.revision
+            if self.body != self._saved_body:
+                self.revision = F('revision') + 1
+            else:
+                self.revision = F('revision')
+
+            try:
+                super(JobTemplate, self).save(*args, **kwargs)
+            except:
+                self.revision = revision
+                raise
+
+            self.revision = JobTemplate.objects.filter(
+                pk=self.pk).values_list('revision', flat=True)[0]
+
+        self._saved_body = self.body
+
+        if self._get_enqueue_state() != self._saved_enqueue_state:
+            Job.objects.update_effective_enqueue_is_enabled(job_template=self)
+            self._saved_enqueue_state = self._get_enqueue_state()
+
+        if self._get_notification_state() != self._saved_notification_state:
+            Job.objects.invalidate_notification_addresses(job_template=self)
+            self._saved_notification_state = self._get_notification_state()
+
+    def _get_enqueue_state(self):
+        """
+        Return a ``tuple`` of the fields affecting the effective enqueue state
+        of the jobs.
+        """
+        return (self.enqueue_is_enabled, self.project_id)
+
+    def _get_notification_state(self):
+        """
+        Return a ``tuple`` of the fields affecting the notification addresses
+        of the jobs.
+        """
+        return (self.notification_addresses, self.project_id)
+
+    def get_compiled_body(self):
+        """
+        Return the compiled body (:class:`~django.template.Template`).
+
+        The compiled body is cached (per process) until the revision of the
+        job-template changes. The body is compared as well, since a revision
+        can be re-used when the transaction saving it was rolled back.
+
+        """
+        revision, body, template = _compiled_templates.get(
+            self.pk, (None, None, None))
+
+        if revision != self.revision or body != self.body:
+            template = Template(self.body)
+            _compiled_templates[self.pk] = (self.revision, self.body, template)
+
+        return template
 
     def get_notification_addresses(self):
         """
@@ -307,6 +557,9 @@ class Job(models.Model):
     )
     script_content_partial = models.TextField('script content')
     script_content = models.TextField(editable=False)
+    # the revision of the job-template the script content was rendered with
+    script_content_revision = models.PositiveIntegerField(
+        default=1, editable=False)
     enqueue_is_enabled = models.BooleanField(
         default=True,
         db_index=True,
@@ -315,6 +568,15 @@ class Job(models.Model):
             'This will not affect already running jobs.'
         )
     )
+    effective_enqueue_is_enabled = models.BooleanField(
+        default=True,
+        db_index=True,
+        editable=False,
+        help_text=(
+            'False when enqueue is disabled for the job, job-template, '
+            'project or worker-pool.'
+        )
+    )
     reschedule_interval = models.PositiveIntegerField(
         null=True,
         blank=True,
@@ -334,10 +596,25 @@ class Job(models.Model):
             'by the number of days in the month.'
         )
     )
+    reschedule_cron_expression = models.CharField(
+        max_length=255,
+        blank=True,
+        validators=[validate_cron_expression],
+        help_text=(
+            'Only used with the cron expression interval type '
+            '(eg: 15 2 * * mon-fri for every weekday at 02:15). '
+            'The time is in the local time-zone.'
+        )
+    )
     notification_addresses = models.TextField(
         help_text='Separate addresses by a newline',
         blank=True,
     )
+    # the addresses of the job, job-template, project and worker-pool
+    # separated by a newline, None when they must be resolved again (see
+    # get_notification_addresses)
+    effective_notification_addresses = models.TextField(
+        null=True, editable=False)
     fail_times = models.PositiveIntegerField(
         editable=False,
         default=0,
@@ -357,6 +634,8 @@ class Job(models.Model):
         editable=False,
     )
 
+    objects = JobManager()
+
     class Meta:
         ordering = (
             'job_template__project__title',
@@ -365,6 +644,12 @@ class Job(models.Model):
         )
         unique_together = (('title', 'job_template'),)
 
+    def __init__(self, *args, **kwargs):
+        super(Job, self).__init__(*args, **kwargs)
+        self._saved_enqueue_state = self._get_enqueue_state()
+        self._saved_script_state = self._get_script_state()
+        self._saved_notification_state = self._get_notification_state()
+
     def __unicode__(self):
         return u'{0} > {1}'.format(self.job_template, self.title)
 
@@ -372,14 +657,102 @@ class Job(models.Model):
         return u'"{0}"({1})'.format(self.title, self.pk)
 
     def save(self, *args, **kwargs):
-        t = Template(self.job_template.body)
-        c = Context({'content': self.script_content_partial})
-        self.script_content = t.render(c)
+        # only re-render when the script changed, a changed job-template body
+        # is handled by get_script_content
+        if not self.pk or self._get_script_state() != \
+                self._saved_script_state:
+            self._render_script_content()
+
+        # only re-calculate when needed, since this requires fetching the
+        # project and worker-pool (and jobs are saved on every run return)
+        if not self.pk or self._get_enqueue_state() != \
+                self._saved_enqueue_state:
+            self.effective_enqueue_is_enabled = \
+                self.get_effective_enqueue_is_enabled()
+
+        if not self.pk or self._get_notification_state() != \
+                self._saved_notification_state:
+            self.effective_notification_addresses = '\n'.join(
+                self._resolve_notification_addresses())
+
         super(Job, self).save(*args, **kwargs)
+        self._saved_enqueue_state = self._get_enqueue_state()
+        self._saved_script_state = self._get_script_state()
+        self._saved_notification_state = self._get_notification_state()
 
-    def get_notification_addresses(self):
+    def clean(self):
+        if (self.reschedule_interval_type == 'CRON' and
+                not self.reschedule_cron_expression):
+            raise ValidationError(
+                u'A cron expression is required for this interval type.')
+
+    def _get_script_state(self):
         """
-        Return a ``list`` of notification addresses.
+        Return a ``tuple`` of the fields affecting the script content.
+        """
+        return (self.job_template_id, self.script_content_partial)
+
+    def _render_script_content(self):
+        """
+        Render the script content with the (compiled) job-template body.
+        """
+        self.script_content = self.job_template.get_compiled_body().render(
+            Context({'content': self.script_content_partial}))
+        self.script_content_revision = self.job_template.revision
+
+    def get_script_content(self):
+        """
+        Return the script content, rendered with the job-template body.
+
+        When the body changed since the script content was rendered, it is
+        re-rendered and stored (without saving the whole job).
+
+        """
+        if self.script_content_revision != self.job_template.revision:
+            self._render_script_content()
+            Job.objects.filter(pk=self.pk).update(
+                script_content=self.script_content,
+                script_content_revision=self.script_content_revision,
+            )
+
+        return self.script_content
+
+    def _get_enqueue_state(self):
+        """
+        Return a ``tuple`` of the fields affecting the effective enqueue state.
+        """
+        return (
+            self.enqueue_is_enabled, self.job_template_id, self.worker_pool_id)
+
+    def get_effective_enqueue_is_enabled(self):
+        """
+        Return ``bool`` indicating if enqueue is enabled for this job.
+
+        This is the case when enqueue is enabled for the job, its job-template,
+        its project and its worker-pool.
+
+        """
+        return bool(
+            self.enqueue_is_enabled and
+            self.job_template.enqueue_is_enabled and
+            self.job_template.project.enqueue_is_enabled and
+            self.worker_pool.enqueue_is_enabled
+        )
+
+    def _get_notification_state(self):
+        """
+        Return a ``tuple`` of the fields affecting the notification addresses.
+        """
+        return (
+            self.notification_addresses,
+            self.job_template_id,
+            self.worker_pool_id,
+        )
+
+    def _resolve_notification_addresses(self):
+        """
+        Return a ``list`` of the addresses of the job, job-template, project
+        and worker-pool.
         """
         addresses = self.notification_addresses.strip().split('\n')
         addresses = [x.strip() for x in addresses if x.strip() != '']
@@ -387,6 +760,27 @@ class Job(models.Model):
         addresses.extend(self.worker_pool.get_notification_addresses())
         return addresses
 
+    def get_notification_addresses(self):
+        """
+        Return a ``list`` of notification addresses.
+
+        The addresses are resolved once and stored in
+        ``effective_notification_addresses`` (without saving the whole job),
+        until the addresses of the job-template, project or worker-pool
+        change.
+
+        """
+        if self.effective_notification_addresses is None:
+            self.effective_notification_addresses = '\n'.join(
+                self._resolve_notification_addresses())
+            Job.objects.filter(pk=self.pk).update(
+                effective_notification_addresses=(
+                    self.effective_notification_addresses),
+            )
+
+        return [
+            x for x in self.effective_notification_addresses.split('\n') if x]
+
     def schedule(self, dts=None):
         """
         Schedule the job to run at the given ``dts``.
@@ -406,7 +800,7 @@ class Job(models.Model):
             schedule_dts=dts,
         )
 
-    def reschedule(self):
+    def reschedule(self, active_schedule_ids=None, last_schedule_dts=None):
         """
         Reschedule job.
 
@@ -416,17 +810,23 @@ class Job(models.Model):
         it will send out an e-mail to the Job-Runner admins and the e-mail
         addresses that are setup for this job, script and server.
 
+        The optional arguments make it possible to fetch the data needed for
+        rescheduling in bulk (eg: by the queue broadcaster). When not given,
+        they are fetched from the database.
+
+        :param active_schedule_ids:
+            A ``list`` of the distinct schedule ids of the runs of this job
+            which are not returned yet.
+
+        :param last_schedule_dts:
+            The ``schedule_dts`` of the last non-manual run of this job.
+
         """
         # there is already an other run which is not finished yet, do
         # not re-schedule, it will be rescheduled when the other job
         # finishes
-        active_runs = self.run_set.filter(return_dts__isnull=True)
-        active_schedule_ids = []
-
-        # TODO: is there a way in the Django ORM to achieve the same?
-        for active_run in active_runs:
-            if not active_run.schedule_id in active_schedule_ids:
-                active_schedule_ids.append(active_run.schedule_id)
+        if active_schedule_ids is None:
+            active_schedule_ids = self.get_active_schedule_ids()
 
         # since we are pre-scheduling (a new run is created, before the
         # scheduled run is sent to the worker), having one schedule id is valid
@@ -437,27 +837,21 @@ class Job(models.Model):
 
         logger.info('Attempting rescheduling {0}'.format(self.log_name()))
 
-        # check if job is setup for re-scheduling
-        if self.reschedule_interval_type and self.reschedule_interval:
-            try:
-                # order by -pk to get the last non-manual scheduled run
-                # from which we need to increment
-                last_run = self.run_set.filter(
-                    is_manual=False).order_by('-pk')[0]
-            except IndexError:
-                logger.error('Reschedule failed for {0}: IndexError'.format(
-                    self.log_name()))
-                return
+        if self.has_reschedule_interval():
+            if last_schedule_dts is None:
+                try:
+                    # order by -pk to get the last non-manual scheduled run
+                    # from which we need to increment
+                    last_schedule_dts = self.run_set.filter(
+                        is_manual=False).order_by('-pk')[0].schedule_dts
+                except IndexError:
+                    logger.error(
+                        'Reschedule failed for {0}: IndexError'.format(
+                            self.log_name()))
+                    return
 
             try:
-                reschedule_date = self._get_reschedule_date(
-                    last_run.schedule_dts)
-
-                # correct daylight saving-time changes to make sure we keep
-                # re-scheduling at the same hour (in local time).
-                reschedule_date = correct_dst_difference(
-                    last_run.schedule_dts, reschedule_date)
-
+                reschedule_date = self.get_reschedule_date(last_schedule_dts)
                 self.schedule(reschedule_date)
                 logger.info('Rescheduled {0} for {1}'.format(
                     self.log_name(), reschedule_date))
@@ -467,6 +861,100 @@ class Job(models.Model):
                         self.log_name()))
                 notifications.reschedule_failed(self)
 
+    def has_reschedule_interval(self):
+        """
+        Return ``bool`` indicating if the job is setup for re-scheduling.
+        """
+        if self.reschedule_interval_type == 'CRON':
+            return bool(self.reschedule_cron_expression)
+        return bool(self.reschedule_interval_type and self.reschedule_interval)
+
+    def get_active_schedule_ids(self):
+        """
+        Return a ``list`` of the schedule ids of the active runs.
+
+        Active runs are runs which are not returned yet (including the
+        scheduled ones).
+
+        """
+        schedule_ids = set()
+
+        for pk, schedule_id in self.run_set.filter(
+                return_dts__isnull=True).values_list(
+                    'pk', 'schedule_id').order_by():
+            schedule_ids.add(schedule_id or pk)
+
+        return list(schedule_ids)
+
+    def get_reschedule_date(self, last_schedule_dts):
+        """
+        Return the reschedule date, incremented from ``last_schedule_dts``.
+
+        This doesn't change anything (in the database), the reschedule
+        excludes are fetched when they are not prefetched.
+
+        :param last_schedule_dts:
+            The ``schedule_dts`` of the last non-manual run.
+
+        :raises:
+            :exc:`.RescheduleException` when the reschedule date can not
+            be calculated.
+
+        :return:
+            An instance of :class:`datetime.datetime`.
+
+        """
+        reschedule_date = self._get_reschedule_date(last_schedule_dts)
+
+        # correct daylight saving-time changes to make sure we keep
+        # re-scheduling at the same hour (in local time). Cron expressions are
+        # already matched against the local time.
+        if self.reschedule_interval_type != 'CRON':
+            reschedule_date = correct_dst_difference(
+                last_schedule_dts, reschedule_date)
+
+        return reschedule_date
+
+    def get_reschedule_dates(self, last_schedule_dts, until):
+        """
+        Return the reschedule dates from ``last_schedule_dts`` to ``until``.
+
+        This is used for pre-scheduling the runs of a job (see
+        ``JOB_RUNNER_SCHEDULE_HORIZON``). Like :meth:`get_reschedule_date`,
+        this doesn't change anything (in the database).
+
+        :param last_schedule_dts:
+            The ``schedule_dts`` of the last non-manual run.
+
+        :param until:
+            An instance of :class:`datetime.datetime`.
+
+        :raises:
+            :exc:`.RescheduleException` when the reschedule date can not
+            be calculated.
+
+        :return:
+            A ``list`` of :class:`datetime.datetime` instances.
+
+        """
+        reschedule_dates = []
+        reschedule_date = last_schedule_dts
+
+        while True:
+            next_date = self.get_reschedule_date(reschedule_date)
+
+            # the daylight saving-time correction of an interval of an hour
+            # or less can result in the same date when the clock is set
+            # forward
+            if next_date <= reschedule_date:
+                next_date = self._get_reschedule_date(reschedule_date)
+
+            if next_date > until:
+                return reschedule_dates
+
+            reschedule_dates.append(next_date)
+            reschedule_date = next_date
+
     def _get_reschedule_incremented_dts(self, increment_date):
         """
         Increment the given ``reference_date`` with the reschedule interval.
@@ -474,11 +962,27 @@ class Job(models.Model):
         :param increment_date:
             An instance of :class:`!datetime.datetime` to increment.
 
+        :raises:
+            :exc:`.RescheduleException` when the cron expression does not
+            match any date.
+
         :return:
             An instance of :class:`!datetime.datetime`.
 
         """
-        if self.reschedule_interval_type == 'MINUTE':
+        if self.reschedule_interval_type == 'CRON':
+            reschedule_date = get_next_dts(
+                self.reschedule_cron_expression,
+                increment_date,
+                timezone.get_default_timezone()
+            )
+
+            if not reschedule_date:
+                raise RescheduleException(
+                    'No match for cron expression {0}'.format(
+                        self.reschedule_cron_expression))
+            return reschedule_date
+        elif self.reschedule_interval_type == 'MINUTE':
             return increment_date + timedelta(minutes=self.reschedule_interval)
         elif self.reschedule_interval_type == 'HOUR':
             return increment_date + timedelta(hours=self.reschedule_interval)
@@ -495,10 +999,108 @@ class Job(models.Model):
                     days=days_in_month[1])
             return reschedule_date
 
-    def _get_reschedule_date(
-            self,
-            reference_date,
-            increment_date=None):
+    def _get_reschedule_occurrence(self, increment_date, not_before):
+        """
+        Return the first incremented date which is not before ``not_before``.
+
+        This is the same as incrementing ``increment_date`` (at least once)
+        with :meth:`_get_reschedule_incremented_dts` until the result is not
+        before ``not_before``, but without iterating over all the increments
+        (eg: a job with an interval of one minute, which has been disabled for
+        a month).
+
+        :param increment_date:
+            An instance of :class:`!datetime.datetime` to increment.
+
+        :param not_before:
+            An instance of :class:`!datetime.datetime`.
+
+        :return:
+            An instance of :class:`!datetime.datetime`.
+
+        """
+        if self.reschedule_interval_type == 'CRON':
+            # the first match after the increment date and not before
+            # ``not_before`` (matches are per minute)
+            return self._get_reschedule_incremented_dts(max(
+                increment_date, not_before - timedelta(microseconds=1)))
+
+        reschedule_date = self._get_reschedule_incremented_dts(increment_date)
+
+        if reschedule_date >= not_before:
+            return reschedule_date
+
+        if self.reschedule_interval_type == 'MONTH':
+            # the number of days added depends on the month, once the day of
+            # the month is <= 28, every increment is the same day of the month
+            # x months later
+            while reschedule_date < not_before and reschedule_date.day > 28:
+                reschedule_date = self._get_reschedule_incremented_dts(
+                    reschedule_date)
+
+            months = (
+                (not_before.year - reschedule_date.year) * 12 +
+                not_before.month - reschedule_date.month - 1
+            )
+
+            if months >= self.reschedule_interval:
+                months -= months % self.reschedule_interval
+                month_index = (
+                    reschedule_date.year * 12 + reschedule_date.month - 1 +
+                    months
+                )
+                reschedule_date = reschedule_date.replace(
+                    year=month_index / 12, month=month_index % 12 + 1)
+
+            while reschedule_date < not_before:
+                reschedule_date = self._get_reschedule_incremented_dts(
+                    reschedule_date)
+
+            return reschedule_date
+
+        interval = timedelta_to_microseconds(reschedule_date - increment_date)
+        behind = timedelta_to_microseconds(not_before - reschedule_date)
+        increments = (behind + interval - 1) / interval
+
+        return reschedule_date + timedelta(
+            microseconds=increments * interval)
+
+    def _get_reschedule_after_exclude(self, reschedule_date, exclude):
+        """
+        Return the first increment of ``reschedule_date`` after ``exclude``.
+
+        :param reschedule_date:
+            An instance of :class:`!datetime.datetime` within ``exclude``.
+
+        :param exclude:
+            An instance of :class:`.RescheduleExclude`.
+
+        :return:
+            An instance of :class:`!datetime.datetime`.
+
+        """
+        if self.reschedule_interval_type == 'CRON':
+            tzinfo = timezone.get_default_timezone()
+            end_date = tzinfo.localize(datetime.combine(
+                reschedule_date.astimezone(tzinfo).date(), exclude.end_time))
+            return self._get_reschedule_incremented_dts(
+                max(reschedule_date, end_date))
+
+        next_date = self._get_reschedule_incremented_dts(reschedule_date)
+
+        if self.reschedule_interval_type == 'MONTH':
+            return next_date
+
+        # skip all the increments within the exclude at once
+        interval = timedelta_to_microseconds(next_date - reschedule_date)
+        remaining = (
+            time_to_microseconds(exclude.end_time) -
+            time_to_microseconds(reschedule_date.time())
+        )
+        return reschedule_date + timedelta(
+            microseconds=(remaining / interval + 1) * interval)
+
+    def _get_reschedule_date(self, reference_date):
         """
         Return a reschedule datetime.
 
@@ -509,11 +1111,6 @@ class Job(models.Model):
             The reference :class:`datetime.datetime` to generate the
             reschedule date from.
 
-        :param increment_date:
-            The :class:`datetime.datetime` to increment for calculating the
-            reschedule date. This is optional and when not set, the
-            ``reference_date`` will be used.
-
         :raises:
             :exc:`.RescheduleException` when the reschedule date can not
             be calculated. This is for example the case when a reschedule
@@ -528,26 +1125,25 @@ class Job(models.Model):
         reference_date = reference_date.astimezone(
             timezone.get_default_timezone())
 
-        if not increment_date:
-            increment_date = reference_date
+        first_date = self._get_reschedule_occurrence(
+            reference_date, timezone.now())
+        reschedule_date = first_date
+        excludes = list(self.rescheduleexclude_set.all())
 
-        reschedule_date = self._get_reschedule_incremented_dts(increment_date)
-
-        while reschedule_date < timezone.now():
-            reschedule_date = self._get_reschedule_incremented_dts(
-                reschedule_date)
+        while True:
+            for exclude in excludes:
+                if (reschedule_date.time() >= exclude.start_time and
+                        reschedule_date.time() <= exclude.end_time):
+                    break
+            else:
+                return reschedule_date
 
-        if (increment_date - reference_date) > timedelta(days=1):
-            raise RescheduleException(
-                'Unable to reschedule due to reschedule excludes')
+            if (reschedule_date - first_date) > timedelta(days=1):
+                raise RescheduleException(
+                    'Unable to reschedule due to reschedule excludes')
 
-        for exclude in self.rescheduleexclude_set.all():
-            if (reschedule_date.time() >= exclude.start_time and
-                    reschedule_date.time() <= exclude.end_time):
-                return self._get_reschedule_date(
-                    reference_date, reschedule_date)
-
-        return reschedule_date
+            reschedule_date = self._get_reschedule_after_exclude(
+                reschedule_date, exclude)
 
 
 class RescheduleExclude(models.Model):
@@ -586,9 +1182,21 @@ class Run(models.Model):
     objects = RunManager()
 
     class Meta:
+        # these fields (and the id, ascending) are covered by a composite
+        # index with the same directions, see migration 0033
         ordering = (
             '-return_dts', '-start_dts', '-enqueue_dts', 'schedule_dts')
 
+    def __init__(self, *args, **kwargs):
+        super(Run, self).__init__(*args, **kwargs)
+        self._saved_schedule_dts = self.schedule_dts
+        self._saved_return_dts = self.return_dts
+
+    def save(self, *args, **kwargs):
+        super(Run, self).save(*args, **kwargs)
+        self._saved_schedule_dts = self.schedule_dts
+        self._saved_return_dts = self.return_dts
+
     def log_name(self):
         return u'Id: {0} ({1})'.format(self.pk, self.job.log_name())
 
@@ -604,15 +1212,58 @@ class Run(models.Model):
         """
         Return a ``QuerySet`` instance for the siblings of this run.
         """
-        return self.__class__.objects.exclude(
+        return self.__class__.objects.with_schedule_ids(
+            [self.get_schedule_id()]
+        ).exclude(
             pk=self.pk,
-            schedule_id__isnull=True,
         ).filter(
-            schedule_id=self.schedule_id,
             job=self.job,
         )
 
+    def register_return(self):
+        """
+        Register the return of this run in the counter of its schedule id.
+
+        The counter is updated with a conditional ``UPDATE``, so that exactly
+        one of the runs sharing the schedule id is registered as the last one
+        to return, without locking the sibling runs. The counter is deleted
+        when the last run returned.
+
+        :return:
+            ``None`` when there is no counter for the schedule id (eg: the run
+            is not part of a fan-out, or one of the runs of the fan-out was
+            deleted before it returned, see :meth:`.get_siblings`), else a
+            ``tuple`` ``(is_last, failed)``, where ``failed`` is the number of
+            failed runs sharing the schedule id (``None`` when not the last).
+
+        """
+        failed = 0 if self.return_success else 1
+        counter_qs = ScheduleCounter.objects.filter(
+            schedule_id=self.get_schedule_id())
+
+        if counter_qs.filter(returned__lt=F('expected') - 1).update(
+                returned=F('returned') + 1, failed=F('failed') + failed):
+            return (False, None)
+
+        if counter_qs.filter(returned=F('expected') - 1).update(
+                returned=F('returned') + 1, failed=F('failed') + failed):
+            # the counter is complete now, the other runs can't match it
+            failed = counter_qs.values_list('failed', flat=True)[0]
+            counter_qs.delete()
+            return (True, failed)
+
+        return None
+
     def get_schedule_id(self):
+        """
+        Return the schedule id of this run.
+
+        Runs which are scheduled together (eg: the runs of a job which runs on
+        all workers) share the same schedule id. To avoid a second write when
+        creating a run, the ``schedule_id`` is only set when it differs from
+        the id of the run.
+
+        """
         if self.schedule_id:
             return self.schedule_id
         return self.pk
@@ -659,6 +1310,21 @@ class Run(models.Model):
         self.save()
 
 
+class ScheduleCounter(models.Model):
+    """
+    Contains the number of returned runs of a job which runs on all workers.
+
+    The counter is created when the run is fanned out to the workers and
+    is used to detect the return of the last run (see
+    :meth:`.Run.register_return`).
+
+    """
+    schedule_id = models.PositiveIntegerField(unique=True)
+    expected = models.PositiveIntegerField()
+    returned = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+
+
 class KillRequest(models.Model):
     """
     Contains requests to kill active runs.
@@ -682,5 +1348,49 @@ class RunLog(models.Model):
         ordering = ('-run',)
 
 
+class Notification(models.Model):
+    """
+    Contains the e-mail notifications which are waiting for delivery.
+
+    The notifications are delivered by ``manage.py send_notifications``.
+
+    """
+    recipient = models.CharField(max_length=255, db_index=True)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    create_dts = models.DateTimeField(auto_now_add=True)
+    next_attempt_dts = models.DateTimeField(db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ('pk',)
+
+    def __unicode__(self):
+        return u'{0} ({1})'.format(self.subject, self.recipient)
+
+
+class NotificationThrottle(models.Model):
+    """
+    Contains the token bucket for rate-limiting the notifications about the
+    same subject (eg: the failed runs of a job).
+
+    The notifications which are suppressed because the bucket is empty are
+    counted, so that they can be summarized in a digest.
+
+    """
+    key = models.CharField(max_length=255, unique=True)
+    tokens = models.FloatField()
+    update_dts = models.DateTimeField()
+    suppressed = models.PositiveIntegerField(default=0)
+    suppressed_since_dts = models.DateTimeField(null=True, db_index=True)
+    subject = models.CharField(max_length=255, blank=True)
+    addresses = models.TextField(blank=True)
+
+    def __unicode__(self):
+        return self.key
+
+
 signals.post_save.connect(post_run_update, sender=Run)
 signals.post_save.connect(post_run_create, sender=Run)
+signals.post_delete.connect(post_run_delete, sender=Run)
+signals.post_save.connect(post_kill_request_create, sender=KillRequest)
@@ -1,20 +1,70 @@
 import copy
 import logging
+from datetime import timedelta
 
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection
+from django.db import IntegrityError, transaction
 from django.template import Context
 from django.template.loader import get_template
+from django.utils import timezone
+
+from job_runner.apps.job_runner.utils import timedelta_to_microseconds
 
 logger = logging.getLogger(__name__)
 
 
+def queue_notification(subject, body, addresses):
+    """
+    Queue a notification for each of the given ``addresses``.
+
+    The notifications are stored in the outbox and delivered by
+    :func:`send_queued_notifications`, so that a slow mail server doesn't
+    block the caller.
+
+    :param subject:
+        The subject of the notification.
+
+    :param body:
+        The body of the notification.
+
+    :param addresses:
+        A ``list`` of e-mail addresses.
+
+    """
+    from job_runner.apps.job_runner.models import Notification
+
+    now = timezone.now()
+    recipients = []
+
+    for address in addresses:
+        if address not in recipients:
+            recipients.append(address)
+
+    Notification.objects.bulk_create([
+        Notification(
+            recipient=recipient,
+            subject=subject[:255],
+            body=body,
+            next_attempt_dts=now,
+        ) for recipient in recipients
+    ])
+
+
 def reschedule_failed(job):
     """
     Send out a notification that the given ``job`` failed to reschedule.
     """
     logger.error('Reschedule failed for {0}'.format(job.log_name()))
 
+    subject = 'Reschedule error for: {0}'.format(job.title)
+    addresses = copy.copy(settings.JOB_RUNNER_ADMIN_EMAILS)
+    addresses.extend(job.get_notification_addresses())
+
+    if not addresses or not _take_token(
+            'reschedule_failed:job:{0}'.format(job.pk), subject, addresses):
+        return
+
     t = get_template('job_runner/email/reschedule_failed.txt')
     c = Context({
         'job': job,
@@ -22,24 +72,34 @@ def reschedule_failed(job):
     })
     email_body = t.render(c)
 
-    addresses = copy.copy(settings.JOB_RUNNER_ADMIN_EMAILS)
-    addresses.extend(job.get_notification_addresses())
-
-    if addresses:
-        send_mail(
-            'Reschedule error for: {0}'.format(job.title),
-            email_body,
-            settings.DEFAULT_FROM_EMAIL,
-            addresses
-        )
+    queue_notification(subject, email_body, addresses)
 
 
 def run_failed(run):
     """
     Send out a notification that the given ``run`` failed.
+
+    The notifications are rate-limited per job and per worker-pool, so that
+    a dying worker-pool doesn't result in a notification for every run.
+
     """
     logger.error('Job run failed for {0}'.format(run.log_name()))
 
+    subject = 'Run error for: {0}'.format(run.job.title)
+    addresses = copy.copy(settings.JOB_RUNNER_ADMIN_EMAILS)
+    addresses.extend(run.job.get_notification_addresses())
+
+    if not addresses or not _take_token(
+            'run_failed:job:{0}'.format(run.job.pk), subject, addresses):
+        return
+
+    if not _take_token(
+            'run_failed:worker_pool:{0}'.format(run.job.worker_pool_id),
+            'Run errors in worker-pool: {0}'.format(
+                run.job.worker_pool.title),
+            addresses):
+        return
+
     t = get_template('job_runner/email/job_failed.txt')
     c = Context({
         'time_zone': settings.TIME_ZONE,
@@ -48,16 +108,7 @@ def run_failed(run):
     })
     email_body = t.render(c)
 
-    addresses = copy.copy(settings.JOB_RUNNER_ADMIN_EMAILS)
-    addresses.extend(run.job.get_notification_addresses())
-
-    if addresses:
-        send_mail(
-            'Run error for: {0}'.format(run.job.title),
-            email_body,
-            settings.DEFAULT_FROM_EMAIL,
-            addresses
-        )
+    queue_notification(subject, email_body, addresses)
 
 
 def worker_pool_unresponsive(worker_pool):
@@ -67,6 +118,16 @@ def worker_pool_unresponsive(worker_pool):
     logger.error('WorkerPool is unresponsive: {0}'.format(
         worker_pool.log_name()))
 
+    subject = 'Worker-pool unresponsive: {0}'.format(worker_pool.title)
+    addresses = copy.copy(settings.JOB_RUNNER_ADMIN_EMAILS)
+    addresses.extend(worker_pool.get_notification_addresses())
+
+    if not addresses or not _take_token(
+            'worker_pool_unresponsive:{0}'.format(worker_pool.pk),
+            subject,
+            addresses):
+        return
+
     t = get_template('job_runner/email/worker_pool_unresponsive.txt')
     c = Context({
         'worker_pool': worker_pool,
@@ -74,13 +135,245 @@ def worker_pool_unresponsive(worker_pool):
     })
     email_body = t.render(c)
 
-    addresses = copy.copy(settings.JOB_RUNNER_ADMIN_EMAILS)
-    addresses.extend(worker_pool.get_notification_addresses())
+    queue_notification(subject, email_body, addresses)
+
+
+def queue_digests():
+    """
+    Queue a digest for the notifications which were suppressed by the
+    rate-limit.
+
+    A digest is queued once the first suppressed notification is
+    ``JOB_RUNNER_NOTIFICATION_DIGEST_WINDOW`` seconds old.
+
+    :return:
+        The number of digests queued.
+
+    """
+    from job_runner.apps.job_runner.models import NotificationThrottle
+
+    now = timezone.now()
+    throttles = NotificationThrottle.objects.select_for_update().filter(
+        suppressed__gt=0,
+        suppressed_since_dts__lte=now - timedelta(
+            seconds=settings.JOB_RUNNER_NOTIFICATION_DIGEST_WINDOW))
+
+    num_queued = 0
+
+    for throttle in throttles:
+        t = get_template('job_runner/email/notification_digest.txt')
+        c = Context({
+            'time_zone': settings.TIME_ZONE,
+            'throttle': throttle,
+        })
+
+        queue_notification(
+            u'Digest of {0} notification(s): {1}'.format(
+                throttle.suppressed, throttle.subject),
+            t.render(c),
+            throttle.addresses.split('\n'),
+        )
+
+        throttle.suppressed = 0
+        throttle.suppressed_since_dts = None
+        throttle.save()
+        num_queued += 1
+
+    return num_queued
+
+
+def _take_token(key, subject, addresses):
+    """
+    Take a token from the rate-limit bucket of ``key``.
+
+    The bucket holds up to ``JOB_RUNNER_NOTIFICATION_BURST`` tokens and is
+    refilled with that number of tokens per
+    ``JOB_RUNNER_NOTIFICATION_DIGEST_WINDOW``. When the bucket is empty, the
+    notification is counted as suppressed (see :func:`queue_digests`).
+
+    The bucket is locked (``SELECT ... FOR UPDATE``) until the calling
+    transaction is committed. Concurrent notifications for the same key (eg:
+    failed runs within the same worker-pool) are serialized on this lock.
+
+    :param key:
+        The key of the bucket (eg: ``run_failed:job:1``).
+
+    :param subject:
+        The subject of the notification.
+
+    :param addresses:
+        A ``list`` of e-mail addresses of the notification.
+
+    :return:
+        ``True`` when a token was available and the notification must be
+        sent, else ``False``.
+
+    """
+    from job_runner.apps.job_runner.models import NotificationThrottle
+
+    now = timezone.now()
+    burst = settings.JOB_RUNNER_NOTIFICATION_BURST
+
+    if not NotificationThrottle.objects.filter(key=key).exists():
+        # an other process might be creating the same bucket, in which case
+        # the insert fails and we continue with the bucket it created
+        sid = transaction.savepoint()
+        try:
+            NotificationThrottle.objects.create(
+                key=key, tokens=burst, update_dts=now)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+        else:
+            transaction.savepoint_commit(sid)
+
+    throttle = NotificationThrottle.objects.select_for_update().get(key=key)
+
+    throttle.tokens = min(
+        burst,
+        throttle.tokens + float(burst) * timedelta_to_microseconds(
+            now - throttle.update_dts) / (
+                settings.JOB_RUNNER_NOTIFICATION_DIGEST_WINDOW * 1000000)
+    )
+    throttle.update_dts = now
+
+    if throttle.tokens >= 1:
+        throttle.tokens -= 1
+        is_allowed = True
+    else:
+        logger.warning('Notification rate-limit reached for {0}'.format(key))
+        throttle.suppressed += 1
+        if not throttle.suppressed_since_dts:
+            throttle.suppressed_since_dts = now
+        throttle.subject = subject[:255]
+
+        throttle_addresses = throttle.addresses.split('\n')
+        for address in addresses:
+            if address not in throttle_addresses:
+                throttle_addresses.append(address)
+        throttle.addresses = '\n'.join([a for a in throttle_addresses if a])
+        is_allowed = False
+
+    throttle.save(force_update=True)
+    return is_allowed
+
+
+def send_queued_notifications():
+    """
+    Deliver the queued notifications which are due.
+
+    The notifications for the same recipient are coalesced into a single
+    e-mail and all e-mails are sent over a single connection to the mail
+    server. When the delivery fails, it is retried after
+    ``JOB_RUNNER_NOTIFICATION_RETRY_INTERVAL`` seconds (doubled after every
+    failed attempt), until ``JOB_RUNNER_NOTIFICATION_MAX_ATTEMPTS`` is
+    reached.
+
+    :return:
+        The number of e-mails sent.
+
+    """
+    from job_runner.apps.job_runner.models import Notification
+
+    recipients = []
+    recipient_notifications = {}
+
+    for notification in Notification.objects.filter(
+            next_attempt_dts__lte=timezone.now()):
+        if notification.recipient not in recipient_notifications:
+            recipients.append(notification.recipient)
+            recipient_notifications[notification.recipient] = []
+        recipient_notifications[notification.recipient].append(notification)
+
+    if not recipients:
+        return 0
+
+    connection = get_connection()
+
+    try:
+        connection.open()
+    except Exception:
+        logger.exception('Could not connect to the mail server')
+        for recipient in recipients:
+            _retry_notifications(recipient_notifications[recipient])
+        return 0
+
+    num_sent = 0
+    sent_ids = []
+
+    try:
+        for recipient in recipients:
+            notifications = recipient_notifications[recipient]
+            try:
+                connection.send_messages(
+                    [_get_email_message(recipient, notifications)])
+            except Exception:
+                logger.exception(
+                    'Could not send notification(s) to {0}'.format(recipient))
+                _retry_notifications(notifications)
+            else:
+                num_sent += 1
+                sent_ids.extend([n.pk for n in notifications])
+    finally:
+        connection.close()
+
+    Notification.objects.filter(pk__in=sent_ids).delete()
+
+    return num_sent
+
+
+def _get_email_message(recipient, notifications):
+    """
+    Return the e-mail message for the given ``notifications``.
+
+    :param recipient:
+        The e-mail address of the recipient.
+
+    :param notifications:
+        A ``list`` of notifications for ``recipient``. When it contains more
+        than one notification, they are combined into a digest.
+
+    """
+    if len(notifications) == 1:
+        subject = notifications[0].subject
+        body = notifications[0].body
+    else:
+        subject = u'{0} (and {1} more)'.format(
+            notifications[0].subject, len(notifications) - 1)
+        body = u'\n\n'.join([
+            u'{0}\n{1}\n\n{2}'.format(
+                n.subject, '=' * len(n.subject), n.body)
+            for n in notifications
+        ])
+
+    return EmailMessage(
+        subject, body, settings.DEFAULT_FROM_EMAIL, [recipient])
+
+
+def _retry_notifications(notifications):
+    """
+    Schedule the next delivery attempt of the given ``notifications``.
+
+    The notifications are discarded when the maximum number of attempts has
+    been reached.
+
+    :param notifications:
+        A ``list`` of notifications for the same recipient.
+
+    """
+    from job_runner.apps.job_runner.models import Notification
+
+    attempts = max([n.attempts for n in notifications]) + 1
+    notification_qs = Notification.objects.filter(
+        pk__in=[n.pk for n in notifications])
 
-    if addresses:
-        send_mail(
-            'Worker-pool unresponsive: {0}'.format(worker_pool.title),
-            email_body,
-            settings.DEFAULT_FROM_EMAIL,
-            addresses
+    if attempts >= settings.JOB_RUNNER_NOTIFICATION_MAX_ATTEMPTS:
+        logger.error('Discarding {0} notification(s) to {1}'.format(
+            len(notifications), notifications[0].recipient))
+        notification_qs.delete()
+    else:
+        notification_qs.update(
+            attempts=attempts,
+            next_attempt_dts=timezone.now() + timedelta(
+                seconds=settings.JOB_RUNNER_NOTIFICATION_RETRY_INTERVAL *
+                2 ** (attempts - 1)),
         )
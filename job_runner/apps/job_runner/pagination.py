@@ -0,0 +1,254 @@
+import base64
+import json
+from urllib import urlencode
+
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import Q
+from django.db.models.fields import FieldDoesNotExist
+from tastypie.exceptions import BadRequest
+from tastypie.paginator import Paginator
+
+
+class KeysetPaginator(Paginator):
+    """
+    Paginator which pages on the ordering of the objects (keyset).
+
+    Keyset pagination is enabled by passing a ``cursor`` (an empty one for the
+    first page). The next page is requested by passing the ``next_cursor`` of
+    the current page as ``cursor``. This cursor is an opaque token containing
+    the ordering values of the last object of the page. The cost of a page
+    doesn't depend on its depth, and objects don't shift between pages when
+    they are inserted or updated while paging.
+
+    Requests without a ``cursor`` (and objects which are ordered on anything
+    else than the fields of the model) are paginated by ``offset``, like the
+    :class:`tastypie.paginator.Paginator`.
+
+    """
+    def get_keyset(self):
+        """
+        Return the keyset of the objects.
+
+        :return:
+            A ``list`` of ``(field, descending)`` tuples, ending with the
+            primary-key, or ``None`` when the objects can't be paginated on
+            their ordering.
+
+        """
+        query = getattr(self.objects, 'query', None)
+        if query is None or query.extra_order_by:
+            return None
+
+        meta = self.objects.model._meta
+        ordering = query.order_by
+        if not ordering and query.default_ordering:
+            ordering = meta.ordering
+
+        keyset = []
+        for name in ordering:
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+
+            if name == 'pk':
+                field = meta.pk
+            else:
+                try:
+                    field = meta.get_field(name)
+                except FieldDoesNotExist:
+                    return None
+
+            # ordering on a relation uses the ordering of the related model
+            if field.rel:
+                return None
+
+            keyset.append((field, descending))
+
+        # the primary-key is appended ascending, indexes covering the ordering
+        # must include it in that direction to avoid a sort
+        if not [field for field, descending in keyset if field.primary_key]:
+            keyset.append((meta.pk, False))
+
+        return keyset
+
+    def encode_cursor(self, keyset, obj):
+        """
+        Return the cursor for the objects after the given object.
+
+        :param keyset:
+            The keyset as returned by :meth:`.get_keyset`.
+
+        :param obj:
+            The last object of the page.
+
+        """
+        values = []
+        for field, descending in keyset:
+            if getattr(obj, field.attname) is None:
+                values.append(None)
+            else:
+                values.append(field.value_to_string(obj))
+
+        # the padding is stripped to keep the cursor URL-safe
+        return base64.urlsafe_b64encode(json.dumps(values)).rstrip('=')
+
+    def decode_cursor(self, keyset, cursor):
+        """
+        Return the ordering values contained by the given cursor.
+
+        :param keyset:
+            The keyset as returned by :meth:`.get_keyset`.
+
+        :param cursor:
+            The cursor as returned by :meth:`.encode_cursor`.
+
+        :raises:
+            ``BadRequest`` when the cursor is not valid.
+
+        """
+        try:
+            cursor = str(cursor)
+            values = json.loads(base64.urlsafe_b64decode(
+                cursor + '=' * (-len(cursor) % 4)))
+            if not isinstance(values, list) or len(values) != len(keyset):
+                raise ValueError('Cursor does not match the ordering')
+
+            return [
+                None if value is None else field.to_python(value)
+                for (field, descending), value in zip(keyset, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise BadRequest(
+                "Invalid cursor '{0}' provided.".format(cursor))
+
+    def get_after_q(self, keyset, values):
+        """
+        Return a ``Q`` object matching the objects after the given values.
+
+        :param keyset:
+            The keyset as returned by :meth:`.get_keyset`.
+
+        :param values:
+            The ordering values of the last object of the previous page.
+
+        :return:
+            A ``Q`` object, or ``None`` when there are no objects after the
+            given values.
+
+        """
+        # NULL is sorted as the smallest value, except by PostgreSQL and
+        # Oracle where it is the largest value
+        nulls_largest = connection.vendor in ('postgresql', 'oracle')
+
+        after_q = None
+        equal_q = Q()
+
+        for (field, descending), value in zip(keyset, values):
+            nulls_last = descending != nulls_largest
+
+            if value is None:
+                field_after_q = None
+                if not nulls_last:
+                    field_after_q = Q(
+                        **{'{0}__isnull'.format(field.name): False})
+            else:
+                field_after_q = Q(**{'{0}__{1}'.format(
+                    field.name, 'lt' if descending else 'gt'): value})
+                if nulls_last and field.null:
+                    field_after_q |= Q(
+                        **{'{0}__isnull'.format(field.name): True})
+
+            if field_after_q is not None:
+                field_after_q = equal_q & field_after_q
+                if after_q is None:
+                    after_q = field_after_q
+                else:
+                    after_q |= field_after_q
+
+            if value is None:
+                equal_q &= Q(**{'{0}__isnull'.format(field.name): True})
+            else:
+                equal_q &= Q(**{field.name: value})
+
+        return after_q
+
+    def get_next_cursor_uri(self, limit, cursor):
+        """
+        Return the URI of the page for the given cursor.
+        """
+        if cursor is None or self.resource_uri is None:
+            return None
+
+        try:
+            # QueryDict has a urlencode method that can handle multiple
+            # values for the same key
+            request_params = self.request_data.copy()
+            for key in ['limit', 'offset', 'cursor']:
+                if key in request_params:
+                    del request_params[key]
+            request_params.update({'limit': limit, 'cursor': cursor})
+            encoded_params = request_params.urlencode()
+        except AttributeError:
+            request_params = {}
+            for key, value in self.request_data.items():
+                if key in ['limit', 'offset', 'cursor']:
+                    continue
+                if isinstance(value, unicode):
+                    value = value.encode('utf-8')
+                request_params[key] = value
+            request_params.update({'limit': limit, 'cursor': cursor})
+            encoded_params = urlencode(request_params)
+
+        return '{0}?{1}'.format(self.resource_uri, encoded_params)
+
+    def page(self):
+        """
+        Return the requested page of objects and its meta-data.
+
+        Unlike offset pages, the meta-data of a keyset page doesn't contain
+        the ``total_count``, since counting all objects gets as expensive as
+        the deepest offset page.
+
+        """
+        keyset = self.get_keyset()
+        if keyset is None:
+            return super(KeysetPaginator, self).page()
+
+        # order on the full keyset, so objects with the same ordering values
+        # have a stable order for offset pages as well
+        self.objects = self.objects.order_by(*[
+            '{0}{1}'.format('-' if descending else '', field.name)
+            for field, descending in keyset
+        ])
+
+        cursor = self.request_data.get('cursor')
+        if cursor is None:
+            return super(KeysetPaginator, self).page()
+
+        limit = self.get_limit()
+        objects = self.objects
+
+        if cursor:
+            after_q = self.get_after_q(
+                keyset, self.decode_cursor(keyset, cursor))
+            if after_q is None:
+                objects = objects.none()
+            else:
+                objects = objects.filter(after_q)
+
+        next_cursor = None
+        if limit:
+            objects = list(objects[:limit + 1])
+            if len(objects) > limit:
+                objects = objects[:limit]
+                next_cursor = self.encode_cursor(keyset, objects[-1])
+
+        return {
+            self.collection_name: objects,
+            'meta': {
+                'limit': limit,
+                'previous': None,
+                'next': self.get_next_cursor_uri(limit, next_cursor),
+                'next_cursor': next_cursor,
+            },
+        }
@@ -1,16 +1,21 @@
 from job_runner.apps.job_runner import notifications
+from job_runner.apps.job_runner.broadcaster import notify_broadcaster
 
 
-def post_run_create(sender, instance, raw, **kwargs):
+def post_run_create(sender, instance, created, raw, **kwargs):
     """
     Post action after creating a run instance.
 
-    This will make sure the ``schedule_id`` field is set.
+    This will notify the queue broadcaster about the new run.
 
     """
-    if not instance.schedule_id:
-        instance.schedule_id = instance.id
-        instance.save()
+    if created and not raw:
+        notify_broadcaster(
+            'run_created',
+            job_id=instance.job_id,
+            run_id=instance.pk,
+            schedule_dts=instance.schedule_dts,
+        )
 
 
 def post_run_update(sender, instance, created, raw, **kwargs):
@@ -22,49 +27,127 @@ def post_run_update(sender, instance, created, raw, **kwargs):
         * send an error notification by e-mail when the job failed
         * disable the job when it failed more times than allowed
         * schedule it's children (if applicable)
+        * notify the queue broadcaster that the job is not active anymore
+        * notify the queue broadcaster when a scheduled run was re-scheduled
 
     """
     if created or raw:
         return
 
+    if (instance.enqueue_dts is None and
+            instance.schedule_dts != instance._saved_schedule_dts):
+        notify_broadcaster(
+            'run_updated',
+            job_id=instance.job_id,
+            run_id=instance.pk,
+            schedule_dts=instance.schedule_dts,
+        )
+
+    from job_runner.apps.job_runner.models import Job
+
     job = instance.job
 
     if instance.return_dts:
         if instance.return_success is False:
-            # the run failed
+            # the run failed, the job is reloaded since its cached
+            # notification addresses could have been invalidated after it
+            # was loaded
+            job = instance.job = Job.objects.get(pk=instance.job_id)
             notifications.run_failed(instance)
             job.fail_times += 1
-            job.last_completed_schedule_id = instance.schedule_id
+            job.last_completed_schedule_id = instance.get_schedule_id()
+            job_values = {
+                'fail_times': job.fail_times,
+                'last_completed_schedule_id': job.last_completed_schedule_id,
+            }
 
             # disable job when it failed more than x times
             if (job.disable_enqueue_after_fails and
                     job.fail_times > job.disable_enqueue_after_fails):
                 job.enqueue_is_enabled = False
-
-            job.save()
+                job.effective_enqueue_is_enabled = False
+                job_values.update({
+                    'enqueue_is_enabled': False,
+                    'effective_enqueue_is_enabled': False,
+                })
 
         else:
             # reset the fail count
             job.fail_times = 0
-            job.last_completed_schedule_id = instance.schedule_id
-            job.save()
+            job.last_completed_schedule_id = instance.get_schedule_id()
+            job_values = {
+                'fail_times': job.fail_times,
+                'last_completed_schedule_id': job.last_completed_schedule_id,
+            }
 
-        # on purpose we are not using .count() since with that, the
-        # .select_for_update() does not have any effect.
+        # the job was loaded earlier in the request, saving the whole job
+        # would write back stale denormalized fields (eg: after a concurrent
+        # bulk update of the effective enqueue state or an invalidation of
+        # the notification addresses)
+        Job.objects.filter(pk=job.pk).update(**job_values)
 
-        # we need to lock the selected records here, to make sure we do not
-        # run this part in parallel (with the risk that when both transactions
-        # are marking the run as finished, they still see each other as
-        # unfinished since the transaction hasn't been committed yet).
-        unfinished_siblings = len(instance.get_siblings().filter(
-            return_dts__isnull=True).select_for_update())
+        return_state = None
 
-        if instance.schedule_children and not unfinished_siblings:
-            failed_siblings = instance.get_siblings().filter(
-                return_success=False)
+        # the runs of a job which runs on all workers (which have a schedule
+        # id different from their id) are counted in the counter of their
+        # schedule id, on the first save after returning
+        if instance._saved_return_dts is None and instance.schedule_id:
+            return_state = instance.register_return()
 
-            if ((instance.return_success and not failed_siblings.count())
-                    or job.schedule_children_on_error):
+        if return_state is not None:
+            all_returned, failed = return_state
+
+        else:
+            # on purpose we are not using .count() since with that, the
+            # .select_for_update() does not have any effect.
+
+            # we need to lock the selected records here, to make sure we do
+            # not run this part in parallel (with the risk that when both
+            # transactions are marking the run as finished, they still see
+            # each other as unfinished since the transaction hasn't been
+            # committed yet).
+            all_returned = not len(instance.get_siblings().filter(
+                return_dts__isnull=True).select_for_update())
+
+            failed = None
+            if instance.schedule_children and all_returned:
+                failed = instance.get_siblings().filter(
+                    return_success=False).count()
+                if not instance.return_success:
+                    failed += 1
+
+        if instance.schedule_children and all_returned:
+            if not failed or job.schedule_children_on_error:
                 for child in instance.job.children.all():
                     if child.enqueue_is_enabled:
                         child.schedule()
+
+        notify_broadcaster('run_returned', run_id=instance.pk)
+
+
+def post_run_delete(sender, instance, **kwargs):
+    """
+    Post action after deleting a run instance.
+
+    When a run of a job which runs on all workers is deleted before it
+    returned, the counter of its schedule id can't complete anymore. The
+    counter is deleted, so that the other runs of the schedule fall back to
+    checking their siblings when they return.
+
+    """
+    from job_runner.apps.job_runner.models import ScheduleCounter
+
+    if instance.schedule_id and instance.return_dts is None:
+        ScheduleCounter.objects.filter(
+            schedule_id=instance.schedule_id).delete()
+
+
+def post_kill_request_create(sender, instance, created, raw, **kwargs):
+    """
+    Post action after creating a kill-request instance.
+
+    This will notify the queue broadcaster about the new kill-request.
+
+    """
+    if created and not raw:
+        notify_broadcaster('kill_request_created', kill_request_id=instance.pk)
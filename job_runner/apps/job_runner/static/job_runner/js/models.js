@@ -19,7 +19,12 @@ angular.module('getAll', []).factory('getAll', function() {
             });
 
             if (items.meta.next !== null) {
-                getAll(output_list, model, items.meta.offset + items.meta.limit, params, success, error);
+                if (items.meta.next_cursor !== undefined) {
+                    // keyset paginated resource, continue after the cursor
+                    getAll(output_list, model, 0, extend({}, params, {cursor: items.meta.next_cursor}), success, error);
+                } else {
+                    getAll(output_list, model, items.meta.offset + items.meta.limit, params, success, error);
+                }
             } else {
                 if (success !== undefined) {
                     success(output_list);
@@ -317,7 +322,30 @@ angular.module('run', ['ngResource', 'getAll', 'job', 'runLog', 'worker', 'jobru
     // Return all runs
     Run.all = function(params, success, error) {
         var output_list = [];
-        getAll(output_list, Run, 0, params, success);
+        // an empty cursor enables the keyset pagination
+        getAll(output_list, Run, 0, angular.extend({cursor: ''}, params), success);
+        return output_list;
+    };
+
+    var LastCompletedRun = $resource(
+        '/api/v1/last_completed_run/',
+        {},
+        {
+            'get': {'method': 'GET'}
+        }
+    );
+
+    // Return the last completed runs of each job
+    Run.allLastCompleted = function(params, success, error) {
+        var output_list = [];
+        getAll([], LastCompletedRun, 0, params, function(items) {
+            angular.forEach(items, function(item) {
+                output_list.push(new Run(item));
+            });
+            if (success) {
+                success(output_list);
+            }
+        }, error);
         return output_list;
     };
 
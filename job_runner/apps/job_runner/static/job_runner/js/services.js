@@ -227,7 +227,7 @@ jobrunnerServices.factory('globalState', function(Project, Job, JobTemplate, Run
                 });
 
                 // get all last completed
-                Run.all({state: 'last_completed', project_id: this.data.projectId}, function(lastCompleted) {
+                Run.allLastCompleted({project_id: this.data.projectId}, function(lastCompleted) {
                     angular.forEach(lastCompleted, function(run) {
                         self.data.runs.push(run);
                     });
@@ -1,11 +1,26 @@
+import json
+from datetime import timedelta
+
+import zmq
+from django.core.management.base import CommandError
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.utils import timezone
 from mock import Mock, call
 
+from job_runner.apps.job_runner.broadcaster import dts_to_timestamp
 from job_runner.apps.job_runner.management.commands.broadcast_queue import (
     Command)
 from job_runner.apps.job_runner.models import (
-    Job, JobTemplate, KillRequest, Project, Run, Worker, WorkerPool)
+    Job,
+    JobTemplate,
+    KillRequest,
+    Project,
+    Run,
+    ScheduleCounter,
+    Worker,
+    WorkerPool,
+)
 
 
 class CommandTestCase(TestCase):
@@ -48,6 +63,16 @@ class CommandTestCase(TestCase):
             ])
         ], command.publisher.send_multipart.call_args_list)
 
+        # the kill-request is only re-broadcasted after the re-send interval
+        self.assertTrue(KillRequest.objects.get(pk=1).enqueue_dts)
+        command._broadcast_kill_requests()
+        self.assertEqual(1, command.publisher.send_multipart.call_count)
+        self.assertTrue(command.next_kill_resend_dts > timezone.now())
+
+        with self.settings(JOB_RUNNER_KILL_REQUEST_RESEND_INTERVAL=0):
+            command._broadcast_kill_requests()
+        self.assertEqual(2, command.publisher.send_multipart.call_count)
+
     def test__broadcast_runs(self):
         """
         Test :meth:`.Command._broadcast_runs`.
@@ -68,6 +93,62 @@ class CommandTestCase(TestCase):
             ]),
         ], command.publisher.send_multipart.call_args_list)
 
+    def test__broadcast_runs_num_queries(self):
+        """
+        Test that rescheduling doesn't query the database per job.
+        """
+        Run.objects.get(pk=2).delete()
+        schedule_dts = Run.objects.get(pk=1).schedule_dts
+
+        for x in range(4):
+            job = Job.objects.get(pk=1)
+            job.pk = None
+            job.title = 'Job copy {0}'.format(x)
+            job.save()
+            Run.objects.create(job=job, schedule_dts=schedule_dts)
+
+        for job in Job.objects.all():
+            job.rescheduleexclude_set.create(
+                start_time='12:00', end_time='12:30')
+
+        command = Command()
+        command.publisher = Mock()
+
+        # nine queries for syncing the timeline and loading the runs, the
+        # excludes, the active runs per worker, the reschedule data and the
+        # workers, plus one query per job for creating the next run
+        with self.assertNumQueries(9 + 5):
+            command._broadcast_runs()
+
+        self.assertEqual(5, command.publisher.send_multipart.call_count)
+        self.assertEqual(
+            5, Run.objects.filter(schedule_dts__gt=schedule_dts).count())
+
+    @override_settings(JOB_RUNNER_SCHEDULE_HORIZON=24)
+    def test__broadcast_runs_schedule_horizon(self):
+        """
+        Test :meth:`.Command._broadcast_runs` with pre-scheduled runs.
+        """
+        Run.objects.get(pk=2).delete()
+        run = Run.objects.create(
+            job=Job.objects.get(pk=1),
+            schedule_dts=timezone.now() - timedelta(minutes=1),
+        )
+
+        command = Command()
+        command.publisher = Mock()
+        command._broadcast_runs()
+
+        # the missed run is discarded and the job is not rescheduled
+        self.assertEqual([
+            call([
+                'master.broadcast.worker1',
+                '{{"action": "enqueue", "run_id": {0}}}'.format(run.pk)
+            ]),
+        ], command.publisher.send_multipart.call_args_list)
+        self.assertEqual(
+            [run.pk], list(Run.objects.values_list('pk', flat=True)))
+
     def test__broadcast_runs_run_on_all_workers(self):
         """
         Test :meth:`.Command._broadcast_runs` with ``run_on_all_workers=True``.
@@ -98,12 +179,57 @@ class CommandTestCase(TestCase):
             ]),
         ], command.publisher.send_multipart.call_args_list)
 
+    def test__fan_out_run(self):
+        """
+        Test :meth:`.Command._fan_out_run`.
+        """
+        pool = WorkerPool.objects.get(pk=1)
+        for x in range(10):
+            pool.workers.add(Worker.objects.create(
+                title='Worker {0}'.format(x),
+                api_key='fan_out_worker{0}'.format(x),
+                secret='verysecret',
+            ))
+        workers = list(pool.workers.all())
+        run = Run.objects.get(pk=1)
+
+        command = Command()
+        # insert runs, insert counter and select the created runs
+        with self.assertNumQueries(3):
+            assigned = command._fan_out_run(run, workers)
+
+        self.assertEqual(11, len(assigned))
+        counter = ScheduleCounter.objects.get(schedule_id=1)
+        self.assertEqual(11, counter.expected)
+        self.assertEqual(0, counter.returned)
+        for assigned_run, worker in assigned:
+            self.assertEqual(worker.pk, assigned_run.worker_id)
+            self.assertEqual(1, assigned_run.schedule_id)
+            self.assertEqual(run.schedule_dts, assigned_run.schedule_dts)
+
+    def test__get_worker_selector(self):
+        """
+        Test :meth:`.Command._get_worker_selector`.
+        """
+        Run.objects.filter(pk=1).update(
+            worker=1, enqueue_dts=timezone.now())
+        Run.objects.filter(pk=2).update(
+            worker=1, enqueue_dts=timezone.now(), return_dts=timezone.now())
+
+        command = Command()
+        with self.assertNumQueries(1):
+            selector = command._get_worker_selector()
+
+        self.assertEqual({1: 1}, selector.active_runs)
+
     def test__broadcast_runs_project_disabled_enqueue(self):
         """
         Test :meth:`.Command._broadcast_runs` with ``enqueue_is_enabled=False``
         for :class:`.Project`.
         """
-        Project.objects.update(enqueue_is_enabled=False)
+        for project in Project.objects.all():
+            project.enqueue_is_enabled = False
+            project.save()
         command = Command()
 
         command.publisher = Mock()
@@ -131,7 +257,9 @@ class CommandTestCase(TestCase):
         Test :meth:`.Command._broadcast_runs` with ``enqueue_is_enabled=False``
         for :class:`.JobTemplate`.
         """
-        JobTemplate.objects.update(enqueue_is_enabled=False)
+        for job_template in JobTemplate.objects.all():
+            job_template.enqueue_is_enabled = False
+            job_template.save()
         command = Command()
 
         command.publisher = Mock()
@@ -145,7 +273,9 @@ class CommandTestCase(TestCase):
         Test :meth:`.Command._broadcast_runs` with ``enqueue_is_enabled=False``
         for :class:`.Run`.
         """
-        Job.objects.update(enqueue_is_enabled=False)
+        for job in Job.objects.all():
+            job.enqueue_is_enabled = False
+            job.save()
         command = Command()
 
         command.publisher = Mock()
@@ -176,12 +306,98 @@ class CommandTestCase(TestCase):
 
         self.assertEqual([], command.publisher.send_multipart.call_args_list)
 
+    def test__broadcast_runs_saturated_worker(self):
+        """
+        Test :meth:`.Command._broadcast_runs` with a saturated worker.
+        """
+        Run.objects.create(
+            job=Job.objects.get(pk=2),
+            worker=Worker.objects.get(pk=1),
+            schedule_dts=timezone.now(),
+            enqueue_dts=timezone.now(),
+        )
+        Worker.objects.filter(pk=1).update(concurrent_jobs=1)
+
+        command = Command()
+        command.publisher = Mock()
+        command._broadcast_runs()
+
+        self.assertEqual([], command.publisher.send_multipart.call_args_list)
+        self.assertEqual(1, Run.objects.filter(
+            job=1, return_dts__isnull=True).count())
+        self.assertIn(1, command.due_runs)
+
+        Worker.objects.filter(pk=1).update(concurrent_jobs=2)
+        command._broadcast_runs()
+
+        self.assertEqual([
+            call([
+                'master.broadcast.worker1',
+                '{"action": "enqueue", "run_id": 1}'
+            ]),
+        ], command.publisher.send_multipart.call_args_list)
+
+    def test__broadcast_runs_run_on_all_workers_saturated_worker(self):
+        """
+        Test :meth:`.Command._broadcast_runs` with ``run_on_all_workers=True``
+        and a saturated worker.
+
+        The run of the saturated worker is broadcasted once the worker has
+        capacity, even when the run of the other worker is active already.
+
+        """
+        job = Job.objects.get(pk=1)
+        job.run_on_all_workers = True
+        job.save()
+
+        pool = WorkerPool.objects.get(pk=1)
+        pool.workers.add(Worker.objects.get(pk=2))
+
+        Run.objects.get(pk=2).delete()
+        Run.objects.create(
+            job=Job.objects.get(pk=2),
+            worker=Worker.objects.get(pk=2),
+            schedule_dts=timezone.now(),
+            enqueue_dts=timezone.now(),
+        )
+        Worker.objects.filter(pk=2).update(concurrent_jobs=1)
+
+        command = Command()
+        command.publisher = Mock()
+        command._broadcast_runs()
+
+        self.assertEqual([
+            call([
+                'master.broadcast.worker1',
+                '{"action": "enqueue", "run_id": 4}'
+            ]),
+        ], command.publisher.send_multipart.call_args_list)
+        self.assertIn(5, command.due_runs)
+
+        # worker 1 picked up its run, worker 2 has capacity again
+        Run.objects.filter(pk=4).update(enqueue_dts=timezone.now())
+        Worker.objects.filter(pk=2).update(concurrent_jobs=2)
+        command._broadcast_runs()
+
+        self.assertEqual([
+            call([
+                'master.broadcast.worker1',
+                '{"action": "enqueue", "run_id": 4}'
+            ]),
+            call([
+                'master.broadcast.worker2',
+                '{"action": "enqueue", "run_id": 5}'
+            ]),
+        ], command.publisher.send_multipart.call_args_list)
+
     def test__broadcast_runs_disabled_enqueue_with_manual(self):
         """
         Test :meth:`.Command._broadcast_runs` with ``enqueue_is_enabled=False``
         but with manual one.
         """
-        Job.objects.update(enqueue_is_enabled=False)
+        for job in Job.objects.all():
+            job.enqueue_is_enabled = False
+            job.save()
         Run.objects.filter(pk=2).update(is_manual=True)
         command = Command()
 
@@ -202,15 +418,321 @@ class CommandTestCase(TestCase):
         command = Command()
         command.publisher = Mock()
 
+        Worker.objects.filter(pk=2).update(enqueue_is_enabled=False)
+        command._broadcast_worker_ping()
         command._broadcast_worker_ping()
 
+        worker = Worker.objects.get(pk=1)
+        self.assertEqual(2, worker.ping_request_seq)
+        self.assertEqual(0, Worker.objects.get(pk=2).ping_request_seq)
+
+        calls = command.publisher.send_multipart.call_args_list
+        self.assertEqual(2, len(calls))
+        topic, message = calls[1][0][0]
+        self.assertEqual('master.broadcast.worker1', topic)
+        self.assertEqual({
+            'action': 'ping',
+            'seq': 2,
+            'sent_ts': dts_to_timestamp(worker.ping_request_dts),
+        }, json.loads(message))
+
+    @override_settings(JOB_RUNNER_BROADCASTER_SHARDS=2)
+    def test__broadcast_runs_sharded(self):
+        """
+        Test :meth:`.Command._broadcast_runs` and
+        :meth:`.Command._broadcast_kill_requests` with multiple shards.
+        """
+        run = Run.objects.get(pk=1)
+        run.start_dts = timezone.now()
+        run.pid = 1234
+        run.worker = Worker.objects.get(pk=1)
+        run.save()
+        KillRequest.objects.create(run=run, schedule_dts=timezone.now())
+
+        command = Command()
+        command.shard = 1
+        command.publisher = Mock()
+        command._broadcast_runs()
+        command._broadcast_kill_requests()
+
+        # job 1 belongs to the second shard
+        self.assertEqual([
+            call([
+                'master.broadcast.worker2',
+                '{"action": "enqueue", "run_id": 2}'
+            ]),
+        ], command.publisher.send_multipart.call_args_list)
+
+        command = Command()
+        command.shard = 2
+        command.publisher = Mock()
+        command._broadcast_runs()
+        command._broadcast_kill_requests()
+
         self.assertEqual([
             call([
                 'master.broadcast.worker1',
-                '{"action": "ping"}'
+                '{"action": "kill", "kill_request_id": 1}'
             ]),
+        ], command.publisher.send_multipart.call_args_list)
+
+    @override_settings(JOB_RUNNER_BROADCASTER_SHARDS=3)
+    def test__parse_shard(self):
+        """
+        Test :meth:`.Command._parse_shard`.
+        """
+        command = Command()
+
+        self.assertEqual(2, command._parse_shard('2/3'))
+        self.assertRaises(CommandError, command._parse_shard, None)
+        self.assertRaises(CommandError, command._parse_shard, 'foo')
+        self.assertRaises(CommandError, command._parse_shard, '2/4')
+        self.assertRaises(CommandError, command._parse_shard, '4/3')
+
+        with self.settings(JOB_RUNNER_BROADCASTER_SHARDS=1):
+            self.assertEqual(1, command._parse_shard(None))
+
+    def test__broadcast_runs_redelivery(self):
+        """
+        Test that :meth:`.Command._broadcast_runs` re-delivers runs which are
+        not picked up by the worker.
+        """
+        pool = WorkerPool.objects.get(pk=1)
+        pool.workers.add(Worker.objects.get(pk=2))
+
+        command = Command()
+        command.publisher = Mock()
+        command._broadcast_runs()
+
+        worker_id = command.deliveries.get_worker_id(1)
+        run_count = Run.objects.filter(job=1).count()
+        self.assertEqual(2, command.publisher.send_multipart.call_count)
+
+        # in-flight, nothing is re-delivered
+        command._broadcast_runs()
+        self.assertEqual(2, command.publisher.send_multipart.call_count)
+
+        # re-delivered to the same worker, without rescheduling the job
+        command.deliveries.interval = 0
+        command.deliveries.sent(1, worker_id)
+        command.deliveries.sent(2, 2)
+        command._broadcast_runs()
+        self.assertEqual(4, command.publisher.send_multipart.call_count)
+        self.assertEqual(worker_id, command.deliveries.get_worker_id(1))
+        self.assertEqual(3, command.deliveries.get_attempts(1))
+        self.assertEqual(run_count, Run.objects.filter(job=1).count())
+
+        # after max. attempts, an other worker is selected
+        command._broadcast_runs()
+        self.assertNotEqual(worker_id, command.deliveries.get_worker_id(1))
+        self.assertEqual(1, command.deliveries.get_attempts(1))
+
+        # once picked up, the run is not tracked anymore
+        Run.objects.filter(pk=1).update(enqueue_dts=timezone.now())
+        command._update_due_runs()
+        self.assertFalse(1 in command.deliveries)
+
+        # the runs of a job which runs on all workers are re-delivered, also
+        # when the run of an other worker is picked up already
+        Run.objects.all().delete()
+        job = Job.objects.get(pk=1)
+        job.run_on_all_workers = True
+        job.save()
+        run = Run.objects.create(job=job, schedule_dts=timezone.now())
+
+        command = Command()
+        command.publisher = Mock()
+        command._broadcast_runs()
+        self.assertEqual(2, command.publisher.send_multipart.call_count)
+
+        fan_out_ids = dict(Run.objects.filter(
+            schedule_id=run.pk).values_list('worker', 'pk'))
+        Run.objects.filter(pk=fan_out_ids[1]).update(
+            enqueue_dts=timezone.now())
+        command.deliveries.interval = 0
+        command.deliveries.sent(fan_out_ids[2], 2)
+        command._broadcast_runs()
+
+        self.assertEqual(3, command.publisher.send_multipart.call_count)
+        self.assertEqual(
             call([
                 'master.broadcast.worker2',
-                '{"action": "ping"}'
+                '{{"action": "enqueue", "run_id": {0}}}'.format(
+                    fan_out_ids[2]),
+            ]),
+            command.publisher.send_multipart.call_args
+        )
+
+    def test__broadcast_runs_unconfirmed_run(self):
+        """
+        Test :meth:`.Command._broadcast_runs` for a run we got notified about
+        before the transaction creating it was committed.
+        """
+        schedule_dts = timezone.now()
+
+        command = Command()
+        command.publisher = Mock()
+        command.receiver = Mock()
+        command.next_pass_dts = schedule_dts
+        command.next_sync_dts = schedule_dts + timedelta(minutes=5)
+        command.receiver.recv.side_effect = [
+            json.dumps({
+                'action': 'run_created',
+                'job_id': 1,
+                'run_id': 999,
+                'schedule_dts': dts_to_timestamp(schedule_dts),
+            }),
+            zmq.ZMQError(),
+        ]
+        command._receive_notifications()
+
+        # the run is not committed yet
+        command._broadcast_runs()
+        self.assertEqual([], command.publisher.send_multipart.call_args_list)
+        self.assertIn(999, command.due_runs)
+        self.assertTrue(
+            command._get_next_pass_dts() <=
+            timezone.now() + timedelta(seconds=5))
+
+        Run.objects.create(pk=999, job_id=1, schedule_dts=schedule_dts)
+        command._broadcast_runs()
+
+        self.assertEqual([
+            call([
+                'master.broadcast.worker1',
+                '{"action": "enqueue", "run_id": 999}'
             ]),
         ], command.publisher.send_multipart.call_args_list)
+        self.assertEqual({}, command.unconfirmed_runs)
+
+    def test__sync_timeline_unconfirmed_run(self):
+        """
+        Test that :meth:`.Command._sync_timeline` keeps the runs which are not
+        visible yet, until the resync interval has passed.
+        """
+        schedule_dts = timezone.now()
+
+        command = Command()
+        command.unconfirmed_runs[999] = (schedule_dts, schedule_dts)
+        command._sync_timeline()
+        self.assertIn(999, command.unconfirmed_runs)
+        self.assertIn(
+            (999, schedule_dts), command.timeline.pop_due(schedule_dts))
+
+        command.unconfirmed_runs[999] = (
+            schedule_dts, schedule_dts - timedelta(days=1))
+        command._sync_timeline()
+        self.assertEqual({}, command.unconfirmed_runs)
+        self.assertNotIn(
+            999, [x[0] for x in command.timeline.pop_due(schedule_dts)])
+
+    @override_settings(JOB_RUNNER_BROADCASTER_MAX_INTERVAL=30)
+    def test__get_next_pass_dts(self):
+        """
+        Test :meth:`.Command._get_next_pass_dts`.
+        """
+        command = Command()
+
+        dts_now = timezone.now()
+        next_pass_dts = command._get_next_pass_dts()
+        self.assertTrue(
+            dts_now + timedelta(seconds=30) <= next_pass_dts <=
+            timezone.now() + timedelta(seconds=30)
+        )
+
+        command.deliveries.sent(1, 1)
+        next_pass_dts = command._get_next_pass_dts()
+        self.assertTrue(next_pass_dts <= timezone.now() + timedelta(seconds=5))
+        command.deliveries.remove(1)
+
+        schedule_dts = timezone.now() + timedelta(seconds=10)
+        command.timeline.add(1, schedule_dts)
+        self.assertEqual(schedule_dts, command._get_next_pass_dts())
+
+    def test__receive_notifications(self):
+        """
+        Test :meth:`.Command._receive_notifications`.
+        """
+        dts_now = timezone.now()
+        schedule_dts = dts_now + timedelta(minutes=5)
+
+        command = Command()
+        command.next_pass_dts = dts_now + timedelta(minutes=10)
+        command.receiver = Mock()
+        command.receiver.recv.side_effect = [
+            json.dumps({
+                'action': 'run_created',
+                'run_id': 1,
+                'schedule_dts': dts_to_timestamp(schedule_dts),
+            }),
+            zmq.ZMQError(),
+        ]
+
+        command._receive_notifications()
+        self.assertEqual(schedule_dts, command.next_pass_dts)
+        self.assertEqual(schedule_dts, command.timeline.next_dts())
+        self.assertFalse(command.notified)
+
+        command.receiver.recv.side_effect = [
+            json.dumps({'action': 'run_returned', 'run_id': 1}),
+            zmq.ZMQError(),
+        ]
+
+        command._receive_notifications()
+        self.assertTrue(command.next_pass_dts <= timezone.now())
+        self.assertTrue(command.notified)
+
+        # a run re-scheduled to an earlier time
+        command.next_pass_dts = dts_now + timedelta(minutes=10)
+        command.receiver.recv.side_effect = [
+            json.dumps({
+                'action': 'run_updated',
+                'run_id': 1,
+                'schedule_dts': dts_to_timestamp(
+                    dts_now + timedelta(minutes=1)),
+            }),
+            zmq.ZMQError(),
+        ]
+
+        command._receive_notifications()
+        self.assertEqual(
+            dts_to_timestamp(dts_now + timedelta(minutes=1)),
+            dts_to_timestamp(command.next_pass_dts))
+        self.assertEqual(
+            command.next_pass_dts, command.timeline.next_dts())
+        self.assertEqual(1, len(command.timeline))
+
+        # runs scheduled in bulk trigger a timeline synchronization
+        command.next_sync_dts = dts_now + timedelta(minutes=5)
+        command.receiver.recv.side_effect = [
+            json.dumps({'action': 'runs_scheduled'}),
+            zmq.ZMQError(),
+        ]
+
+        command._receive_notifications()
+        self.assertTrue(command.next_sync_dts <= timezone.now())
+
+    def test__broadcast_runs_from_timeline(self):
+        """
+        Test that :meth:`.Command._broadcast_runs` only broadcasts due runs.
+        """
+        command = Command()
+        command.publisher = Mock()
+        command._sync_timeline()
+
+        # run 2 is not due according to the timeline
+        command.timeline.add(2, timezone.now() + timedelta(minutes=5))
+        command._broadcast_runs()
+
+        self.assertEqual([
+            call([
+                'master.broadcast.worker1',
+                '{"action": "enqueue", "run_id": 1}'
+            ]),
+        ], command.publisher.send_multipart.call_args_list)
+        self.assertEqual([1], command.due_runs.keys())
+
+        # once picked up by the worker, it is removed from the due runs
+        Run.objects.filter(pk=1).update(enqueue_dts=timezone.now())
+        command._update_due_runs()
+        self.assertEqual({}, command.due_runs)
@@ -0,0 +1,49 @@
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from job_runner.apps.job_runner.models import Job, JobTemplate
+
+
+class CommandTestCase(TestCase):
+    """
+    Tests for the ``check_effective_enqueue`` command.
+    """
+    fixtures = [
+        'test_auth',
+        'test_projects',
+        'test_workers',
+        'test_worker_pools',
+        'test_job_templates',
+        'test_jobs',
+    ]
+
+    def test_consistent(self):
+        """
+        Test without incorrect effective enqueue states.
+        """
+        stdout = StringIO()
+        call_command('check_effective_enqueue', stdout=stdout)
+        self.assertEqual('All good!\n', stdout.getvalue())
+
+    def test_inconsistent(self):
+        """
+        Test with incorrect effective enqueue states.
+        """
+        JobTemplate.objects.filter(pk=1).update(enqueue_is_enabled=False)
+
+        stderr = StringIO()
+        self.assertRaises(
+            SystemExit,
+            call_command,
+            'check_effective_enqueue',
+            stdout=StringIO(),
+            stderr=stderr,
+        )
+        self.assertIn('Found 1 job(s)', stderr.getvalue())
+        self.assertTrue(Job.objects.get(pk=1).effective_enqueue_is_enabled)
+
+        call_command('check_effective_enqueue', fix=True, stdout=StringIO())
+        self.assertFalse(Job.objects.get(pk=1).effective_enqueue_is_enabled)
+        self.assertTrue(Job.objects.get(pk=2).effective_enqueue_is_enabled)
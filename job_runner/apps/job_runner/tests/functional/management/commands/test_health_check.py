@@ -7,6 +7,7 @@ from django.utils import timezone
 from mock import Mock
 
 from job_runner.apps.job_runner.management.commands.health_check import Command
+from job_runner.apps.job_runner import notifications
 from job_runner.apps.job_runner.models import Run, Worker
 
 
@@ -97,6 +98,7 @@ class CommandTestCase(TestCase):
 
         command = Command()
         command._find_unresponsive_worker_pools()
+        notifications.send_queued_notifications()
 
         self.assertEqual(1, len(mail.outbox))
         self.assertEqual(
@@ -0,0 +1,95 @@
+from datetime import timedelta
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from mock import Mock, patch
+
+from job_runner.apps.job_runner.models import Job, Run
+
+
+class CommandTestCase(TestCase):
+    """
+    Tests for the ``schedule_horizon`` command.
+    """
+    fixtures = [
+        'test_auth',
+        'test_projects',
+        'test_workers',
+        'test_worker_pools',
+        'test_job_templates',
+        'test_jobs',
+    ]
+
+    def test_schedule_horizon(self):
+        """
+        Test pre-scheduling the runs.
+        """
+        Job.objects.filter(pk=2).update(reschedule_interval_type='')
+
+        stdout = StringIO()
+        with self.assertNumQueries(4):
+            call_command('schedule_horizon', hours=72, stdout=stdout)
+        self.assertEqual('Scheduled 3 run(s)\n', stdout.getvalue())
+
+        runs = Run.objects.filter(
+            job=1, schedule_dts__gt=timezone.now()).order_by('schedule_dts')
+        self.assertEqual(3, len(runs))
+        self.assertEqual(1, Run.objects.filter(job=2).count())
+
+        for run in runs:
+            self.assertEqual(run.pk, run.get_schedule_id())
+            self.assertFalse(run.is_manual)
+            self.assertTrue(run.schedule_dts <= (
+                timezone.now() + timedelta(hours=72)))
+
+        self.assertEqual(
+            timedelta(days=1), runs[1].schedule_dts - runs[0].schedule_dts)
+        self.assertEqual(
+            timedelta(days=1), runs[2].schedule_dts - runs[1].schedule_dts)
+
+        # the already scheduled runs are not scheduled again
+        stdout = StringIO()
+        call_command('schedule_horizon', hours=72, stdout=stdout)
+        self.assertEqual('Scheduled 0 run(s)\n', stdout.getvalue())
+
+    def test_schedule_horizon_notify_after_commit(self):
+        """
+        Test that the broadcaster is notified after the runs are committed.
+        """
+        calls = Mock()
+
+        with patch('django.db.transaction.commit', calls.commit):
+            with patch('job_runner.apps.job_runner.management.commands.'
+                       'schedule_horizon.notify_broadcaster',
+                       calls.notify_broadcaster):
+                call_command('schedule_horizon', hours=72, stdout=StringIO())
+
+        self.assertEqual(
+            ['commit', 'notify_broadcaster'],
+            [name for name, args, kwargs in calls.method_calls])
+        calls.notify_broadcaster.assert_called_once_with('runs_scheduled')
+
+    def test_schedule_horizon_disabled_enqueue(self):
+        """
+        Test that no runs are pre-scheduled for disabled jobs.
+        """
+        Job.objects.update(effective_enqueue_is_enabled=False)
+
+        stdout = StringIO()
+        call_command('schedule_horizon', hours=72, stdout=stdout)
+        self.assertEqual('Scheduled 0 run(s)\n', stdout.getvalue())
+
+    def test_schedule_horizon_not_set(self):
+        """
+        Test without ``--hours`` and ``JOB_RUNNER_SCHEDULE_HORIZON``.
+        """
+        stderr = StringIO()
+        self.assertRaises(
+            SystemExit,
+            call_command,
+            'schedule_horizon',
+            stderr=stderr
+        )
+        self.assertIn('JOB_RUNNER_SCHEDULE_HORIZON', stderr.getvalue())
@@ -10,13 +10,17 @@ from django.test import TestCase
 from django.utils import timezone
 from mock import Mock, patch
 
+from job_runner.apps.job_runner import notifications
+from job_runner.apps.job_runner.auth import get_worker_scope
 from job_runner.apps.job_runner.models import (
     Job,
     JobTemplate,
     KillRequest,
+    Notification,
     Project,
     Run,
     RunLog,
+    ScheduleCounter,
     Worker,
     WorkerPool,
 )
@@ -367,6 +371,30 @@ class WorkerTestCase(ApiTestBase):
         worker = Worker.objects.get(pk=1)
         self.assertEqual(dts, worker.ping_response_dts)
 
+    def test_patch_ping_response_seq(self):
+        """
+        Test PATCH the ping_response_seq field.
+        """
+        Worker.objects.filter(pk=1).update(
+            ping_request_seq=5, ping_request_dts=timezone.now())
+        response = self.patch(
+            '/api/v1/worker/1/',
+            {
+                'ping_response_dts': timezone.now().isoformat(' '),
+                'ping_response_seq': 5,
+                'ping_request_seq': 10,
+                'ping_rtt_history': [1, 2, 3],
+            }
+        )
+        self.assertEqual(202, response.status_code)
+
+        json_data = self.get_json('/api/v1/worker/1/')
+        self.assertEqual(5, json_data['ping_request_seq'])
+        self.assertEqual(5, json_data['ping_response_seq'])
+        self.assertEqual(1, len(json_data['ping_rtt_history']))
+        self.assertEqual(
+            json_data['ping_rtt_history'][0], json_data['ping_rtt'])
+
     def test_patch_ping_response_no_permissions(self):
         """
         Test PATCH the ping_response_dts without having permission.
@@ -545,6 +573,18 @@ class JobTestCase(ApiTestBase):
         json_data = json.loads(response.content)
         self.assertEqual(1, json_data['objects'][0]['id'])
 
+    def test_script_content(self):
+        """
+        Test that the script content reflects changes of the job-template.
+        """
+        job_template = JobTemplate.objects.get(pk=1)
+        job_template.body = '#!/bin/bash\n{{ content|safe }}'
+        job_template.save()
+
+        json_data = self.get_json('/api/v1/job/1/')
+        self.assertEqual(
+            '#!/bin/bash\nprint "Hello world"', json_data['script_content'])
+
 
 class RunTestCase(ApiTestBase):
     """
@@ -597,6 +637,133 @@ class RunTestCase(ApiTestBase):
         response = self.get('/api/v1/run/2/')
         self.assertEqual(401, response.status_code)
 
+    def test_api_authorization_scope(self):
+        """
+        Test that the scope of the API-key is cached until it changes.
+        """
+        self.assertEqual(1, len(self.get_json('/api/v1/run/')['objects']))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(([1], [1]), get_worker_scope('worker1'))
+
+        WorkerPool.objects.get(pk=1).workers.remove(Worker.objects.get(pk=1))
+        self.assertEqual(0, len(self.get_json('/api/v1/run/')['objects']))
+
+    def test_patch_num_queries(self):
+        """
+        Test the number of queries of PATCH ``/api/v1/run/1/``.
+        """
+        # resolve the credentials and scope of the worker
+        self.get('/api/v1/run/1/')
+
+        # select run, authorize run (EXISTS), select run log, select job,
+        # hydrate job (select, authorize (EXISTS), worker-pool and children),
+        # check run exists and update run
+        with self.assertNumQueries(10):
+            response = self.patch(
+                '/api/v1/run/1/', {'start_dts': timezone.now().isoformat(' ')})
+
+        self.assertEqual(202, response.status_code)
+
+    def test_schedule_id(self):
+        """
+        Test the ``schedule_id`` of a run which is its own schedule.
+        """
+        self.assertEqual(None, Run.objects.get(pk=1).schedule_id)
+
+        json_data = self.get_json('/api/v1/run/1/')
+        self.assertEqual(1, json_data['schedule_id'])
+
+        now = timezone.now()
+        Run.objects.filter(pk=1).update(
+            enqueue_dts=now, start_dts=now, return_dts=now)
+        Job.objects.filter(pk=1).update(last_completed_schedule_id=1)
+
+        json_data = self.get_json('/api/v1/run/?state=last_completed')
+        self.assertEqual(
+            [1], [run['id'] for run in json_data['objects']])
+
+    def test_last_completed(self):
+        """
+        Test listing the last completed runs of each job.
+        """
+        now = timezone.now()
+        old_run = Run.objects.create(job_id=1, schedule_dts=now)
+        Run.objects.update(enqueue_dts=now, start_dts=now, return_dts=now)
+        Job.objects.filter(pk=1).update(last_completed_schedule_id=1)
+        Job.objects.filter(pk=2).update(last_completed_schedule_id=2)
+
+        for path in ['/api/v1/run/', '/api/v1/last_completed_run/']:
+            json_data = self.get_json(
+                '{0}?state=last_completed&project_id=1'.format(path))
+            self.assertEqual(
+                [1], [run['id'] for run in json_data['objects']])
+
+            # the worker has no access to project 2
+            json_data = self.get_json(
+                '{0}?state=last_completed&project_id=2'.format(path))
+            self.assertEqual([], json_data['objects'])
+
+        Job.objects.filter(pk=1).update(
+            last_completed_schedule_id=old_run.pk)
+        response = self.get('/api/v1/last_completed_run/?project_id=1')
+        self.assertIn('max-age=10', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+
+        json_data = json.loads(response.content)
+        self.assertEqual(1, len(json_data['objects']))
+        self.assertEqual(
+            '/api/v1/run/{0}/'.format(old_run.pk),
+            json_data['objects'][0]['resource_uri']
+        )
+
+    def test_keyset_pagination(self):
+        """
+        Test paginating the runs with the ``next_cursor``.
+        """
+        now = timezone.now()
+        for x in range(6):
+            Run.objects.create(job_id=1, schedule_dts=now)
+        Run.objects.filter(pk__in=[3, 4]).update(
+            enqueue_dts=now, start_dts=now)
+        Run.objects.filter(pk=5).update(
+            enqueue_dts=now, start_dts=now, return_dts=now)
+
+        expected = list(Run.objects.filter(job_id=1).order_by(
+            '-return_dts', '-start_dts', '-enqueue_dts', 'schedule_dts', 'pk'
+        ).values_list('pk', flat=True))
+
+        run_ids = []
+        json_data = self.get_json('/api/v1/run/?limit=2&cursor=')
+        self.assertNotIn('total_count', json_data['meta'])
+
+        while json_data['meta']['next']:
+            run_ids.extend([run['id'] for run in json_data['objects']])
+            self.assertIn(
+                'cursor={0}'.format(json_data['meta']['next_cursor']),
+                json_data['meta']['next'])
+            json_data = self.get_json(json_data['meta']['next'])
+
+        run_ids.extend([run['id'] for run in json_data['objects']])
+        self.assertEqual(None, json_data['meta']['next_cursor'])
+        self.assertEqual(expected, run_ids)
+
+        # without a cursor, the runs are paginated by offset
+        json_data = self.get_json('/api/v1/run/?limit=2')
+        self.assertEqual(
+            expected[:2], [run['id'] for run in json_data['objects']])
+        self.assertEqual(0, json_data['meta']['offset'])
+        self.assertEqual(7, json_data['meta']['total_count'])
+        self.assertNotIn('next_cursor', json_data['meta'])
+
+        json_data = self.get_json('/api/v1/run/?limit=2&offset=2')
+        self.assertEqual(
+            expected[2:4], [run['id'] for run in json_data['objects']])
+        self.assertEqual(7, json_data['meta']['total_count'])
+
+        response = self.get('/api/v1/run/?cursor=foo')
+        self.assertEqual(400, response.status_code)
+
     def test_user_authorization(self):
         """
         Test user authorization (user has only access to one object).
@@ -768,7 +935,7 @@ class RunTestCase(ApiTestBase):
         """
         Test PATCH ``/api/v1/run/1/`` returned with error.
 
-        This is expected to send e-mail notifications out.
+        This is expected to queue e-mail notifications.
 
         """
         response = self.patch(
@@ -780,9 +947,12 @@ class RunTestCase(ApiTestBase):
         )
 
         self.assertEqual(202, response.status_code)
+        self.assertEqual(0, len(mail.outbox))
+        self.assertEqual(4, Notification.objects.count())
+        self.assertEqual(4, notifications.send_queued_notifications())
         self.assertTrue(hasattr(mail, 'outbox'))
-        self.assertEqual(1, len(mail.outbox))
-        self.assertEqual(4, len(mail.outbox[0].to))
+        self.assertEqual(4, len(mail.outbox))
+        self.assertEqual(1, len(mail.outbox[0].to))
         self.assertEqual('Run error for: Test job 1', mail.outbox[0].subject)
         self.assertEqual(1, Job.objects.get(pk=1).last_completed_schedule_id)
 
@@ -989,6 +1159,48 @@ class ChainedRunTestCase(ApiTestBase):
         self.assertEqual(202, response.status_code)
         self.assertEqual(0, Job.objects.get(pk=3).run_set.count())
 
+    def test_patch_with_reschedule_schedule_counter(self):
+        """
+        Test PATCH ``/api/v1/run/1/`` for a chained job on all workers.
+
+        The child is scheduled when the last run sharing the schedule id
+        returned.
+
+        """
+        Run.objects.update(enqueue_dts=timezone.now())
+        sibling = Run.objects.create(
+            job_id=1,
+            schedule_id=1,
+            schedule_dts=timezone.now(),
+            enqueue_dts=timezone.now(),
+        )
+        ScheduleCounter.objects.create(schedule_id=1, expected=2)
+
+        response = self.patch(
+            '/api/v1/run/{0}/'.format(sibling.pk),
+            {
+                'return_dts': timezone.now().isoformat(' '),
+                'return_success': True,
+            }
+        )
+
+        self.assertEqual(202, response.status_code)
+        self.assertEqual(0, Job.objects.get(pk=3).run_set.count())
+        self.assertEqual(
+            1, ScheduleCounter.objects.get(schedule_id=1).returned)
+
+        response = self.patch(
+            '/api/v1/run/1/',
+            {
+                'return_dts': timezone.now().isoformat(' '),
+                'return_success': True,
+            }
+        )
+
+        self.assertEqual(202, response.status_code)
+        self.assertEqual(1, Job.objects.get(pk=3).run_set.count())
+        self.assertEqual(0, ScheduleCounter.objects.count())
+
 
 class KillRequestTestCase(ApiTestBase):
     """
@@ -1057,6 +1269,23 @@ class RunLogTestCase(ApiTestBase):
         self.assertEqual(201, response.status_code)
         self.assertEqual(1, RunLog.objects.filter(run_id=1).count())
 
+    def test_keyset_pagination(self):
+        """
+        Test paginating the run logs with the ``next_cursor``.
+        """
+        for x in range(3):
+            run = Run.objects.create(job_id=1, schedule_dts=timezone.now())
+            RunLog.objects.create(run=run, content='foo bar')
+
+        json_data = self.get_json('/api/v1/run_log/?limit=2&cursor=')
+        self.assertEqual(
+            [3, 2], [run_log['id'] for run_log in json_data['objects']])
+
+        json_data = self.get_json(json_data['meta']['next'])
+        self.assertEqual(
+            [1], [run_log['id'] for run_log in json_data['objects']])
+        self.assertEqual(None, json_data['meta']['next'])
+
     def test_post_new_run_log_no_access(self):
         """
         Test POST ``/api/v1/run_log/`` with run we don't have access to.
@@ -1,3 +1,5 @@
+from datetime import timedelta
+
 from django.test import TestCase
 from django.utils import timezone
 
@@ -94,6 +96,28 @@ class KillRequestManagerTestCase(TestCase):
 
         self.assertEqual(0, KillRequest.objects.killable().count())
 
+    def test_killable_resend_before(self):
+        """
+        Test with one killable run which was enqueued before ``resend_before``.
+        """
+        run = Run.objects.get(pk=1)
+        run.start_dts = timezone.now()
+        run.pid = 1234
+        run.worker = Worker.objects.get(pk=1)
+        run.save()
+
+        enqueue_dts = timezone.now()
+        KillRequest.objects.create(
+            run=run,
+            schedule_dts=enqueue_dts,
+            enqueue_dts=enqueue_dts,
+        )
+
+        self.assertEqual(0, KillRequest.objects.killable(
+            resend_before=enqueue_dts - timedelta(seconds=1)).count())
+        self.assertEqual(1, KillRequest.objects.killable(
+            resend_before=enqueue_dts).count())
+
     def test_killable_already_executed(self):
         """
         Test with one killable run which has been already executed.
@@ -2,13 +2,23 @@ from datetime import datetime, time, timedelta
 
 from django.core import mail
 from django.core.exceptions import ValidationError
+from django.db.models import F
 from django.test import TestCase
 from django.utils import timezone
+from mock import patch
 
+from job_runner.apps.job_runner import notifications
 from job_runner.apps.job_runner.models import (
     Job,
+    JobTemplate,
+    Notification,
+    Project,
+    RescheduleException,
     RescheduleExclude,
     Run,
+    ScheduleCounter,
+    Worker,
+    WorkerPool,
 )
 from job_runner.apps.job_runner.utils import correct_dst_difference
 
@@ -40,6 +50,118 @@ class JobTestCase(TestCase):
         job.parent = Job.objects.get(pk=2)
         self.assertRaises(ValidationError, job.full_clean)
 
+    def test_effective_enqueue_is_enabled(self):
+        """
+        Test that ``effective_enqueue_is_enabled`` follows the enqueue state
+        of the job, job-template, project and worker-pool.
+        """
+        def get_effective_states():
+            return list(Job.objects.order_by('pk').values_list(
+                'effective_enqueue_is_enabled', flat=True))
+
+        self.assertEqual([True, True], get_effective_states())
+
+        for model, pk in (
+                (Job, 1),
+                (JobTemplate, 1),
+                (Project, 1),
+                (WorkerPool, 1)):
+            obj = model.objects.get(pk=pk)
+            obj.enqueue_is_enabled = False
+            obj.save()
+            self.assertEqual([False, True], get_effective_states())
+
+            obj.enqueue_is_enabled = True
+            obj.save()
+            self.assertEqual([True, True], get_effective_states())
+
+        self.assertEqual(0, Job.objects.effective_enqueue_mismatches().count())
+        Project.objects.update(enqueue_is_enabled=False)
+        self.assertEqual(2, Job.objects.effective_enqueue_mismatches().count())
+
+    def test_effective_enqueue_is_enabled_unchanged(self):
+        """
+        Test that the jobs are only updated when the enqueue state changed.
+        """
+        for model, pk, num_queries in (
+                (JobTemplate, 1, 3),
+                (Project, 1, 2),
+                (WorkerPool, 1, 2)):
+            obj = model.objects.get(pk=pk)
+            obj.description = 'Foo'
+            with self.assertNumQueries(num_queries):
+                obj.save()
+
+        # moving the job-template to a disabled project
+        Project.objects.filter(pk=2).update(enqueue_is_enabled=False)
+        job_template = JobTemplate.objects.get(pk=1)
+        job_template.project = Project.objects.get(pk=2)
+        job_template.save()
+        self.assertFalse(Job.objects.get(pk=1).effective_enqueue_is_enabled)
+
+    def test_script_content_concurrent_save(self):
+        """
+        Test that concurrent body changes get a unique revision.
+        """
+        job_template_1 = JobTemplate.objects.get(pk=1)
+        job_template_2 = JobTemplate.objects.get(pk=1)
+
+        job_template_1.body = '#!/bin/bash\n{{ content|safe }}'
+        job_template_1.save()
+        self.assertEqual(2, job_template_1.revision)
+
+        job_template_2.body = '#!/bin/sh\n{{ content|safe }}'
+        job_template_2.save()
+        self.assertEqual(3, job_template_2.revision)
+
+        # saving without a body change doesn't write back a stale revision
+        job_template_1.title = 'Foo'
+        job_template_1.save()
+        self.assertEqual(3, job_template_1.revision)
+        self.assertEqual(3, JobTemplate.objects.get(pk=1).revision)
+
+    def test_script_content(self):
+        """
+        Test that the script content is re-rendered lazily.
+        """
+        job_template = JobTemplate.objects.get(pk=1)
+        job_template.body = '#!/bin/bash\n{{ content|safe }}'
+
+        # the jobs are not saved nor updated
+        with self.assertNumQueries(3):
+            job_template.save()
+        self.assertEqual(2, job_template.revision)
+
+        job = Job.objects.select_related('job_template').get(pk=1)
+        self.assertEqual(1, job.script_content_revision)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                '#!/bin/bash\nprint "Hello world"', job.get_script_content())
+        self.assertEqual(2, Job.objects.get(pk=1).script_content_revision)
+
+        with self.assertNumQueries(0):
+            job.get_script_content()
+
+        # the compiled body is cached per revision
+        self.assertTrue(
+            job_template.get_compiled_body() is
+            JobTemplate.objects.get(pk=1).get_compiled_body()
+        )
+
+        # saving the job (eg: on run return) doesn't fetch the job-template
+        # to re-render
+        job = Job.objects.get(pk=2)
+        with self.assertNumQueries(2):
+            job.save()
+
+        job.script_content_partial = 'echo "Hello world"'
+        job.save()
+        self.assertEqual(
+            '#!/usr/bin/env python\n\necho "Hello world"\n',
+            Job.objects.get(pk=2).script_content.replace('\r', '')
+        )
+
 
 class RunTestCase(TestCase):
     """
@@ -54,6 +176,67 @@ class RunTestCase(TestCase):
         'test_jobs'
     ]
 
+    def test_script_content_run_failed(self):
+        """
+        Test that the run failed notification contains the re-rendered script
+        content.
+        """
+        job_template = JobTemplate.objects.get(pk=1)
+        job_template.body = '#!/bin/bash\n# new body\n{{ content|safe }}'
+        job_template.save()
+
+        Notification.objects.all().delete()
+        notifications.run_failed(Run.objects.get(pk=1))
+        self.assertIn('# new body', Notification.objects.latest('pk').body)
+
+    def test_return_concurrent_enqueue_update(self):
+        """
+        Test that a run return doesn't write back a stale effective enqueue
+        state.
+        """
+        run = Run.objects.select_related('job').get(pk=1)
+        self.assertTrue(run.job.effective_enqueue_is_enabled)
+
+        project = Project.objects.get(pk=1)
+        project.enqueue_is_enabled = False
+        project.save()
+
+        run.enqueue_dts = timezone.now()
+        run.start_dts = timezone.now()
+        run.return_dts = timezone.now()
+        run.return_success = True
+        run.save()
+
+        job = Job.objects.get(pk=1)
+        self.assertFalse(job.effective_enqueue_is_enabled)
+        self.assertEqual(run.get_schedule_id(), job.last_completed_schedule_id)
+
+    def test_return_concurrent_notification_addresses_update(self):
+        """
+        Test that a failed run uses (and doesn't write back over) invalidated
+        notification addresses.
+        """
+        run = Run.objects.select_related('job').get(pk=1)
+        run.job.get_notification_addresses()
+
+        project = Project.objects.get(pk=1)
+        project.notification_addresses = 'new@example.com'
+        project.save()
+
+        Notification.objects.all().delete()
+        run.enqueue_dts = timezone.now()
+        run.start_dts = timezone.now()
+        run.return_dts = timezone.now()
+        run.return_success = False
+        run.save()
+
+        recipients = Notification.objects.values_list('recipient', flat=True)
+        self.assertIn('new@example.com', recipients)
+        self.assertNotIn('project1@example.com', recipients)
+        self.assertNotIn(
+            'project1@example.com',
+            Job.objects.get(pk=1).get_notification_addresses())
+
     def test_reschedule(self):
         """
         Test reschedule.
@@ -193,6 +376,186 @@ class RunTestCase(TestCase):
             runs[1].schedule_dts
         )
 
+    def test_get_reschedule_date(self):
+        """
+        Test :meth:`.Job._get_reschedule_date` against the increment by
+        increment calculation.
+        """
+        dts_now = timezone.make_aware(
+            datetime(2013, 7, 10, 10, 30), timezone.utc)
+        references = [
+            dts_now + timedelta(hours=2),
+            dts_now - timedelta(seconds=90),
+            dts_now - timedelta(days=3, minutes=7),
+            dts_now - timedelta(days=40, hours=5),
+            dts_now - timedelta(days=400),
+            timezone.make_aware(datetime(2013, 5, 31, 20), timezone.utc),
+            timezone.make_aware(datetime(2012, 12, 31, 20), timezone.utc),
+        ]
+        exclude_sets = [
+            [],
+            [(time(12, 0), time(13, 0))],
+            [(time(10, 0), time(11, 0)), (time(11, 0), time(12, 30))],
+            [(time(0, 0), time(23, 59, 59, 999999))],
+        ]
+
+        def get_iterative(job, reference_date, excludes):
+            reschedule_date = job._get_reschedule_incremented_dts(
+                reference_date.astimezone(timezone.get_default_timezone()))
+            while reschedule_date < dts_now:
+                reschedule_date = job._get_reschedule_incremented_dts(
+                    reschedule_date)
+
+            first_date = reschedule_date
+            while [x for x in excludes
+                    if x[0] <= reschedule_date.time() <= x[1]]:
+                if reschedule_date - first_date > timedelta(days=1):
+                    return None
+                reschedule_date = job._get_reschedule_incremented_dts(
+                    reschedule_date)
+            return reschedule_date
+
+        job = Job.objects.get(pk=1)
+
+        with patch('django.utils.timezone.now', return_value=dts_now):
+            for excludes in exclude_sets:
+                job.rescheduleexclude_set.all().delete()
+                for start_time, end_time in excludes:
+                    RescheduleExclude.objects.create(
+                        job=job, start_time=start_time, end_time=end_time)
+
+                for interval_type, interval in (
+                        ('MINUTE', 1), ('MINUTE', 7), ('HOUR', 1),
+                        ('HOUR', 5), ('DAY', 1), ('DAY', 3), ('MONTH', 1),
+                        ('MONTH', 2)):
+                    job.reschedule_interval_type = interval_type
+                    job.reschedule_interval = interval
+
+                    for reference_date in references:
+                        # keep the increment by increment calculation fast
+                        if (interval_type == 'MINUTE' and
+                                dts_now - reference_date > timedelta(
+                                    days=45)):
+                            continue
+
+                        expected = get_iterative(
+                            job, reference_date, excludes)
+
+                        if expected is None:
+                            self.assertRaises(
+                                RescheduleException,
+                                job._get_reschedule_date,
+                                reference_date
+                            )
+                        else:
+                            self.assertEqual(
+                                expected,
+                                job._get_reschedule_date(reference_date)
+                            )
+
+    def test_get_reschedule_date_far_behind(self):
+        """
+        Test :meth:`.Job._get_reschedule_date` for a job which is far behind.
+        """
+        job = Job.objects.get(pk=1)
+        job.reschedule_interval_type = 'MINUTE'
+        RescheduleExclude.objects.create(
+            job=job, start_time=time(0, 0), end_time=time(11, 59))
+
+        reference_date = timezone.now() - timedelta(days=365, seconds=30)
+
+        with self.assertNumQueries(1):
+            reschedule_date = job._get_reschedule_date(reference_date)
+
+        self.assertTrue(reschedule_date >= timezone.now())
+        self.assertTrue(reschedule_date.astimezone(
+            timezone.get_default_timezone()).time() > time(11, 59))
+        self.assertEqual(
+            0, (reschedule_date - reference_date).seconds % 60)
+
+    def test_get_reschedule_dates(self):
+        """
+        Test :meth:`.Job.get_reschedule_dates` when the clock is set forward.
+        """
+        job = Job.objects.get(pk=1)
+        job.reschedule_interval_type = 'HOUR'
+
+        # the last sunday of march of next year
+        tzinfo = timezone.get_default_timezone()
+        year = timezone.now().year + 1
+        day = max([
+            x for x in range(25, 32) if datetime(year, 3, x).weekday() == 6])
+        last_schedule_dts = tzinfo.localize(datetime(year, 3, day))
+
+        reschedule_dates = job.get_reschedule_dates(
+            last_schedule_dts, last_schedule_dts + timedelta(hours=4))
+
+        self.assertEqual(
+            [last_schedule_dts + timedelta(hours=x) for x in range(1, 5)],
+            reschedule_dates
+        )
+
+    def test_reschedule_cron(self):
+        """
+        Test reschedule with a cron expression.
+        """
+        job = Job.objects.get(pk=1)
+        job.reschedule_interval_type = 'CRON'
+        job.reschedule_interval = None
+        job.reschedule_cron_expression = '15 2 * * mon-fri'
+        job.full_clean()
+        job.save()
+
+        Run.objects.filter(pk=1).update(
+            enqueue_dts=timezone.now(),
+            return_dts=timezone.now(),
+        )
+        RescheduleExclude.objects.create(
+            job=job,
+            start_time=time(2, 0),
+            end_time=time(3, 0),
+        )
+        RescheduleExclude.objects.create(
+            job=job,
+            start_time=time(0, 0),
+            end_time=time(1, 0),
+        )
+
+        dts_now = timezone.make_aware(
+            datetime(2013, 7, 12, 10, 30), timezone.utc)
+
+        # the exclude covers all matches
+        with patch('django.utils.timezone.now', return_value=dts_now):
+            job.reschedule()
+        self.assertEqual(1, Run.objects.filter(job_id=1).count())
+
+        RescheduleExclude.objects.filter(start_time=time(2, 0)).delete()
+
+        # 2013-07-12 is a friday
+        with patch('django.utils.timezone.now', return_value=dts_now):
+            job.reschedule()
+
+        self.assertEqual(2, Run.objects.filter(job_id=1).count())
+        self.assertEqual(
+            timezone.get_default_timezone().localize(
+                datetime(2013, 7, 15, 2, 15)),
+            Run.objects.filter(job_id=1).order_by('-pk')[0].schedule_dts
+        )
+
+    def test_clean_cron(self):
+        """
+        Test validating the cron expression.
+        """
+        job = Job.objects.get(pk=1)
+        job.reschedule_interval_type = 'CRON'
+        self.assertRaises(ValidationError, job.full_clean)
+
+        job.reschedule_cron_expression = '* * *'
+        self.assertRaises(ValidationError, job.full_clean)
+
+        job.reschedule_cron_expression = '*/5 * * * *'
+        job.full_clean()
+
     def test_reschedule_with_invalid_exclude(self):
         """
         Test reschedule with exclude time which is invalid.
@@ -216,9 +579,11 @@ class RunTestCase(TestCase):
         job.reschedule()
 
         self.assertEqual(1, Run.objects.filter(job_id=1).count())
+        self.assertEqual(4, Notification.objects.count())
+        self.assertEqual(4, notifications.send_queued_notifications())
         self.assertTrue(hasattr(mail, 'outbox'))
-        self.assertEqual(1, len(mail.outbox))
-        self.assertEqual(4, len(mail.outbox[0].to))
+        self.assertEqual(4, len(mail.outbox))
+        self.assertEqual(1, len(mail.outbox[0].to))
         self.assertEqual(
             'Reschedule error for: Test job 1', mail.outbox[0].subject)
 
@@ -289,6 +654,58 @@ class RunTestCase(TestCase):
             Job.objects.get(pk=1).get_notification_addresses()
         )
 
+    def test_effective_notification_addresses(self):
+        """
+        Test that the resolved notification addresses are cached.
+        """
+        job = Job.objects.get(pk=1)
+        job.get_notification_addresses()
+
+        job = Job.objects.get(pk=1)
+        with self.assertNumQueries(0):
+            self.assertEqual(4, len(job.get_notification_addresses()))
+
+        # saving without changes keeps the cached addresses
+        project = Project.objects.get(pk=1)
+        project.save()
+        self.assertNotEqual(
+            None, Job.objects.get(pk=1).effective_notification_addresses)
+
+        project.notification_addresses = 'project1@example.com\nnew@x.com'
+        project.save()
+
+        job = Job.objects.get(pk=1)
+        self.assertEqual(None, job.effective_notification_addresses)
+        self.assertIn('new@x.com', job.get_notification_addresses())
+
+        job = Job.objects.get(pk=1)
+        job.notification_addresses = ''
+        job.save()
+
+        job = Job.objects.get(pk=1)
+        with self.assertNumQueries(0):
+            self.assertItemsEqual(
+                [
+                    'project1@example.com',
+                    'new@x.com',
+                    'pool1@example.com',
+                    'template1@example.com',
+                ],
+                job.get_notification_addresses()
+            )
+
+        # moving the job-template to an other project
+        job_template = JobTemplate.objects.get(pk=1)
+        job_template.project = Project.objects.get(pk=2)
+        job_template.save()
+
+        job = Job.objects.get(pk=1)
+        self.assertEqual(None, job.effective_notification_addresses)
+        self.assertNotIn(
+            'project1@example.com', job.get_notification_addresses())
+        self.assertIn(
+            'project2@example.com', job.get_notification_addresses())
+
     def test_schedule(self):
         """
         Test direct schedule.
@@ -301,15 +718,113 @@ class RunTestCase(TestCase):
         job.schedule()
         self.assertEqual(1, job.run_set.count())
 
-    def test_schedule_id_set_on_create(self):
+    def test_schedule_id_on_create(self):
         """
-        Test that the ``schedule_id`` is set on create.
+        Test that a run is its own schedule, without a second write.
         """
+        job = Job.objects.get(pk=1)
+
+        with self.assertNumQueries(1):
+            run = Run.objects.create(job=job, schedule_dts=timezone.now())
+
+        self.assertEqual(None, run.schedule_id)
+        self.assertEqual(run.pk, run.get_schedule_id())
+
+    def test_get_siblings(self):
+        """
+        Test :meth:`.Run.get_siblings`.
+        """
+        job = Job.objects.get(pk=1)
+        run = Run.objects.create(job=job, schedule_dts=timezone.now())
+        sibling = Run.objects.create(
+            job=job, schedule_dts=timezone.now(), schedule_id=run.pk)
+        Run.objects.create(job=job, schedule_dts=timezone.now())
+
+        self.assertEqual([sibling], list(run.get_siblings()))
+        self.assertEqual([run], list(sibling.get_siblings()))
+
+    def test_register_return(self):
+        """
+        Test :meth:`.Run.register_return`.
+        """
+        job = Job.objects.get(pk=1)
+        run = Run.objects.create(job=job, schedule_dts=timezone.now())
+        self.assertEqual(None, run.register_return())
+
+        runs = []
+        for x in range(3):
+            runs.append(Run.objects.create(
+                job=job, schedule_dts=timezone.now(), schedule_id=run.pk))
+        ScheduleCounter.objects.create(schedule_id=run.pk, expected=3)
+
+        runs[0].return_success = False
+        with self.assertNumQueries(1):
+            self.assertEqual((False, None), runs[0].register_return())
+
+        runs[1].return_success = True
+        self.assertEqual((False, None), runs[1].register_return())
+
+        runs[2].return_success = True
+        self.assertEqual((True, 1), runs[2].register_return())
+        self.assertEqual(0, ScheduleCounter.objects.count())
+
+        # deleting a run which didn't return yet deletes the counter
+        ScheduleCounter.objects.create(schedule_id=run.pk, expected=3)
+        runs[0].delete()
+        self.assertEqual(0, ScheduleCounter.objects.count())
+
+    def test_register_return_not_fan_out(self):
+        """
+        Test that the return of a run which is not part of a fan-out is not
+        registered in a counter.
+        """
+        run = Run.objects.get(pk=1)
+        run.enqueue_dts = timezone.now()
+        run.start_dts = timezone.now()
+        run.return_dts = timezone.now()
+        run.return_success = True
+
+        with patch.object(Run, 'register_return') as register_return:
+            run.save()
+        self.assertEqual(0, register_return.call_count)
+
+    @patch('job_runner.apps.job_runner.signals.notify_broadcaster')
+    def test_notify_broadcaster(self, notify_broadcaster):
+        """
+        Test that the broadcaster is notified about new, re-scheduled and
+        returned runs.
+        """
+        schedule_dts = timezone.now() + timedelta(hours=1)
         run = Run.objects.create(
             job=Job.objects.get(pk=1),
-            schedule_dts=timezone.now()
+            schedule_dts=schedule_dts,
         )
-        self.assertTrue(run.pk == run.schedule_id)
+        notify_broadcaster.assert_called_once_with(
+            'run_created', job_id=1, run_id=run.pk, schedule_dts=schedule_dts)
+
+        # saving without changing the schedule_dts doesn't notify
+        notify_broadcaster.reset_mock()
+        run = Run.objects.get(pk=run.pk)
+        run.save()
+        self.assertEqual(0, notify_broadcaster.call_count)
+
+        schedule_dts = timezone.now()
+        run.schedule_dts = schedule_dts
+        run.save()
+        notify_broadcaster.assert_called_once_with(
+            'run_updated', job_id=1, run_id=run.pk, schedule_dts=schedule_dts)
+
+        notify_broadcaster.reset_mock()
+        run.enqueue_dts = timezone.now()
+        run.save()
+        self.assertEqual(0, notify_broadcaster.call_count)
+
+        run.start_dts = timezone.now()
+        run.return_dts = timezone.now()
+        run.return_success = True
+        run.save()
+        notify_broadcaster.assert_called_once_with(
+            'run_returned', run_id=run.pk)
 
     def test_mark_failed(self):
         """
@@ -345,3 +860,79 @@ class RunTestCase(TestCase):
         run = Run.objects.get(pk=1)
 
         self.assertTrue(run.return_success)
+
+
+class WorkerTestCase(TestCase):
+    """
+    Tests for :class:`.Worker`.
+    """
+    fixtures = ['test_workers']
+
+    def test_ping_rtt(self):
+        """
+        Test the ping round-trip time on ping response.
+        """
+        Worker.objects.filter(pk=1).update(
+            ping_request_seq=3,
+            ping_request_dts=timezone.now() - timedelta(seconds=2),
+            ping_rtt_history=','.join(['1'] * 10),
+        )
+        worker = Worker.objects.get(pk=1)
+
+        # response to an old ping request
+        worker.ping_response_seq = 2
+        worker.save()
+        self.assertEqual([1] * 10, worker.get_ping_rtt_history())
+
+        worker.ping_response_seq = 3
+        worker.save()
+
+        worker = Worker.objects.get(pk=1)
+        history = worker.get_ping_rtt_history()
+        self.assertEqual(10, len(history))
+        self.assertTrue(2000 <= history[-1] < 3000)
+        self.assertEqual(sum(history) / 10, worker.get_ping_rtt())
+
+        # saving again doesn't add the same response twice
+        worker.save()
+        self.assertEqual(history, worker.get_ping_rtt_history())
+
+    def test_ping_rtt_concurrent_ping_request(self):
+        """
+        Test a ping response saved while a new ping request is sent.
+        """
+        Worker.objects.filter(pk=1).update(
+            ping_request_seq=3,
+            ping_request_dts=timezone.now() - timedelta(seconds=2),
+        )
+        worker = Worker.objects.get(pk=1)
+
+        # the broadcaster sends the next ping request
+        request_dts = timezone.now()
+        Worker.objects.filter(pk=1).update(
+            ping_request_seq=F('ping_request_seq') + 1,
+            ping_request_dts=request_dts,
+        )
+
+        worker.ping_response_seq = 3
+        worker.save()
+
+        worker = Worker.objects.get(pk=1)
+        self.assertEqual(4, worker.ping_request_seq)
+        self.assertEqual(request_dts, worker.ping_request_dts)
+        self.assertEqual(3, worker.ping_response_seq)
+        self.assertEqual([], worker.get_ping_rtt_history())
+
+    def test_add_ping_rtt_max_length(self):
+        """
+        Test that the ping RTT history is truncated to fit the column.
+        """
+        worker = Worker.objects.get(pk=1)
+
+        with self.settings(JOB_RUNNER_WORKER_PING_RTT_HISTORY=100):
+            for x in range(100):
+                worker.add_ping_rtt(timedelta(seconds=1000))
+
+        self.assertTrue(len(worker.ping_rtt_history) <= 255)
+        self.assertEqual(
+            [1000000] * (256 / 8), worker.get_ping_rtt_history())
@@ -0,0 +1,186 @@
+from datetime import timedelta
+
+from django.core import mail
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from mock import Mock, patch
+
+from job_runner.apps.job_runner import notifications
+from job_runner.apps.job_runner.models import (
+    Job,
+    Notification,
+    NotificationThrottle,
+    Run,
+)
+
+
+class NotificationsTestCase(TestCase):
+    """
+    Tests for the notification outbox.
+    """
+    def test_queue_notification(self):
+        """
+        Test :func:`.queue_notification`.
+        """
+        notifications.queue_notification(
+            'Subject', 'Body', ['a@example.com', 'b@example.com',
+                                'a@example.com'])
+
+        self.assertEqual(0, len(mail.outbox))
+        self.assertEqual(
+            ['a@example.com', 'b@example.com'],
+            list(Notification.objects.values_list('recipient', flat=True)))
+
+    def test_send_queued_notifications(self):
+        """
+        Test :func:`.send_queued_notifications`.
+
+        The notifications for the same recipient are coalesced into a single
+        e-mail.
+
+        """
+        for x in range(3):
+            notifications.queue_notification(
+                'Subject {0}'.format(x), 'Body {0}'.format(x),
+                ['a@example.com'])
+        notifications.queue_notification(
+            'Subject 3', 'Body 3', ['b@example.com'])
+
+        with self.assertNumQueries(3):
+            self.assertEqual(2, notifications.send_queued_notifications())
+
+        self.assertEqual(0, Notification.objects.count())
+        self.assertEqual(2, len(mail.outbox))
+
+        self.assertEqual(['a@example.com'], mail.outbox[0].to)
+        self.assertEqual('Subject 0 (and 2 more)', mail.outbox[0].subject)
+        self.assertIn('Subject 1\n=========\n\nBody 1', mail.outbox[0].body)
+
+        self.assertEqual(['b@example.com'], mail.outbox[1].to)
+        self.assertEqual('Subject 3', mail.outbox[1].subject)
+        self.assertEqual('Body 3', mail.outbox[1].body)
+
+        self.assertEqual(0, notifications.send_queued_notifications())
+
+    @override_settings(
+        JOB_RUNNER_NOTIFICATION_RETRY_INTERVAL=60,
+        JOB_RUNNER_NOTIFICATION_MAX_ATTEMPTS=3,
+    )
+    @patch('job_runner.apps.job_runner.notifications.get_connection')
+    def test_send_queued_notifications_failed(self, get_connection):
+        """
+        Test :func:`.send_queued_notifications` when the delivery fails.
+        """
+        get_connection.return_value.send_messages = Mock(
+            side_effect=Exception('Boom!'))
+
+        notifications.queue_notification('Subject', 'Body', ['a@example.com'])
+
+        self.assertEqual(0, notifications.send_queued_notifications())
+        notification = Notification.objects.get()
+        self.assertEqual(1, notification.attempts)
+        self.assertTrue(
+            notification.next_attempt_dts >
+            timezone.now() + timedelta(seconds=55))
+        self.assertEqual(1, get_connection.return_value.close.call_count)
+
+        # not due yet
+        self.assertEqual(0, notifications.send_queued_notifications())
+        self.assertEqual(1, Notification.objects.get().attempts)
+
+        # the interval is doubled after every failed attempt
+        Notification.objects.update(next_attempt_dts=timezone.now())
+        self.assertEqual(0, notifications.send_queued_notifications())
+        notification = Notification.objects.get()
+        self.assertEqual(2, notification.attempts)
+        self.assertTrue(
+            notification.next_attempt_dts >
+            timezone.now() + timedelta(seconds=115))
+
+        # and discarded after the max. number of attempts
+        Notification.objects.update(next_attempt_dts=timezone.now())
+        self.assertEqual(0, notifications.send_queued_notifications())
+        self.assertEqual(0, Notification.objects.count())
+
+
+class RateLimitTestCase(TestCase):
+    """
+    Tests for the notification rate-limit.
+    """
+    fixtures = [
+        'test_auth',
+        'test_projects',
+        'test_workers',
+        'test_worker_pools',
+        'test_job_templates',
+        'test_jobs',
+    ]
+
+    @override_settings(
+        JOB_RUNNER_NOTIFICATION_BURST=2,
+        JOB_RUNNER_NOTIFICATION_DIGEST_WINDOW=60 * 60,
+    )
+    def test_run_failed(self):
+        """
+        Test :func:`.run_failed` when the rate-limit is reached.
+        """
+        job = Job.objects.get(pk=1)
+        runs = []
+        for x in range(5):
+            runs.append(Run.objects.create(
+                job=job, schedule_dts=timezone.now()))
+        Notification.objects.all().delete()
+
+        for run in runs:
+            notifications.run_failed(run)
+
+        # 2 notifications for each of the 4 addresses
+        self.assertEqual(8, Notification.objects.count())
+        throttle = NotificationThrottle.objects.get(key='run_failed:job:1')
+        self.assertEqual(3, throttle.suppressed)
+        self.assertEqual('Run error for: Test job 1', throttle.subject)
+        self.assertEqual(4, len(throttle.addresses.split('\n')))
+
+        # the window has not passed yet
+        self.assertEqual(0, notifications.queue_digests())
+
+        NotificationThrottle.objects.update(
+            suppressed_since_dts=timezone.now() - timedelta(hours=1))
+        self.assertEqual(1, notifications.queue_digests())
+        self.assertEqual(12, Notification.objects.count())
+        self.assertEqual(
+            'Digest of 3 notification(s): Run error for: Test job 1',
+            Notification.objects.latest('pk').subject)
+
+        throttle = NotificationThrottle.objects.get(key='run_failed:job:1')
+        self.assertEqual(0, throttle.suppressed)
+        self.assertEqual(None, throttle.suppressed_since_dts)
+        self.assertEqual(0, notifications.queue_digests())
+
+        # the bucket is refilled over the window
+        NotificationThrottle.objects.update(
+            update_dts=timezone.now() - timedelta(minutes=30))
+        notifications.run_failed(runs[0])
+        self.assertEqual(16, Notification.objects.count())
+        self.assertEqual(
+            0,
+            NotificationThrottle.objects.get(
+                key='run_failed:job:1').suppressed
+        )
+
+    def test_take_token_concurrent_create(self):
+        """
+        Test :func:`._take_token` when the bucket is created concurrently.
+        """
+        NotificationThrottle.objects.create(
+            key='run_failed:job:1', tokens=2, update_dts=timezone.now())
+
+        # the bucket didn't exist yet when checked
+        with patch('django.db.models.query.QuerySet.exists') as exists:
+            exists.return_value = False
+            self.assertTrue(notifications._take_token(
+                'run_failed:job:1', 'Subject', ['a@example.com']))
+
+        throttle = NotificationThrottle.objects.get()
+        self.assertTrue(1 <= throttle.tokens < 1.1)
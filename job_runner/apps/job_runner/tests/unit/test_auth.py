@@ -2,13 +2,19 @@ from django.test import TestCase
 
 from mock import Mock, patch
 
-from job_runner.apps.job_runner.auth import validate_hmac
+from job_runner.apps.job_runner.auth import (
+    CredentialCache, _get_cached_scope, credential_cache, invalidate_scopes,
+    scope_cache, validate_hmac)
 
 
 class ModuleTestCase(TestCase):
     """
     Tests for :mod:`apps.job_runner.auth`.
     """
+    def setUp(self):
+        credential_cache.clear()
+        scope_cache.clear()
+
     @patch('job_runner.apps.job_runner.auth.Worker')
     def test_validate_hmac_valid_api_key(self, Worker):
         """
@@ -46,3 +52,91 @@ class ModuleTestCase(TestCase):
         api_user.secret = 'foobar'
 
         self.assertFalse(validate_hmac(request))
+
+    @patch('job_runner.apps.job_runner.auth.Worker')
+    def test_validate_hmac_cached_credentials(self, Worker):
+        """
+        Test :func:`.validate_hmac` caches the worker credentials.
+        """
+        request = Mock()
+        request.method = 'POST'
+        request.META = {
+            'HTTP_AUTHORIZATION': (
+                'ApiKey api_user:9bfd7ed2a963182c4005c851f5f862cc97607f7b'),
+        }
+        request.get_full_path.return_value = 'full_request_path'
+        request.raw_post_data = 'raw_post_data'
+
+        api_user = Worker.objects.get.return_value
+        api_user.pk = 1
+        api_user.secret = 'foobar'
+
+        self.assertTrue(validate_hmac(request))
+        self.assertTrue(validate_hmac(request))
+        self.assertEqual(1, Worker.objects.get.call_count)
+
+        # the credentials are removed from the cache when the worker changes
+        credential_cache.invalidate(1)
+        self.assertTrue(validate_hmac(request))
+        self.assertEqual(2, Worker.objects.get.call_count)
+
+    def test__get_cached_scope(self):
+        """
+        Test :func:`._get_cached_scope`.
+        """
+        resolve = Mock(return_value=([1], [2]))
+
+        self.assertEqual(([1], [2]), _get_cached_scope('key', resolve))
+        self.assertEqual(([1], [2]), _get_cached_scope('key', resolve))
+        self.assertEqual(1, resolve.call_count)
+
+        invalidate_scopes(sender=None)
+        self.assertEqual(([1], [2]), _get_cached_scope('key', resolve))
+        self.assertEqual(2, resolve.call_count)
+
+
+class CredentialCacheTestCase(TestCase):
+    """
+    Tests for :class:`.CredentialCache`.
+    """
+    def test_lru(self):
+        """
+        Test that the least recently used credentials are removed.
+        """
+        cache = CredentialCache(max_size=2, ttl=60)
+        cache.set('key1', 1, 'secret1')
+        cache.set('key2', 2, 'secret2')
+        self.assertEqual((1, 'secret1'), cache.get('key1'))
+
+        cache.set('key3', 3, 'secret3')
+        self.assertEqual((1, 'secret1'), cache.get('key1'))
+        self.assertEqual(None, cache.get('key2'))
+        self.assertEqual((3, 'secret3'), cache.get('key3'))
+
+    @patch('job_runner.apps.job_runner.auth.time')
+    def test_ttl(self, time):
+        """
+        Test that the credentials expire.
+        """
+        time.time.return_value = 1000
+        cache = CredentialCache(max_size=2, ttl=60)
+        cache.set('key1', 1, 'secret1')
+
+        time.time.return_value = 1060
+        self.assertEqual((1, 'secret1'), cache.get('key1'))
+
+        time.time.return_value = 1061
+        self.assertEqual(None, cache.get('key1'))
+
+    def test_invalidate(self):
+        """
+        Test invalidating the credentials of a worker.
+        """
+        cache = CredentialCache(max_size=2, ttl=60)
+        cache.set('key1', 1, 'secret1')
+        cache.set('key2', 2, 'secret2')
+
+        cache.invalidate(1)
+        cache.invalidate(3)
+        self.assertEqual(None, cache.get('key1'))
+        self.assertEqual((2, 'secret2'), cache.get('key2'))
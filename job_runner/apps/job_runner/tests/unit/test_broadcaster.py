@@ -0,0 +1,219 @@
+from datetime import datetime, timedelta
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from mock import Mock, patch
+
+from job_runner.apps.job_runner.broadcaster import (
+    DeliveryTracker, LeastLoadedWorkerSelector, RandomWorkerSelector,
+    RunTimeline, get_shard_ports, notify_broadcaster)
+from job_runner.apps.job_runner.models import Worker
+
+
+class RunTimelineTestCase(TestCase):
+    """
+    Tests for :class:`.RunTimeline`.
+    """
+    def setUp(self):
+        self.dts = timezone.make_aware(datetime(2032, 1, 1), timezone.utc)
+
+    def test_pop_due(self):
+        """
+        Test :meth:`.RunTimeline.pop_due`.
+        """
+        timeline = RunTimeline()
+        timeline.add(3, self.dts + timedelta(minutes=3))
+        timeline.add(1, self.dts + timedelta(minutes=1))
+        timeline.add(2, self.dts + timedelta(minutes=2))
+
+        self.assertEqual(3, len(timeline))
+        self.assertEqual(
+            self.dts + timedelta(minutes=1), timeline.next_dts())
+        self.assertEqual([
+            (1, self.dts + timedelta(minutes=1)),
+            (2, self.dts + timedelta(minutes=2)),
+        ], timeline.pop_due(self.dts + timedelta(minutes=2)))
+        self.assertEqual(1, len(timeline))
+        self.assertEqual([], timeline.pop_due(self.dts))
+
+    def test_reschedule_and_remove(self):
+        """
+        Test re-scheduling and removing runs.
+        """
+        timeline = RunTimeline()
+        timeline.add(1, self.dts + timedelta(minutes=1))
+        timeline.add(2, self.dts + timedelta(minutes=2))
+        timeline.add(1, self.dts + timedelta(minutes=3))
+        timeline.remove(2)
+
+        self.assertEqual(
+            self.dts + timedelta(minutes=3), timeline.next_dts())
+        self.assertEqual(
+            [(1, self.dts + timedelta(minutes=3))],
+            timeline.pop_due(self.dts + timedelta(minutes=5))
+        )
+        self.assertEqual(None, timeline.next_dts())
+
+
+class DeliveryTrackerTestCase(TestCase):
+    """
+    Tests for :class:`.DeliveryTracker`.
+    """
+    def test_sent(self):
+        """
+        Test :meth:`.DeliveryTracker.sent`.
+        """
+        tracker = DeliveryTracker(5)
+        tracker.sent(1, 10)
+        tracker.sent(1, 10)
+        tracker.sent(2, 10)
+
+        self.assertEqual(2, len(tracker))
+        self.assertEqual(2, tracker.get_attempts(1))
+        self.assertFalse(tracker.is_due(1))
+        self.assertEqual({10: 2}, tracker.get_worker_counts())
+        self.assertTrue(
+            tracker.next_dts() <= timezone.now() + timedelta(seconds=5))
+
+        # sending to an other worker resets the attempts
+        tracker.sent(1, 11)
+        self.assertEqual(1, tracker.get_attempts(1))
+        self.assertEqual(11, tracker.get_worker_id(1))
+
+    def test_retain(self):
+        """
+        Test :meth:`.DeliveryTracker.retain`.
+        """
+        tracker = DeliveryTracker(0)
+        tracker.sent(1, 10)
+        tracker.sent(2, 10)
+        tracker.retain({2: None})
+
+        self.assertFalse(1 in tracker)
+        self.assertTrue(tracker.is_due(2))
+        self.assertEqual(None, tracker.get_worker_id(1))
+
+        tracker.remove(2)
+        self.assertEqual(None, tracker.next_dts())
+
+
+@override_settings(
+    JOB_RUNNER_BROADCASTER_SHARDS=2,
+    JOB_RUNNER_BROADCASTER_PORT=5556,
+    JOB_RUNNER_BROADCASTER_NOTIFY_PORT=5557,
+)
+class ShardingTestCase(TestCase):
+    """
+    Tests for sharding the queue broadcaster.
+    """
+    def test_get_shard_ports(self):
+        """
+        Test :func:`.get_shard_ports`.
+        """
+        self.assertEqual((5556, 5557), get_shard_ports(1))
+        self.assertEqual((5558, 5559), get_shard_ports(2))
+
+    @patch('job_runner.apps.job_runner.broadcaster._get_notify_sockets')
+    def test_notify_broadcaster(self, get_notify_sockets):
+        """
+        Test that :func:`.notify_broadcaster` notifies the right shard(s).
+        """
+        sockets = [Mock(), Mock()]
+        get_notify_sockets.return_value = sockets
+
+        notify_broadcaster('run_created', job_id=3, run_id=1)
+        self.assertFalse(sockets[0].send.called)
+        self.assertEqual(1, sockets[1].send.call_count)
+
+        notify_broadcaster('run_returned', run_id=1)
+        self.assertEqual(1, sockets[0].send.call_count)
+        self.assertEqual(2, sockets[1].send.call_count)
+
+
+class WorkerSelectorTestCase(TestCase):
+    """
+    Tests for the worker selectors.
+    """
+    def setUp(self):
+        self.worker1 = Worker(
+            pk=1, concurrent_jobs=4, ping_response_dts=timezone.now())
+        self.worker2 = Worker(
+            pk=2, concurrent_jobs=1, ping_response_dts=timezone.now())
+        self.worker3 = Worker(
+            pk=3, concurrent_jobs=8,
+            ping_response_dts=timezone.now() - timedelta(days=1))
+
+    def test_random_skips_unresponsive(self):
+        """
+        Test that :class:`.RandomWorkerSelector` skips unresponsive workers.
+        """
+        selector = RandomWorkerSelector({})
+
+        for x in range(10):
+            self.assertNotEqual(self.worker3, selector.select(
+                None, [self.worker1, self.worker2, self.worker3]))
+
+    def test_all_unresponsive(self):
+        """
+        Test selecting when none of the workers is responsive.
+        """
+        selector = RandomWorkerSelector({})
+        self.assertEqual(self.worker3, selector.select(None, [self.worker3]))
+        self.assertEqual(None, selector.select(None, []))
+
+    def test_least_loaded(self):
+        """
+        Test :class:`.LeastLoadedWorkerSelector`.
+        """
+        workers = [self.worker1, self.worker2, self.worker3]
+        selector = LeastLoadedWorkerSelector({1: 3})
+
+        # worker2 has no active runs, worker3 is unresponsive
+        self.assertEqual(self.worker2, selector.select(None, workers))
+        selector.assign(self.worker2)
+
+        # worker1: 3 / 4 runs, worker2: 1 / 1 runs
+        self.assertEqual(self.worker1, selector.select(None, workers))
+        selector.assign(self.worker1)
+
+        self.assertEqual({1: 4, 2: 1}, selector.active_runs)
+
+    def test_saturated(self):
+        """
+        Test that saturated workers are not selected.
+        """
+        workers = [self.worker1, self.worker2]
+        selector = LeastLoadedWorkerSelector({1: 4, 2: 1})
+
+        self.assertFalse(selector.has_capacity(self.worker1))
+        self.assertFalse(selector.has_capacity(self.worker2))
+        self.assertEqual(None, selector.select(None, workers))
+
+        # workers without reported concurrent jobs are never saturated
+        self.worker2.concurrent_jobs = None
+        self.assertEqual(self.worker2, selector.select(None, workers))
+
+    def test_saturated_shards(self):
+        """
+        Test that the capacity of the workers is split between the shards.
+        """
+        # worker1 has 1 enqueued run, the 3 other slots are split between
+        # 2 shards
+        capacities = []
+        for shard in (1, 2):
+            selector = LeastLoadedWorkerSelector(
+                {1: 1}, in_flight_runs={}, shard=shard, shards=2)
+            capacities.append(selector.get_capacity(self.worker1))
+        self.assertEqual([3, 2], capacities)
+
+        # the in-flight runs of this shard count against its share
+        selector = LeastLoadedWorkerSelector(
+            {1: 1}, in_flight_runs={}, shard=2, shards=2)
+        self.assertTrue(selector.has_capacity(self.worker1))
+        selector.assign(self.worker1)
+        self.assertFalse(selector.has_capacity(self.worker1))
+
+        selector = LeastLoadedWorkerSelector(
+            {1: 3}, in_flight_runs={1: 2}, shard=1, shards=2)
+        self.assertFalse(selector.has_capacity(self.worker1))
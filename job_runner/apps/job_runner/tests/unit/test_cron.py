@@ -0,0 +1,116 @@
+from datetime import datetime
+
+import pytz
+from django.test import TestCase
+
+from job_runner.apps.job_runner.cron import (
+    CronExpression,
+    InvalidCronExpression,
+    get_cron_expression,
+    get_next_dts,
+)
+
+
+class CronExpressionTestCase(TestCase):
+    """
+    Tests for :class:`.CronExpression`.
+    """
+    def test_parse(self):
+        """
+        Test parsing an expression.
+        """
+        expression = CronExpression('*/20 1-3,5 1 jan-mar/2 mon-fri,7')
+
+        self.assertEqual([0, 20, 40], expression.minutes)
+        self.assertEqual([1, 2, 3, 5], expression.hours)
+        self.assertEqual([1], expression.days)
+        self.assertEqual([1, 3], expression.months)
+        self.assertEqual([0, 1, 2, 3, 4, 5], expression.days_of_week)
+
+        expression = CronExpression('@hourly')
+        self.assertEqual([0], expression.minutes)
+        self.assertEqual(range(24), expression.hours)
+
+    def test_parse_invalid(self):
+        """
+        Test parsing invalid expressions.
+        """
+        for invalid in [
+                '* * * *',
+                '60 * * * *',
+                '* * 0 * *',
+                '5-1 * * * *',
+                '*/0 * * * *',
+                'foo * * * *']:
+            self.assertRaises(InvalidCronExpression, CronExpression, invalid)
+
+    def test_get_next(self):
+        """
+        Test :meth:`.CronExpression.get_next`.
+        """
+        in_and_expected = [
+            # weekdays at 02:15, 2013-07-12 is a friday
+            ('15 2 * * mon-fri', datetime(2013, 7, 12, 2, 15),
+                datetime(2013, 7, 15, 2, 15)),
+            ('15 2 * * mon-fri', datetime(2013, 7, 12, 2, 14, 59),
+                datetime(2013, 7, 12, 2, 15)),
+            # steps
+            ('*/15 * * * *', datetime(2013, 7, 12, 23, 50),
+                datetime(2013, 7, 13, 0, 0)),
+            ('0 */6 * * *', datetime(2013, 7, 12, 6, 0),
+                datetime(2013, 7, 12, 12, 0)),
+            # day of month or day of week, 2013-07-14 is a sunday
+            ('0 0 20 * sun', datetime(2013, 7, 12),
+                datetime(2013, 7, 14)),
+            ('0 0 13 * sun', datetime(2013, 7, 12),
+                datetime(2013, 7, 13)),
+            # a day field starting with * combines the day fields with and
+            ('0 0 */2 * mon', datetime(2013, 7, 12),
+                datetime(2013, 7, 15)),
+            ('0 0 20 * */2', datetime(2013, 7, 12),
+                datetime(2013, 7, 20)),
+            # end of the year and leap days
+            ('@yearly', datetime(2013, 7, 12), datetime(2014, 1, 1)),
+            ('0 12 29 feb *', datetime(2013, 7, 12),
+                datetime(2016, 2, 29, 12)),
+        ]
+
+        for expression, in_dts, expected_dts in in_and_expected:
+            self.assertEqual(
+                expected_dts, CronExpression(expression).get_next(in_dts))
+
+        self.assertEqual(
+            None, CronExpression('0 0 31 2 *').get_next(datetime(2013, 1, 1)))
+
+    def test_get_cron_expression(self):
+        """
+        Test that :func:`.get_cron_expression` caches the expressions.
+        """
+        self.assertTrue(
+            get_cron_expression('0 * * * *') is
+            get_cron_expression('0 * * * *')
+        )
+
+    def test_get_next_dts(self):
+        """
+        Test :func:`.get_next_dts` around daylight saving-time changes.
+        """
+        tzinfo = pytz.timezone('Europe/Amsterdam')
+
+        # summer time (+2) to winter time (+1)
+        dts = tzinfo.localize(datetime(2013, 10, 26, 2, 15))
+        next_dts = get_next_dts('15 2 * * *', dts, tzinfo)
+        self.assertEqual(
+            tzinfo.localize(datetime(2013, 10, 27, 2, 15), is_dst=False),
+            next_dts
+        )
+        self.assertEqual(
+            datetime(2013, 10, 27, 1, 15),
+            next_dts.astimezone(pytz.utc).replace(tzinfo=None)
+        )
+
+        # 02:15 does not exist when switching to summer time
+        dts = tzinfo.localize(datetime(2013, 3, 30, 2, 15))
+        next_dts = get_next_dts('15 2 * * *', dts, tzinfo)
+        self.assertEqual(
+            tzinfo.localize(datetime(2013, 3, 31, 3, 15)), next_dts)
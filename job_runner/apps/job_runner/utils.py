@@ -22,3 +22,28 @@ def correct_dst_difference(previous_schedule_dts, next_schedule_dts):
     dts_difference = previous_dts.utcoffset() - next_dts.utcoffset()
 
     return next_dts + dts_difference
+
+
+def timedelta_to_microseconds(delta):
+    """
+    Return the total number of microseconds (``int``) of ``delta``.
+
+    :param delta:
+        An instance of :class:`datetime.timedelta`.
+
+    """
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def time_to_microseconds(time):
+    """
+    Return the number of microseconds (``int``) since midnight of ``time``.
+
+    :param time:
+        An instance of :class:`datetime.time`.
+
+    """
+    return (
+        (time.hour * 3600 + time.minute * 60 + time.second) * 1000000 +
+        time.microsecond
+    )
@@ -187,6 +187,49 @@ This list will currently be used when a job failed to reschedule.
 """
 
 
+JOB_RUNNER_NOTIFICATION_SEND_INTERVAL = 10
+"""
+The interval in seconds at which ``manage.py send_notifications`` delivers the
+queued e-mail notifications.
+
+Notifications queued for the same address in the meantime are sent as a
+single e-mail.
+
+"""
+
+
+JOB_RUNNER_NOTIFICATION_RETRY_INTERVAL = 60
+"""
+The interval in seconds after which the delivery of a notification is retried
+when it failed. The interval is doubled after every failed attempt.
+"""
+
+
+JOB_RUNNER_NOTIFICATION_MAX_ATTEMPTS = 10
+"""
+The number of failed delivery attempts after which a notification is
+discarded.
+"""
+
+
+JOB_RUNNER_NOTIFICATION_BURST = 5
+"""
+The number of notifications about the same job or worker-pool which can be
+sent in a row. After that, the notifications are rate-limited to this number
+per :data:`JOB_RUNNER_NOTIFICATION_DIGEST_WINDOW`.
+"""
+
+
+JOB_RUNNER_NOTIFICATION_DIGEST_WINDOW = 60 * 60
+"""
+The window in seconds of the notification rate-limit.
+
+The notifications which are suppressed by the rate-limit are summarized in a
+single digest e-mail, which is sent at the end of the window.
+
+"""
+
+
 JOB_RUNNER_BROADCASTER_PORT = 5556
 """
 The port to which the queue broadcaster is binding to.
@@ -196,6 +239,153 @@ Unless there is a specific need, you can keep the default.
 """
 
 
+JOB_RUNNER_BROADCASTER_HOSTNAME = 'localhost'
+"""
+The hostname of the queue broadcaster.
+
+This is used to notify the queue broadcaster about new runs, returned runs
+and kill-requests.
+
+"""
+
+
+JOB_RUNNER_BROADCASTER_NOTIFY_PORT = 5557
+"""
+The port to which the queue broadcaster is binding to for receiving
+notifications (see :data:`JOB_RUNNER_BROADCASTER_HOSTNAME`).
+
+Unless there is a specific need, you can keep the default.
+
+"""
+
+
+JOB_RUNNER_BROADCASTER_MAX_INTERVAL = 30
+"""
+The maximum interval in seconds between two passes of the queue broadcaster.
+
+Normally the broadcaster wakes up when a run is due or when it gets notified
+about a change. This interval is a safety net for changes the broadcaster
+isn't notified about (eg: enabling enqueue in the admin, or a lost
+notification).
+
+"""
+
+
+JOB_RUNNER_BROADCASTER_RESYNC_INTERVAL = 60 * 5
+"""
+The interval in seconds for re-loading all scheduled runs from the database
+into the in-memory timeline of the queue broadcaster.
+
+In between, the timeline is updated from the notifications the queue
+broadcaster receives.
+
+"""
+
+
+JOB_RUNNER_BROADCASTER_SHARDS = 1
+"""
+The number of queue broadcaster processes (shards).
+
+Each shard is started with ``manage.py broadcast_queue --shard=N/M`` (where
+``M`` is the number of shards) and broadcasts the runs of its own slice of
+the jobs (based on the job id). Shard ``N`` binds to
+:data:`JOB_RUNNER_BROADCASTER_PORT` and
+:data:`JOB_RUNNER_BROADCASTER_NOTIFY_PORT` plus ``2 * (N - 1)``, the workers
+must subscribe to the publish port of every shard.
+
+Every shard only keeps track of its own runs which are broadcasted but not
+picked up yet. The capacity of a worker (its concurrent jobs minus its
+enqueued runs) is therefore split between the shards. A shard can't use
+the share of an other shard, even when that shard has nothing to
+broadcast.
+
+"""
+
+
+JOB_RUNNER_KILL_REQUEST_RESEND_INTERVAL = 60
+"""
+The interval in seconds after which a broadcasted kill-request is broadcasted
+again, in case it has not been executed by the worker.
+"""
+
+
+JOB_RUNNER_WORKER_SELECTOR = (
+    'job_runner.apps.job_runner.broadcaster.LeastLoadedWorkerSelector')
+"""
+The class used by the queue broadcaster to select the worker for a run (in
+case the job doesn't run on all workers). Available options:
+
+``job_runner.apps.job_runner.broadcaster.LeastLoadedWorkerSelector``
+    Select the responsive worker with the least active runs relative to the
+    number of concurrent jobs it reported.
+
+``job_runner.apps.job_runner.broadcaster.RandomWorkerSelector``
+    Select a random responsive worker.
+
+You can implement your own by sub-classing
+:class:`~job_runner.apps.job_runner.broadcaster.WorkerSelector`.
+
+"""
+
+
+JOB_RUNNER_SCHEDULE_HORIZON = None
+"""
+The number of hours for which the runs of periodic jobs are pre-scheduled.
+
+By default (``None``), the queue broadcaster reschedules a job when its
+scheduled run is broadcasted. When set, the runs are pre-scheduled in bulk by
+``manage.py schedule_horizon``, which must be run periodically (eg: every
+hour from cron) and the queue broadcaster doesn't reschedule jobs anymore.
+
+Note that a change of the reschedule interval of a job only applies to the
+runs which are not scheduled yet.
+
+"""
+
+
+JOB_RUNNER_API_KEY_CACHE_TTL = 60
+"""
+The number of seconds the credentials of a worker are cached by the API
+processes.
+
+A saved or deleted worker is removed from the cache of the process handling
+the change. The other processes pick up the change after this interval.
+
+"""
+
+
+JOB_RUNNER_API_KEY_CACHE_SIZE = 1000
+"""
+The max. number of worker credentials cached per API process.
+"""
+
+
+JOB_RUNNER_AUTH_SCOPE_CACHE_TTL = 60
+"""
+The number of seconds the authorization scope (the projects and worker-pools
+a worker or user has access to) is cached by the API processes.
+
+Changes to the projects, worker-pools or groups clear the cache of the process
+handling the change. The other processes pick up the change after this
+interval.
+
+"""
+
+
+JOB_RUNNER_AUTH_SCOPE_CACHE_SIZE = 1000
+"""
+The max. number of authorization scopes (of workers and users) cached per API
+process.
+"""
+
+
+JOB_RUNNER_LAST_COMPLETED_RUN_CACHE_TIMEOUT = 10
+"""
+The number of seconds the response of ``/api/v1/last_completed_run/`` can be
+cached by the client (``Cache-Control: max-age``).
+"""
+
+
 JOB_RUNNER_WS_SERVER_HOSTNAME = 'localhost'
 """
 The hostname of the WebSocket Server.
@@ -237,6 +427,12 @@ unresponsive.
 """
 
 
+JOB_RUNNER_WORKER_PING_RTT_HISTORY = 10
+"""
+The number of ping round-trip times to keep per worker.
+"""
+
+
 HOSTNAME = ''
 """
 The hostname of the server.